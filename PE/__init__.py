@@ -1,4 +1,5 @@
 import os
+import mmap
 import struct
 
 from cStringIO import StringIO
@@ -354,12 +355,21 @@ class PE(object):
         """
         Construct a PE object.  use inmem=True if you are
         using a MemObjFile or other "memory like" image.
+
+        If fd is an mmap.mmap object (see peFromFileName(mapped=True))
+        all reads are served directly from the mapping, and nothing
+        beyond the headers is parsed until it is asked for.
         """
         object.__init__(self)
         self.inmem = inmem
         self.filesize = None
+        self.mmap = None
+
+        if isinstance(fd, mmap.mmap):
+            self.mmap = fd
+            self.filesize = len(fd)
 
-        if not inmem:
+        elif not inmem:
             fd.seek(0, os.SEEK_END)
             self.filesize = fd.tell()
             fd.seek(0)
@@ -393,10 +403,11 @@ class PE(object):
             return ()
         ret = []
         rbytes = self.readAtRva(sec.VirtualAddress, sec.VirtualSize)
-        while len(rbytes):
+        offset = 0
+        while offset < len(rbytes):
             f = vs_pe.IMAGE_RUNTIME_FUNCTION_ENTRY()
-            f.vsParse(rbytes)
-            rbytes = rbytes[len(f):]
+            f.vsParse(rbytes[offset:offset+len(f)])
+            offset += len(f)
             ret.append(f)
         return ret
 
@@ -634,11 +645,13 @@ class PE(object):
         secsize = len(vstruct.getStructure("pe.IMAGE_SECTION_HEADER"))
 
         sbytes = self.readAtOffset(off, secsize * self.IMAGE_NT_HEADERS.FileHeader.NumberOfSections)
-        while sbytes:
+        if not sbytes:
+            return
+
+        for soff in xrange(0, len(sbytes), secsize):
             s = vstruct.getStructure("pe.IMAGE_SECTION_HEADER")
-            s.vsParse(sbytes[:secsize])
+            s.vsParse(sbytes[soff:soff+secsize])
             self.sections.append(s)
-            sbytes = sbytes[secsize:]
 
     def readRvaFormat(self, fmt, rva):
         size = struct.calcsize(fmt)
@@ -650,6 +663,14 @@ class PE(object):
         return self.readAtOffset(offset, size, shortok)
 
     def readAtOffset(self, offset, size, shortok=False):
+        if self.mmap != None:
+            if offset < 0:
+                raise ValueError('negative file offset: %d' % offset)
+            ret = self.mmap[offset:offset+size]
+            if len(ret) != size and not shortok:
+                return None
+            return ret
+
         ret = ""
         self.fd.seek(offset)
         while len(ret) != size:
@@ -703,7 +724,34 @@ class PE(object):
         
         return True
 
+    def readBufferAtOffset(self, offset, size):
+        '''
+        Return a read-only buffer for size bytes at the given file offset.
+
+        For mmap backed PE objects the buffer is a view of the mapping
+        (no bytes are copied until it is sliced or str()'d), otherwise
+        the bytes are read as usual.  Returns None on a short read.
+        '''
+        if self.mmap != None:
+            if offset < 0 or offset + size > self.filesize:
+                return None
+            return buffer(self.mmap, offset, size)
+        return self.readAtOffset(offset, size)
+
+    def readBufferAtRva(self, rva, size):
+        return self.readBufferAtOffset(self.rvaToOffset(rva), size)
+
     def readStringAtRva(self, rva, maxsize=None):
+        if self.mmap != None:
+            offset = self.rvaToOffset(rva)
+            end = self.filesize
+            if maxsize:
+                end = min(end, offset + maxsize)
+            nul = self.mmap.find('\x00', offset, end)
+            if nul == -1:
+                nul = end
+            return self.mmap[offset:nul]
+
         ret = ''
         while True:
             if maxsize and maxsize <= len(ret):
@@ -806,14 +854,18 @@ class PE(object):
             return
         
         reloff = self.rvaToOffset(rva)
-        relbytes = self.readAtOffset(reloff, rsize)
+        relbytes = self.readBufferAtOffset(reloff, rsize)
+        if not relbytes:
+            return
 
-        while relbytes:
+        offset = 0
+        relsize = len(relbytes)
+        while offset < relsize:
             # bounce if we have less than 8 bytes to unpack
-            if len(relbytes) < 8:
+            if relsize - offset < 8:
                 return
 
-            pageva, chunksize = struct.unpack("<II", relbytes[:8])
+            pageva, chunksize = struct.unpack_from("<II", relbytes, offset)
             relcnt = (chunksize - 8) / 2
             
             # if chunksize == 0 bail
@@ -821,15 +873,15 @@ class PE(object):
                 return
 
             # RP BUG FIX - sometimes the chunksize is invalid we do a quick check to make sure we dont overrun the buffer
-            if chunksize > len(relbytes):
+            if chunksize > relsize - offset:
                 return
             
-            rels = struct.unpack("<%dH" % relcnt, relbytes[8:chunksize])
+            rels = struct.unpack_from("<%dH" % relcnt, relbytes, offset + 8)
             for r in rels:
                 rtype = r >> 12
                 roff  = r & 0xfff
                 self.relocations.append((pageva+roff, rtype))
-            relbytes = relbytes[chunksize:]
+            offset += chunksize
 
     def getExportName(self):
         '''
@@ -1115,13 +1167,23 @@ def peFromMemoryObject(memobj, baseaddr):
     fd = MemObjFile(memobj, baseaddr)
     return PE(fd, inmem=True)
 
-def peFromFileName(fname):
+def peFromFileName(fname, mapped=False):
     """
     Utility helper that assures that the file is opened in 
     binary mode which is required for proper functioning.
+
+    Specify mapped=True to parse the file from a read-only mmap
+    (section bodies are then never read unless asked for).
     """
     f = file(fname, "rb")
-    return PE(f)
+    if not mapped:
+        return PE(f)
+
+    try:
+        m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    finally:
+        f.close()
+    return PE(m)
 
 def peFromBytes(fbytes):
     fd = StringIO(fbytes)
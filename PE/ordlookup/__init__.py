@@ -1,37 +1,80 @@
-import mfc42
-import oledlg
-import ws2_32
-import comctl32
-import msvbvm60
-import oleaut32
-
 '''
 A small module for keeping a database of ordinal to symbol
 mappings for DLLs which frequently get linked without symbolic
 infoz.
+
+The ordinal tables are looked up from a prebuilt key db file
+( ordinals.keydb, see PE.ordlookup.builddb ) rather than importing
+each of the (large) table modules.
 '''
+import os
+import sys
+import threading
 
-ords = {
-    'mfc42.dll':mfc42.ord_names,
-    'oledlg.dll':oledlg.ord_names,
-    'ws2_32.dll':ws2_32.ord_names,
-    'wsock32.dll':ws2_32.ord_names,
-    'msvbvm60.dll':msvbvm60.ord_names,
-    'comctl32.dll':comctl32.ord_names,
-    'oleaut32.dll':oleaut32.ord_names,
+# dll name: the table module in this package
+ord_mods = {
+    'mfc42.dll':'mfc42',
+    'oledlg.dll':'oledlg',
+    'ws2_32.dll':'ws2_32',
+    'wsock32.dll':'ws2_32',
+    'msvbvm60.dll':'msvbvm60',
+    'comctl32.dll':'comctl32',
+    'oleaut32.dll':'oleaut32',
 }
 
+ordsdb_path = os.path.join(os.path.dirname(__file__), 'ordinals.keydb')
+
+_ords_db = None
+_ords_lock = threading.Lock()
+
+def getOrdTable(modname):
+    '''
+    Return the ord: name dict from the given table module.
+    '''
+    fullname = 'PE.ordlookup.%s' % modname
+    __import__(fullname)
+    return sys.modules[fullname].ord_names
+
+def buildOrdDb():
+    '''
+    (Re)build the prebuilt ordinal db file from the table modules.
+    '''
+    import envi.keydb as e_keydb
+
+    items = []
+    for modname in set(ord_mods.values()):
+        for ord, name in getOrdTable(modname).items():
+            items.append( ('%s:%d' % (modname, ord), name) )
+
+    e_keydb.writeKeyDb(ordsdb_path, items)
+
+def getOrdDb():
+    '''
+    Return the (shared) prebuilt ordinal db or None if there is no
+    prebuilt db file.
+    '''
+    global _ords_db
+    with _ords_lock:
+        if _ords_db == None and os.path.isfile(ordsdb_path):
+            # ( envi is only imported once PE needs an ordinal name )
+            import envi.keydb as e_keydb
+            _ords_db = e_keydb.KeyDb(ordsdb_path)
+        return _ords_db
+
 def ordLookup(libname, ord):
     '''
     Lookup a name for the given ordinal if it's in our
     database.
     '''
-    names = ords.get(libname.lower())
-    if names == None:
+    modname = ord_mods.get(libname.lower())
+    if modname == None:
         return 'ord%d' % ord
-    name = names.get(ord)
+    db = getOrdDb()
+    if db != None:
+        name = db.get('%s:%d' % (modname, ord))
+    else:
+        name = getOrdTable(modname).get(ord)
+
     if name == None:
         return 'ord%d' % ord
     return name
-
-
@@ -0,0 +1,17 @@
+'''
+Rebuild the prebuilt ordinal db file from the ordinal table modules.
+
+( run this after changing or adding one of the PE.ordlookup tables )
+
+Usage: python -m PE.ordlookup.builddb
+'''
+import sys
+
+import PE.ordlookup as ordlookup
+
+def main(argv):
+    ordlookup.buildOrdDb()
+    print('%s' % ordlookup.ordsdb_path)
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,25 @@
+import unittest
+
+import PE.ordlookup as ordlookup
+
+class OrdLookupTest(unittest.TestCase):
+
+    def test_ordlookup_prebuilt(self):
+        # The prebuilt db must be rebuilt when an ordinal table changes
+        # ( python -m PE.ordlookup.builddb )
+        db = ordlookup.getOrdDb()
+        self.assertTrue(db != None)
+
+        count = 0
+        for modname in set(ordlookup.ord_mods.values()):
+            for ord, name in ordlookup.getOrdTable(modname).items():
+                self.assertEqual(db.get('%s:%d' % (modname, ord)), name)
+                count += 1
+
+        self.assertEqual(len(db), count)
+
+    def test_ordlookup(self):
+        self.assertEqual(ordlookup.ordLookup('WS2_32.dll', 1), 'accept')
+        self.assertEqual(ordlookup.ordLookup('wsock32.dll', 3), 'closesocket')
+        self.assertEqual(ordlookup.ordLookup('ws2_32.dll', 0x7fffffff), 'ord2147483647')
+        self.assertEqual(ordlookup.ordLookup('woot.dll', 3), 'ord3')
@@ -17,7 +17,6 @@ import types
 import Queue
 import socket
 import struct
-import urllib2
 import traceback
 try:
     import msgpack
@@ -54,6 +53,15 @@ COBRA_GOODBYE   = 5
 COBRA_AUTH      = 6
 COBRA_NEWOBJ    = 7 # Used to return object references
 
+# Message Flags ( or'd into the message type )
+MFLAG_SEQ       = 0x0100    # The top 16 bits are a sequence id
+MFLAG_RAW       = 0x0200    # The data is a raw (not serialized) str
+MFLAG_OOB       = 0x0400    # Large str call args follow the data
+MTYPE_MASK      = 0x00ff
+
+# str call args at least this big are sent out-of-band (unserialized)
+oob_minsize = 0x1000
+
 SFLAG_MSGPACK   = 0x0001
 SFLAG_JSON      = 0x0002
 
@@ -193,6 +201,13 @@ class CobraSocket:
         self.dumps = pickledumps
         self.loads = pickle.loads
 
+        # Sequence ids of the last received message and of the reply
+        # being sent ( servers answer with the caller's sequence id )
+        self.recvseq = None
+        self.replyseq = None
+
+        self._setNoDelay()
+
         if sflags & SFLAG_MSGPACK:
             if not msgpack:
                 raise Exception('Missing "msgpack" python module ( http://visi.kenshoto.com/viki/Msgpack )')
@@ -210,30 +225,86 @@ class CobraSocket:
             self.dumps = jsondumps
             self.loads = jsonloads
 
+    def _setNoDelay(self):
+        # Pipelined messages should not wait on Nagle
+        try:
+            self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        except Exception, e:
+            pass
+
     def getSockName(self):
         return self.socket.getsockname()
 
     def getPeerName(self):
         return self.socket.getpeername()
 
-    def sendMessage(self, mtype, objname, data):
+    def sendMessage(self, mtype, objname, data, seq=None, oob=True):
         """
         Send message is responsable for transmission of cobra messages,
         and socket reconnection in the event that the send fails for network
         reasons.
+
+        Messages with a sequence id (seq) may be pipelined, and unless oob
+        is False, their str data and large str call args are sent as-is
+        rather than serialized.
         """
 
         #NOTE: for errors while using msgpack, we must send only the str
         if mtype == COBRA_ERROR and self.sflags & (SFLAG_MSGPACK | SFLAG_JSON):
             data = str(data)
 
-        try:
-            buf = self.dumps(data)
-        except Exception, e:
-            raise CobraPickleException("The arguments/attributes must be serializable: %s" % e)
+        if seq == None:
+            seq = self.replyseq
+
+        blobs = ()
+        if seq != None:
+            mtype |= MFLAG_SEQ | (seq << 16)
+            if oob and type(data) == str:
+                mtype |= MFLAG_RAW
+
+            # ( replies to calls are also COBRA_CALL messages )
+            elif oob and mtype & MTYPE_MASK == COBRA_CALL and self.replyseq == None:
+                data, blobs = self._getOobArgs(data)
+                if blobs:
+                    mtype |= MFLAG_OOB
+
+        if mtype & MFLAG_RAW:
+            buf = data
+        else:
+            try:
+                buf = self.dumps(data)
+            except Exception, e:
+                raise CobraPickleException("The arguments/attributes must be serializable: %s" % e)
 
         objname = toUtf8(objname)
-        self.sendExact(struct.pack("<III", mtype, len(objname), len(buf)) + objname + buf)
+        hdr = struct.pack("<III", mtype, len(objname), len(buf)) + objname
+        # Only copy small messages into one buffer
+        if len(buf) < oob_minsize:
+            self.sendExact(hdr + buf)
+        else:
+            self.sendExact(hdr)
+            self.sendExact(buf)
+
+        for blob in blobs:
+            self.sendExact(blob)
+
+    def _getOobArgs(self, data):
+        # Pull large str args out of a call to be sent unserialized
+        methname, args, kwargs = data
+
+        blobs = []
+        oobidx = []
+        args = list(args)
+        for i, arg in enumerate(args):
+            if type(arg) == str and len(arg) >= oob_minsize:
+                oobidx.append(i)
+                blobs.append(arg)
+                args[i] = len(arg)
+
+        if not blobs:
+            return data, ()
+
+        return (methname, args, kwargs, oobidx), blobs
 
     def recvMessage(self):
         """
@@ -247,7 +318,25 @@ class CobraSocket:
         hdr = self.recvExact(12)
         mtype, nsize, dsize = struct.unpack("<III", hdr)
         name = self.recvExact(nsize)
-        data = self.loads(self.recvExact(dsize))
+        buf = self.recvExact(dsize)
+
+        self.recvseq = None
+        if mtype & MFLAG_SEQ:
+            self.recvseq = mtype >> 16
+
+        if mtype & MFLAG_RAW:
+            data = buf
+        else:
+            data = self.loads(buf)
+
+        if mtype & MFLAG_OOB:
+            methname, args, kwargs, oobidx = data
+            args = list(args)
+            for i in oobidx:
+                args[i] = self.recvExact(args[i])
+            data = (methname, args, kwargs)
+
+        mtype &= MTYPE_MASK
 
         #NOTE: for errors while using msgpack, we must send only the str
         if mtype == COBRA_ERROR and self.sflags & (SFLAG_MSGPACK | SFLAG_JSON):
@@ -256,14 +345,28 @@ class CobraSocket:
         return (mtype, name, data)
 
     def recvExact(self, size):
-        buf = ""
         s = self.socket
-        while len(buf) != size:
-            x = s.recv(size - len(buf))
-            if len(x) == 0:
+        if size == 0:
+            return ''
+
+        x = s.recv(size)
+        if len(x) == size:
+            return x
+
+        if len(x) == 0:
+            raise CobraClosedException("Socket closed in recvExact...")
+
+        # Receive the rest in place rather than re-building a string
+        buf = bytearray(size)
+        buf[:len(x)] = x
+        view = memoryview(buf)
+        offset = len(x)
+        while offset != size:
+            rlen = s.recv_into(view[offset:], size - offset)
+            if rlen == 0:
                 raise CobraClosedException("Socket closed in recvExact...")
-            buf += x
-        return buf
+            offset += rlen
+        return str(buf)
 
     def sendExact(self, buf):
         self.socket.sendall(buf)
@@ -337,6 +440,7 @@ class SocketBuilder:
 class CobraAsyncTrans:
 
     def __init__(self, csock, mtype, objname, data):
+        self.seq = None
         self.data = data
         self.csock = csock
         self.mtype = mtype
@@ -351,6 +455,11 @@ class CobraAsyncTrans:
         a sendMessage() automagically on recpt of an exception
         in recvMessage()
         """
+        # Many async calls may be in flight on a pipelined socket
+        if self.csock.pipeline:
+            self.seq = self.csock.cobraPipelineSend(self.mtype, self.objname, self.data)
+            return
+
         while True:
             try:
                 self.csock.sendMessage(self.mtype, self.objname, self.data)
@@ -362,6 +471,12 @@ class CobraAsyncTrans:
 
     def wait(self):
         try:
+            if self.seq != None:
+                mtype,name,data = self.csock.cobraPipelineRecv(self.seq)
+                if mtype == COBRA_CALL:
+                    return data
+                raise data
+
             while True:
                 try:
                     mtype,name,data = self.csock.recvMessage()
@@ -383,7 +498,7 @@ class CobraAsyncTrans:
 
 class CobraClientSocket(CobraSocket):
 
-    def __init__(self, sockctor, retrymax=cobra_retrymax, sflags=0, authinfo=None, pool=None):
+    def __init__(self, sockctor, retrymax=cobra_retrymax, sflags=0, authinfo=None, pool=None, pipeline=None):
         CobraSocket.__init__(self, sockctor(), sflags=sflags)
         self.sockctor = sockctor
         self.retries = 0
@@ -392,6 +507,12 @@ class CobraClientSocket(CobraSocket):
         self.authinfo = authinfo
         self.pool     = pool
 
+        # pipeline is None until we know if the server takes sequence ids
+        self.pipeline = pipeline
+        self.nextseq = 0
+        self.inflight = {}  # seq: (mtype, objname, data)
+        self.replies = {}   # seq: (mtype, name, data)
+
     def __enter__(self):
         return self 
 
@@ -408,6 +529,7 @@ class CobraClientSocket(CobraSocket):
             try:
 
                 self.socket = self.sockctor()
+                self._setNoDelay()
 
                 # A bit messy but... a fix for now...
                 # If we have authinfo lets authenticate
@@ -441,6 +563,10 @@ class CobraClientSocket(CobraSocket):
         a sendMessage() automagically on recpt of an exception
         in recvMessage()
         """
+        if self.pipeline != False and mtype != COBRA_AUTH:
+            seq = self.cobraPipelineSend(mtype, objname, data)
+            return self.cobraPipelineRecv(seq)
+
         while True:
             try:
                 self.sendMessage(mtype, objname, data)
@@ -455,6 +581,70 @@ class CobraClientSocket(CobraSocket):
             except socket.error, e:
                 self.reConnect()
 
+    def cobraPipelineSend(self, mtype, objname, data):
+        '''
+        Send a request tagged with a sequence id and return the id
+        ( without waiting for the reply, see cobraPipelineRecv ).
+        '''
+        seq = self.nextseq
+        self.nextseq = (seq + 1) & 0xffff
+        self.inflight[seq] = (mtype, objname, data)
+
+        try:
+            self.sendMessage(mtype, objname, data, seq=seq, oob=self.pipeline)
+
+        except CobraAuthException, e:
+            raise
+
+        except (socket.error, CobraClosedException), e:
+            # Reconnecting re-sends everything in flight
+            self._pipelineReConnect()
+
+        return seq
+
+    def cobraPipelineRecv(self, seq):
+        '''
+        Return the (mtype, name, data) reply for the given sequence id
+        ( saving replies to other in flight requests along the way ).
+        '''
+        while seq not in self.replies:
+            try:
+                mtype, name, data = self.recvMessage()
+
+            except CobraAuthException, e:
+                raise
+
+            except (socket.error, CobraClosedException), e:
+                self._pipelineReConnect()
+                continue
+
+            rseq = self.recvseq
+            if rseq == None:
+                if self.pipeline != None:
+                    raise CobraException('Untagged reply on a pipelined socket!')
+
+                # An older server which does not know sequence ids
+                self.pipeline = False
+                mtype, objname, data = self.inflight.pop(seq)
+                return self.cobraTransaction(mtype, objname, data)
+
+            self.pipeline = True
+            if self.inflight.pop(rseq, None) != None:
+                self.replies[rseq] = (mtype, name, data)
+
+        return self.replies.pop(seq)
+
+    def _pipelineReConnect(self):
+        while True:
+            self.reConnect()
+            try:
+                for seq, (mtype, objname, data) in sorted(self.inflight.items()):
+                    self.sendMessage(mtype, objname, data, seq=seq, oob=self.pipeline)
+                return
+
+            except (socket.error, CobraClosedException), e:
+                continue
+
 class CobraDaemon(ThreadingTCPServer):
 
     def __init__(self, host="", port=COBRA_PORT, sslcrt=None, sslkey=None, sslca=None, msgpack=False, json=False):
@@ -757,6 +947,9 @@ class CobraConnectionHandler:
                 if verbose: traceback.print_exc()
                 break
 
+            # Replies carry the sequence id of a pipelined request
+            csock.replyseq = csock.recvseq
+
             # If they re-auth ( app layer ) later, lets handle it...
             if mtype == COBRA_AUTH and self.daemon.authmod:
                 authuser = self.daemon.authmod.authCobraUser(data)
@@ -875,6 +1068,7 @@ class CobraConnectionHandler:
             pass
 
 def isCobraUri(uri):
+    import urllib2
     try:
         x = urllib2.Request(uri)
         if x.get_type() not in ["cobra","cobrassl"]:
@@ -884,6 +1078,7 @@ def isCobraUri(uri):
     return True
 
 def chopCobraUri(uri):
+    import urllib2
 
     req = urllib2.Request(uri)
     scheme = req.get_type()
@@ -924,10 +1119,12 @@ class CobraProxy:
                       ( but it can be auth module specific )
         msgpack     - Use msgpack serialization
         sockpool    - Fixed sized pool of cobra sockets (not socket per thread) 
+        pipeline    - Set to False to disable pipelined (sequenced) requests
 
     Also, the following protocol options may be passed through the URI:
 
     msgpack=1
+    pipeline=0
     authinfo=<base64( json( <authinfo dict> ))>
     '''
 
@@ -950,6 +1147,12 @@ class CobraProxy:
         self._cobra_sflags = 0
         self._cobra_spoolcnt = int(urlparams.get('sockpool', 0))
         self._cobra_sockpool = None 
+        self._cobra_pipeline = None
+
+        # Sockets are shared by proxies (per-thread), but not across modes
+        if not int(urlparams.get('pipeline', kwargs.get('pipeline', 1))):
+            self._cobra_pipeline = False
+            self._cobra_slookup = (host,port,'nopipeline')
 
         if self._cobra_timeout != None:
             self._cobra_timeout = int(self._cobra_timeout)
@@ -1006,6 +1209,8 @@ class CobraProxy:
                 csock.trashed = True
                 raise Exception("Invalid Cobra Hello Response")
 
+            self._cobra_pipeline = csock.pipeline
+
         self._cobra_gothello = True
         self._cobra_methods = data
 
@@ -1066,7 +1271,7 @@ class CobraProxy:
             addSocketBuilder(host, port, builder)
 
         authinfo = self._cobra_kwargs.get('authinfo') 
-        return CobraClientSocket(builder, retrymax=retrymax, sflags=self._cobra_sflags, authinfo=authinfo, pool=self._cobra_sockpool)
+        return CobraClientSocket(builder, retrymax=retrymax, sflags=self._cobra_sflags, authinfo=authinfo, pool=self._cobra_sockpool, pipeline=self._cobra_pipeline)
 
     def __dir__(self):
         '''
@@ -0,0 +1,51 @@
+import unittest
+
+import cobra
+
+class PipeObject:
+
+    def __init__(self):
+        self.calls = 0
+
+    def getBytes(self, size):
+        self.calls += 1
+        return 'A' * size
+
+    def getLen(self, bytez, x, y=None):
+        self.calls += 1
+        return (len(bytez), bytez[:4], x, y)
+
+    def raiseError(self):
+        raise Exception('woot')
+
+class CobraPipelineTest(unittest.TestCase):
+
+    def getProxy(self, **kwargs):
+        daemon = cobra.CobraDaemon(port=0)
+        objname = daemon.shareObject( PipeObject() )
+        daemon.fireThread()
+        self.addCleanup(daemon.stopServer)
+        return cobra.CobraProxy('cobra://localhost:%d/%s' % (daemon.port, objname), **kwargs)
+
+    def checkProxy(self, t):
+        big = 'B' * 0x100000
+        self.assertEqual(t.getBytes(0x200000), 'A' * 0x200000)
+        self.assertEqual(t.getLen(big, 3, y='woot'), (0x100000, 'BBBB', 3, 'woot'))
+        self.assertRaises(Exception, t.raiseError)
+
+    def test_cobra_pipeline(self):
+        t = self.getProxy()
+        self.assertTrue(t._cobra_pipeline)
+        self.checkProxy(t)
+
+        # Many calls in flight ( waited on in any order )
+        waiters = [ t.getBytes(i, _cobra_async=True) for i in xrange(20) ]
+        # A synchronous call while async calls are in flight
+        self.assertEqual(t.getBytes(3), 'AAA')
+        self.assertEqual([ w.wait() for w in reversed(waiters) ], [ 'A' * i for i in xrange(19, -1, -1) ])
+        self.assertEqual(t.calls, 23)
+
+    def test_cobra_nopipeline(self):
+        t = self.getProxy(pipeline=False)
+        self.assertFalse(t._cobra_pipeline)
+        self.checkProxy(t)
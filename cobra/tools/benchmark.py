@@ -0,0 +1,94 @@
+'''
+Benchmark cobra calls over loopback with and without pipelining.
+
+Usage: python -m cobra.tools.benchmark [options]
+'''
+import sys
+import time
+import optparse
+import multiprocessing
+
+import cobra
+
+class BenchObject:
+
+    def ping(self):
+        return None
+
+    def readMemory(self, va, size):
+        return '\x90' * size
+
+    def writeMemory(self, va, bytez):
+        return len(bytez)
+
+def runServer(port, ready):
+    daemon = cobra.CobraDaemon(host='127.0.0.1', port=port)
+    daemon.shareObject(BenchObject(), 'bench')
+    ready.set()
+    daemon.serve_forever()
+
+def timeit(name, count, func):
+    start = time.time()
+    func()
+    delta = time.time() - start
+    print('    %-28s %8.3f sec  %10.1f/sec' % (name, delta, count / delta))
+
+def runBench(port, pipeline, opts):
+    uri = 'cobra://127.0.0.1:%d/bench?pipeline=%d' % (port, int(pipeline))
+    proxy = cobra.CobraProxy(uri)
+    print('pipeline=%s' % (proxy._cobra_pipeline,))
+
+    def pings():
+        for i in xrange(opts.calls):
+            proxy.ping()
+
+    def smallreads():
+        for i in xrange(opts.calls):
+            proxy.readMemory(0x41410000, 16)
+
+    def asyncreads():
+        waiters = []
+        for i in xrange(opts.calls):
+            waiters.append( proxy.readMemory(0x41410000, 16, _cobra_async=True) )
+            if len(waiters) >= opts.depth:
+                waiters.pop(0).wait()
+        [ w.wait() for w in waiters ]
+
+    bigbytes = '\xcc' * opts.bigsize
+    def bigreads():
+        for i in xrange(opts.bigcalls):
+            proxy.readMemory(0x41410000, opts.bigsize)
+
+    def bigwrites():
+        for i in xrange(opts.bigcalls):
+            proxy.writeMemory(0x41410000, bigbytes)
+
+    timeit('ping', opts.calls, pings)
+    timeit('readMemory(16)', opts.calls, smallreads)
+    timeit('async readMemory(16)', opts.calls, asyncreads)
+    timeit('readMemory(%d)' % opts.bigsize, opts.bigcalls, bigreads)
+    timeit('writeMemory(%d)' % opts.bigsize, opts.bigcalls, bigwrites)
+
+def main(argv):
+    parser = optparse.OptionParser(usage=__doc__.strip())
+    parser.add_option('--port', dest='port', type='int', default=cobra.COBRA_PORT + 100)
+    parser.add_option('--calls', dest='calls', type='int', default=10000)
+    parser.add_option('--depth', dest='depth', type='int', default=32, help='async calls in flight')
+    parser.add_option('--bigsize', dest='bigsize', type='int', default=0x400000)
+    parser.add_option('--bigcalls', dest='bigcalls', type='int', default=50)
+    opts, args = parser.parse_args(argv)
+
+    ready = multiprocessing.Event()
+    server = multiprocessing.Process(target=runServer, args=(opts.port, ready))
+    server.daemon = True
+    server.start()
+    ready.wait()
+
+    try:
+        runBench(opts.port, False, opts)
+        runBench(opts.port, True, opts)
+    finally:
+        server.terminate()
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -5,7 +5,6 @@ ArchitectureModule, Opcode, Operand, and Emulator objects.
 
 import types
 import struct
-import platform
 
 # TODO: move into const.py
 # Parsed Opcode Formats
@@ -64,6 +63,7 @@ from envi.const import *
 import envi.bits as e_bits
 import envi.memory as e_mem
 import envi.registers as e_reg
+import envi.transcache as e_tcache
 import envi.memcanvas as e_canvas
 
 class ArchitectureModule:
@@ -519,7 +519,7 @@ class Opcode:
     def getOperands(self):
         return list(self.opers)
 
-class Emulator(e_reg.RegisterContext, e_mem.MemoryObject):
+class Emulator(e_reg.RegisterContext, e_mem.PagedMemoryObject):
     """
     The Emulator class is mostly "Abstract" in the java
     Interface sense.  The emulator should be able to
@@ -535,7 +535,7 @@ class Emulator(e_reg.RegisterContext, e_mem.MemoryObject):
     """
     def __init__(self, archmod=None):
 
-        e_mem.MemoryObject.__init__(self, arch=archmod._arch_id)
+        e_mem.PagedMemoryObject.__init__(self, arch=archmod._arch_id)
         e_reg.RegisterContext.__init__(self)
 
         self._emu_segments = [ (0, 0xffffffff), ]
@@ -551,6 +551,16 @@ class Emulator(e_reg.RegisterContext, e_mem.MemoryObject):
             if name.startswith("i_"):
                 self.op_methods[name[2:]] = getattr(self, name)
 
+        # Opcodes decoded from the original map bytes, and the (absolute)
+        # page indexes we have written to (and so may not use them for)
+        self._emu_tcache = e_tcache.TranslationCache()
+        self._emu_dirty = set()
+
+        # An (optional) OpcodeCache shared with whoever owns the memory
+        # our maps were built from ( and its generation at the time )
+        self._emu_opcache = None
+        self._emu_opgen = None
+
     def initEmuOpt(self, opt, defval, doc):
         '''
         Initialize an emulator option used by the emulator type.
@@ -595,6 +605,122 @@ class Emulator(e_reg.RegisterContext, e_mem.MemoryObject):
         self.setRegisterSnap(regs)
         self.setMemorySnap(mem)
 
+    def setMemorySnap(self, snap):
+        e_mem.PagedMemoryObject.setMemorySnap(self, snap)
+
+        # The snapshot may be from another emulator...
+        shift = self._mem_pageshift
+        psize = self._mem_pagesize
+        for mdef in self._map_defs:
+            for pidx in mdef[4]:
+                pva = mdef[0] + (pidx << shift)
+                self._emu_dirty.add(pva >> shift)
+                self._emu_dirty.add((pva + psize - 1) >> shift)
+
+    def writeMemory(self, va, bytez):
+        # Mark the pages dirty first (a write may fault part way)
+        shift = self._mem_pageshift
+        dirty = self._emu_dirty
+        pidx = va >> shift
+        lidx = (va + len(bytez) - 1) >> shift
+        if pidx not in dirty or lidx not in dirty:
+            dirty.update(xrange(pidx, lidx + 1))
+
+        e_mem.PagedMemoryObject.writeMemory(self, va, bytez)
+
+    def parseOpcode(self, va, arch=ARCH_DEFAULT):
+        '''
+        Parse an opcode from the specified virtual address (using the
+        translation cache unless we have written to the memory at va).
+        '''
+        if arch == ARCH_DEFAULT:
+            dirty = self._emu_dirty
+            shift = self._mem_pageshift
+            if (va >> shift) not in dirty and ((va + e_tcache.OPCODE_WINDOW - 1) >> shift) not in dirty:
+                op = self._emu_tcache.getOpcode(va)
+                if op == None:
+                    op = self.translateBlock(va)
+                if op != None:
+                    return op
+
+        return e_mem.PagedMemoryObject.parseOpcode(self, va, arch)
+
+    def setOpcodeCache(self, opcache):
+        '''
+        Share decoded opcodes with an envi.transcache.OpcodeCache.  The
+        cache must currently describe the same bytes as this emulator's
+        memory maps ( it is no longer used once the cache is cleared ).
+        '''
+        self._emu_opcache = opcache
+        self._emu_opgen = opcache.generation
+
+    def _parseTransOpcode(self, arch, bytez, va):
+        # Decode a translated opcode (using the shared opcode cache)
+        opcache = self._emu_opcache
+        if opcache == None or opcache.generation != self._emu_opgen:
+            return arch.archParseOpcode(bytez, 0, va)
+
+        archname = arch.getArchName()
+        op = opcache.getOpcode(va, archname)
+        if op is None:
+            op = arch.archParseOpcode(bytez, 0, va)
+            opcache.addOpcode(va, archname, op, gen=self._emu_opgen)
+        return op
+
+    def _getTransBytes(self, va):
+        # Return the original map bytes to decode an opcode at va from
+        # (or None if it may not be translated)
+        mdef = self._getMapDef(va)
+        if mdef == None or va + e_tcache.OPCODE_WINDOW > mdef[1]:
+            return None
+
+        if not mdef[2][2] & e_mem.MM_READ:
+            return None
+
+        shift = self._mem_pageshift
+        off = va - mdef[0]
+        pages = mdef[4]
+        if pages and ((off >> shift) in pages or ((off + e_tcache.OPCODE_WINDOW - 1) >> shift) in pages):
+            return None
+
+        return mdef[3][off:off+e_tcache.OPCODE_WINDOW]
+
+    def translateBlock(self, va):
+        '''
+        Decode the straight line block of instructions beginning at va
+        into the translation cache.  Returns the opcode at va (or None if
+        the memory at va may not be translated).
+        '''
+        tcache = self._emu_tcache
+        arch = self.imem_archs[0]
+
+        bytez = self._getTransBytes(va)
+        if bytez == None:
+            return None
+
+        op = self._parseTransOpcode(arch, bytez, va)
+        ops = [ op ]
+
+        while len(ops) < tcache.maxblock and not op.iflags & e_tcache.BLOCK_END_FLAGS:
+            va += len(op)
+            if not len(op) or tcache.getOpcode(va) != None:
+                break
+
+            bytez = self._getTransBytes(va)
+            if bytez == None:
+                break
+
+            # Let the (unlikely) executed one raise later...
+            try:
+                op = self._parseTransOpcode(arch, bytez, va)
+            except Exception:
+                break
+
+            ops.append(op)
+
+        tcache.addBlock(ops)
+        return ops[0]
+
     def executeOpcode(self, opobj):
         """
         This is the core method for the 
@@ -1244,6 +1370,8 @@ def getCurrentArch():
     """
     Return an envi normalized name for the current arch.
     """
+    import platform
+
     width = struct.calcsize("P")
     mach = platform.machine()   # 'i386','ppc', etc...
 
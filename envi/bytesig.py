@@ -5,6 +5,10 @@ sequences (and potential comparison masks) for general purpose
 signature matching.
 
 Currently used by vivisect function entry sig db and others.
+
+The SignatureTree answers "which signature is at this offset?" while the
+SignatureScanner finds every signature match in a whole buffer in one
+linear pass.
 """
 
 class SignatureTree:
@@ -24,6 +28,7 @@ class SignatureTree:
     def __init__(self):
         self.basenode = (0, [], [None] * 256)
         self.sigs = {} # track duplicates
+        self._scanner = None
 
     def _addChoice(self, siginfo, node):
 
@@ -84,6 +89,7 @@ class SignatureTree:
             return
 
         self.sigs[bytekey] = True
+        self._scanner = None
 
         byteord = [ord(c) for c in bytes]
         maskord = [ord(c) for c in masks]
@@ -91,6 +97,30 @@ class SignatureTree:
         siginfo = (byteord, maskord, val)
         self._addChoice(siginfo, self.basenode)
 
+    def getScanner(self):
+        """
+        Return a SignatureScanner for the signatures in this tree.
+        """
+        if self._scanner == None:
+            scanner = SignatureScanner()
+            # The base node has every sig (in the order they were added)
+            for sbytes, smasks, sobj in self.basenode[1]:
+                bytes = ''.join([ chr(b) for b in sbytes ])
+                masks = ''.join([ chr(m) for m in smasks ])
+                scanner.addSignature(bytes, masks=masks, val=sobj)
+            self._scanner = scanner
+
+        return self._scanner
+
+    def scanSignatures(self, bytes, offset=0, size=None):
+        """
+        Yield an (offset, val) tuple for every signature match which
+        starts in bytes[offset:offset+size] (in offset order).
+
+        See SignatureScanner.scan() for details.
+        """
+        return self.getScanner().scan(bytes, offset=offset, size=size)
+
     def isSignature(self, bytes, offset=0):
         return self.getSignature(bytes, offset=offset) != None
 
@@ -123,3 +153,187 @@ class SignatureTree:
             # We failed to make our next choice
             if node == None:
                 return None
+
+class SignatureScanner:
+    """
+    A compiled multi-pattern matcher for byte/mask signatures which scans
+    a whole buffer in one pass (rather than walking a SignatureTree at
+    each offset).
+
+    Each signature is "anchored" on its longest run of unmasked (0xff)
+    bytes.  The anchors are compiled into an Aho-Corasick automaton ( as
+    a flat 256 way transition table ) and each anchor hit is then checked
+    against the rest of the signature's bytes and masks.  Signatures
+    without any unmasked bytes are checked at every offset.
+
+    Example:
+        scanner = SignatureScanner()
+        scanner.addSignature('\\x55\\x8b\\xec', val='push ebp; mov ebp,esp')
+        for offset, val in scanner.scan(bytes):
+            print('0x%.8x %s' % (offset, val))
+    """
+
+    def __init__(self):
+        self.sigs = [] # (bytes, masks, val) in the order they were added
+        self.sigkeys = {} # track duplicates
+        self._sc_trans = None
+
+    def addSignature(self, bytes, masks=None, val=None):
+        """
+        Add a signature to the scanner.  The bytes, masks and val are the
+        same as for SignatureTree.addSignature().
+        """
+        if masks == None:
+            masks = "\xff" * len(bytes)
+
+        if val == None:
+            val = True
+
+        if len(masks) != len(bytes):
+            raise Exception('Signature bytes and masks are different lengths!')
+
+        bytekey = bytes + masks
+        if self.sigkeys.get(bytekey) != None:
+            return
+
+        self.sigkeys[bytekey] = True
+        self.sigs.append( (bytes, masks, val) )
+        self._sc_trans = None
+
+    def _getAnchor(self, masks):
+        # Return (offset, size) of the longest run of unmasked bytes
+        best = (0, 0)
+        start = None
+        for i, m in enumerate(masks + '\x00'):
+            if m == '\xff':
+                if start == None:
+                    start = i
+                continue
+
+            if start != None and i - start > best[1]:
+                best = (start, i - start)
+            start = None
+
+        return best
+
+    def _compile(self):
+        # The goto trie of anchors and the (sigidx, back) anchor ends
+        # ( back is from the last anchor byte to the signature start )
+        gotos = [ {} ]
+        outs = [ [] ]
+        self._sc_nonanchored = []
+        self._sc_checks = []
+
+        for sigidx, (bytes, masks, val) in enumerate(self.sigs):
+            aoff, asize = self._getAnchor(masks)
+
+            # The bytes which the anchor doesn't cover (and are not
+            # completely masked) must be checked for each hit
+            checks = []
+            for i in xrange(len(bytes)):
+                if aoff <= i < aoff + asize:
+                    continue
+                m = ord(masks[i])
+                if m:
+                    checks.append( (i, m, ord(bytes[i])) )
+            self._sc_checks.append( (len(bytes), tuple(checks), val) )
+
+            if not asize:
+                self._sc_nonanchored.append(sigidx)
+                continue
+
+            state = 0
+            for c in bytes[aoff:aoff+asize]:
+                b = ord(c)
+                nstate = gotos[state].get(b)
+                if nstate == None:
+                    nstate = len(gotos)
+                    gotos.append( {} )
+                    outs.append( [] )
+                    gotos[state][b] = nstate
+                state = nstate
+
+            outs[state].append( (sigidx, aoff + asize - 1) )
+
+        # Build the fail links breadth first and flatten the automaton
+        # into a DFA transition table trans[ (state << 8) | byte ]
+        nstates = len(gotos)
+        trans = [ 0 ] * (nstates * 256)
+        fails = [ 0 ] * nstates
+
+        todo = []
+        for b, nstate in gotos[0].items():
+            trans[b] = nstate
+            todo.append(nstate)
+
+        while todo:
+            ntodo = []
+            for state in todo:
+                fbase = fails[state] << 8
+                sbase = state << 8
+                for b in xrange(256):
+                    nstate = gotos[state].get(b)
+                    if nstate == None:
+                        trans[sbase | b] = trans[fbase | b]
+                        continue
+
+                    trans[sbase | b] = nstate
+                    fails[nstate] = trans[fbase | b]
+                    outs[nstate].extend( outs[ fails[nstate] ] )
+                    ntodo.append(nstate)
+
+            todo = ntodo
+
+        self._sc_outs = [ tuple(o) or None for o in outs ]
+        self._sc_trans = trans
+
+    def _checkSig(self, bytes, offset, sigidx):
+        siglen, checks, val = self._sc_checks[sigidx]
+        for i, m, b in checks:
+            if ord(bytes[offset + i]) & m != b:
+                return False
+        return True
+
+    def scan(self, bytes, offset=0, size=None):
+        """
+        Yield an (offset, val) tuple for every signature match which
+        starts in bytes[offset:offset+size] (in offset order and then
+        the order the signatures were added).
+
+        NOTE: the whole signature must be within bytes[offset:offset+size]
+        """
+        if self._sc_trans == None:
+            self._compile()
+
+        if size == None:
+            size = len(bytes) - offset
+
+        endoff = offset + size
+
+        trans = self._sc_trans
+        outs = self._sc_outs
+        checks = self._sc_checks
+
+        matches = []
+        state = 0
+        i = offset
+        for b in bytearray(buffer(bytes, offset, size)):
+            state = trans[(state << 8) | b]
+            if outs[state] != None:
+                for sigidx, back in outs[state]:
+                    start = i - back
+                    if start < offset or start + checks[sigidx][0] > endoff:
+                        continue
+                    if self._checkSig(bytes, start, sigidx):
+                        matches.append( (start, sigidx) )
+            i += 1
+
+        for sigidx in self._sc_nonanchored:
+            siglen = checks[sigidx][0]
+            for start in xrange(offset, endoff - siglen + 1):
+                if self._checkSig(bytes, start, sigidx):
+                    matches.append( (start, sigidx) )
+
+        matches.sort()
+        for start, sigidx in matches:
+            yield start, checks[sigidx][2]
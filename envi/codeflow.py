@@ -42,7 +42,7 @@ class CodeFlowContext(object):
 
         self._cf_recurse = recurse
         self._cf_exptable = exptable
-        self._cf_blocks = [] 
+        self._cf_blocks = {}    # va: count of active code flows from va
         self._dynamic_branch_handlers = []
 
 
@@ -53,6 +53,14 @@ class CodeFlowContext(object):
         '''
         return branches
 
+    def _cb_opdone(self, va):
+        '''
+        Extend CodeFlowContext and implement this method to return True
+        for an address whose opcode was already handled ( by a previous
+        code flow ) so it is not decoded again.
+        '''
+        return False
+
     def _cb_function(self, fva, fmeta):
         '''
         Extend CodeFlowContext and implement this method to recieve
@@ -128,54 +136,115 @@ class CodeFlowContext(object):
 
         Set persist=True to store 'opdone' and never disassemble the same thing twice
         '''
+        return self._runCodeFlow(va, arch)
+
+    def addEntryPoint(self, va, arch=envi.ARCH_DEFAULT):
+        '''
+        Analyze the given procedure entry point and flow downward
+        to find all subsequent code blocks and procedure edges.
+
+        Example:
+            cf.addEntryPoint( 0x77c70308 )
+            ... callbacks flow along ...
+        '''
+        # Check if this is already a known function.
+        if self._funcs.get(va) != None:
+            return
+
+        # Add this function to known functions
+        self._funcs[va] = True
+        self._runCodeFlow(va, arch, isentry=True)
+
+    def _runCodeFlow(self, va, arch, isentry=False):
+        '''
+        Run the code flow for va (and every entry point discovered along
+        the way) from an explicit stack of flows rather than by recursion.
+        '''
+        calls_from = {}
+        flows = [ (va, calls_from, self._iterCodeFlow(va, arch, calls_from), isentry), ]
+        while flows:
+
+            fva, fcalls, flow, fentry = flows[-1]
+
+            try:
+                epva, eparch = flow.next()
+            except StopIteration:
+                flows.pop()
+                if fentry:
+                    fcalls = fcalls.keys()
+                    self._fcalls[fva] = fcalls
+
+                    # Finally, notify the callback of a new function
+                    self._cb_function(fva, {'CallsFrom':fcalls})
+                continue
+
+            # The flow found an entry point which must be done first
+            if self._funcs.get(epva) != None:
+                continue
+
+            self._funcs[epva] = True
+            epcalls = {}
+            flows.append( (epva, epcalls, self._iterCodeFlow(epva, eparch, epcalls), True) )
+
+        return calls_from.keys()
+
+    def _iterCodeFlow(self, va, arch, calls_from):
+        '''
+        A generator which does the code flow for a single address (filling
+        in calls_from) and yields the (va, arch) of each entry point which
+        should be analyzed (before resuming) along the way.
+        '''
         opdone = {}
         if self._cf_persist != None:
             opdone = self._cf_persist
 
-        calls_from = {}
         optodo = [ ((0, va), arch), ]
         startva = va
-        self._cf_blocks.append( va )
         cf_eps = set()
-        while len(optodo):
 
-            todo,arch = optodo.pop()
+        # add block as part of our call stack
+        blocks = self._cf_blocks
+        blocks[startva] = blocks.get(startva, 0) + 1
+        try:
+            while len(optodo):
 
-            if self._cf_noflow.get( todo ):
-                self._cb_noflow( *todo )
-                continue
+                todo,arch = optodo.pop()
 
-            pva, va = todo
-            if opdone.get(va):
-                continue
+                if self._cf_noflow.get( todo ):
+                    self._cb_noflow( *todo )
+                    continue
 
-            opdone[va] = True
+                pva, va = todo
+                if opdone.get(va):
+                    continue
 
-            try:
-                op = self._mem.parseOpcode(va, arch=arch)
-            except envi.InvalidInstruction, e:
-                print 'parseOpcode error at 0x%.8x: %s' % (va,e)
-                continue 
-            except Exception, e:
-                print 'parseOpcode error at 0x%.8x: %s' % (va,e)
-                continue
+                opdone[va] = True
+
+                # Already handled by a previous code flow
+                if self._cb_opdone(va):
+                    continue
 
-            branches = op.getBranches()
-            # The opcode callback may filter branches...
-            branches = self._cb_opcode(va, op, branches)
+                try:
+                    op = self._mem.parseOpcode(va, arch=arch)
+                except envi.InvalidInstruction, e:
+                    print 'parseOpcode error at 0x%.8x: %s' % (va,e)
+                    continue
+                except Exception, e:
+                    print 'parseOpcode error at 0x%.8x: %s' % (va,e)
+                    continue
 
-            while len(branches):
+                branches = op.getBranches()
+                # The opcode callback may filter branches...
+                branches = self._cb_opcode(va, op, branches)
 
-                bva, bflags = branches.pop()
-                                
-                # look for dynamic branches (ie. branches which don't have a known target).  assume at least one branch
-                if bva == None:
-                    self._cb_dynamic_branch(va, op, bflags, branches)
+                while len(branches):
 
-                # add block as part of our call stack
-                self._cf_blocks.append( bva )
+                    bva, bflags = branches.pop()
+
+                    # look for dynamic branches (ie. branches which don't have a known target).  assume at least one branch
+                    if bva == None:
+                        self._cb_dynamic_branch(va, op, bflags, branches)
 
-                try:
                     # Handle a table branch by adding more branches...
                     if bflags & envi.BR_TABLE:
                         if self._cf_exptable:
@@ -219,13 +288,13 @@ class CodeFlowContext(object):
 
                             # Now we decend so we do deepest func callbacks first!
                             if self._cf_recurse:
-                                if bva in self._cf_blocks:
-                                    # the function that we want to make prodcedural
-                                    # called us so we can't call to make it procedural
-                                    # until its done
+                                if not bflags & envi.BR_DEREF or bva in blocks:
+                                    # direct calls (and calls to functions which are
+                                    # still being flowed, which may have called us) are
+                                    # made procedural once this flow is done
                                     cf_eps.add(bva)
                                 else:
-                                    self.addEntryPoint( bva )
+                                    yield bva, envi.ARCH_DEFAULT
 
                             if self._cf_noret.get( bva ):
                                 # then our next va is noflow!
@@ -235,42 +304,22 @@ class CodeFlowContext(object):
 
                             # We only go up to procedural branches, not across
                             continue
-                finally:
-                    self._cf_blocks.pop()
 
-                if not opdone.get(bva):
-                    optodo.append( ((va, bva), bflags) )
+                    if not opdone.get(bva):
+                        optodo.append( ((va, bva), bflags) )
 
+        finally:
+            # remove our local blocks from global block stack
+            if blocks[startva] == 1:
+                blocks.pop(startva)
+            else:
+                blocks[startva] -= 1
 
-        # remove our local blocks from global block stack
-        self._cf_blocks.pop()
         while cf_eps:
             fva = cf_eps.pop()
             if not self._mem.isFunction(fva):
-                self.addEntryPoint(fva, arch=arch)
-
-        return calls_from.keys()
+                yield fva, arch
 
-    def addEntryPoint(self, va, arch=envi.ARCH_DEFAULT):
-        '''
-        Analyze the given procedure entry point and flow downward
-        to find all subsequent code blocks and procedure edges.
-
-        Example:
-            cf.addEntryPoint( 0x77c70308 )
-            ... callbacks flow along ...
-        '''
-        # Check if this is already a known function.
-        if self._funcs.get(va) != None:
-            return
-
-        # Add this function to known functions
-        self._funcs[va] = True
-        calls_from = self.addCodeFlow(va, arch=arch)
-        self._fcalls[va] = calls_from
-        
-        # Finally, notify the callback of a new function
-        self._cb_function(va, {'CallsFrom':calls_from})
     def addDynamicBranchHandler(self, cb):
         '''
         Add a callback handler for dynamic branches the code-flow resolver 
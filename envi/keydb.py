@@ -0,0 +1,175 @@
+'''
+A compact, read-only (mmap'd) on-disk hash table of string keys to
+string values.
+
+Used for large static tables ( import API definitions, ordinal names )
+which are much cheaper to look up by name from a prebuilt file than to
+import as a giant dict literal.
+
+The file format:
+
+header:     magic, version, record/bucket counts, table offsets and
+            the size of the (marshal'd) meta value
+records:    (keyhash, dataoff, keylen, vallen, hashnext) for each key
+buckets:    recidx+1 of the first record in each key hash chain
+data:       the (marshal'd) meta value then each key followed by its value
+
+( the meta value is loaded with the db, callers may use it for things like
+a string table used to encode the values )
+'''
+import os
+import mmap
+import zlib
+import struct
+import marshal
+
+keydb_magic = 'VKEYDB00'
+keydb_version = 1
+
+keydb_hdr = struct.Struct('<8sIIIIIII')
+keydb_rec = struct.Struct('<IIHHI')
+keydb_bucket = struct.Struct('<I')
+
+# marshal format 2 is readable by every python 2.5+
+marshal_version = 2
+
+def keyDbHash(key):
+    return zlib.crc32(key) & 0xffffffff
+
+def writeKeyDb(filename, items, meta=None):
+    '''
+    Write a key db file from a list of (key, value) string tuples ( and
+    an optional marshal'able meta value which is loaded with the db ).
+
+    NOTE: keys and values must be less than 64k each.
+    '''
+    items = sorted(items)
+    count = len(items)
+
+    nbuckets = 1
+    while nbuckets < count:
+        nbuckets <<= 1
+
+    metabytes = marshal.dumps(meta, marshal_version)
+
+    data = [ metabytes, ]
+    dataoff = len(metabytes)
+    buckets = [ 0 ] * nbuckets
+    recs = []
+    for i, (key, val) in enumerate(items):
+        if type(key) == unicode:
+            key = key.encode('utf8')
+
+        if len(key) > 0xffff or len(val) > 0xffff:
+            raise Exception('Key DB key/value too large: %r' % key[:64])
+
+        h = keyDbHash(key)
+        b = h & (nbuckets - 1)
+        recs.append( keydb_rec.pack(h, dataoff, len(key), len(val), buckets[b]) )
+        buckets[b] = i + 1
+
+        data.append(key)
+        data.append(val)
+        dataoff += len(key) + len(val)
+
+    recoff = keydb_hdr.size
+    bucketoff = recoff + (count * keydb_rec.size)
+    dataoff = bucketoff + (nbuckets * keydb_bucket.size)
+
+    hdr = keydb_hdr.pack(keydb_magic, keydb_version, count, nbuckets,
+                         recoff, bucketoff, dataoff, len(metabytes))
+
+    # Write a new file and move it into place ( the old one may be mapped )
+    tmpname = '%s.%d.tmp' % (filename, os.getpid())
+    fd = file(tmpname, 'wb')
+    fd.write(hdr)
+    fd.write(''.join(recs))
+    fd.write(''.join([ keydb_bucket.pack(b) for b in buckets ]))
+    fd.write(''.join(data))
+    fd.close()
+
+    try:
+        os.rename(tmpname, filename)
+    except OSError, e:
+        os.unlink(filename)
+        os.rename(tmpname, filename)
+
+class KeyDb:
+    '''
+    A read-only (mmap'd) key db file.  Nothing but the header and meta
+    value is read until a key is looked up.
+
+    Example:
+        db = KeyDb('ords.keydb')
+        name = db.get('ws2_32:1')
+    '''
+    def __init__(self, filename):
+        fd = file(filename, 'rb')
+        try:
+            self.mmap = mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ)
+        finally:
+            fd.close()
+
+        hdr = keydb_hdr.unpack_from(self.mmap, 0)
+        magic, version, self.count, self.nbuckets = hdr[:4]
+        self.recoff, self.bucketoff, self.dataoff, metasize = hdr[4:]
+
+        if magic != keydb_magic or version != keydb_version:
+            raise Exception('Invalid Key DB File: %s' % filename)
+
+        self.meta = marshal.loads(self.mmap[self.dataoff:self.dataoff + metasize])
+
+    def __len__(self):
+        return self.count
+
+    def __contains__(self, key):
+        return self._getKeyRec(key) != None
+
+    def close(self):
+        self.mmap.close()
+
+    def _getRec(self, i):
+        return keydb_rec.unpack_from(self.mmap, self.recoff + (i * keydb_rec.size))
+
+    def _getKeyRec(self, key):
+        if not self.count:
+            return None
+
+        if type(key) == unicode:
+            key = key.encode('utf8')
+
+        h = keyDbHash(key)
+        b = h & (self.nbuckets - 1)
+        i = keydb_bucket.unpack_from(self.mmap, self.bucketoff + (b * keydb_bucket.size))[0]
+        while i:
+            rec = self._getRec(i - 1)
+            if rec[0] == h and rec[2] == len(key):
+                keyoff = self.dataoff + rec[1]
+                if self.mmap[keyoff:keyoff + rec[2]] == key:
+                    return rec
+
+            i = rec[4]
+
+    def _getRecValue(self, rec):
+        valoff = self.dataoff + rec[1] + rec[2]
+        return self.mmap[valoff:valoff + rec[3]]
+
+    def get(self, key, default=None):
+        '''
+        Return the value for the given key (or default).
+        '''
+        rec = self._getKeyRec(key)
+        if rec == None:
+            return default
+        return self._getRecValue(rec)
+
+    def items(self):
+        '''
+        Return a list of all the (key, value) tuples in the db.
+        '''
+        ret = []
+        for i in xrange(self.count):
+            rec = self._getRec(i)
+            keyoff = self.dataoff + rec[1]
+            ret.append( (self.mmap[keyoff:keyoff + rec[2]], self._getRecValue(rec)) )
+        return ret
@@ -3,6 +3,7 @@ import struct
 import collections
 
 import envi
+import envi.pagelookup as e_page
 
 """
 A module containing memory utilities and the definition of the
@@ -328,7 +329,7 @@ class MemoryCache(IMemory):
             chunksize = min( self.pagesize - pageoff, size )
             page = self.pagecache.get( pageva )
             if page == None:
-                page = self.mem.readMemory(pageva, self.pagesize)
+                page = self._cachePage(pageva)
                 self.pagecache[pageva] = page
             ret += page[ pageoff : pageoff + chunksize ]
 
@@ -346,7 +347,7 @@ class MemoryCache(IMemory):
 
             page = self.pagecache.get(pageva)
             if page == None:
-                page = self.mem.readMemory(pageva, self.pagesize)
+                page = self._cachePage(pageva)
                 self.pagecache[pageva] = page
 
             self.pagedirty[pageva] = True
@@ -389,6 +390,7 @@ class MemoryObject(IMemory):
         """
         IMemory.__init__(self, arch=arch)
         self._map_defs = []
+        self._map_index = e_page.RangeLookup()
 
     #FIXME MemoryObject: def allocateMemory(self, size, perms=MM_RWX, suggestaddr=0):
 
@@ -400,6 +402,7 @@ class MemoryObject(IMemory):
         mmap = (va, msize, perms, fname)
         hlpr = [va, va+msize, mmap, bytez]
         self._map_defs.append(hlpr)
+        self._map_index.addRangeLookup(va, va+msize, hlpr)
         return
 
     def getMemorySnap(self):
@@ -417,42 +420,59 @@ class MemoryObject(IMemory):
         Example: mem.setMemorySnap(snap)
         '''
         self._map_defs = [list(md) for md in snap]
+        self._reindexMapDefs()
+
+    def _reindexMapDefs(self):
+        self._map_index.clearRangeLookup()
+        for mdef in self._map_defs:
+            self._map_index.addRangeLookup(mdef[0], mdef[1], mdef)
+
+    def _getMapDef(self, va):
+        '''
+        Return the internal map definition list which contains
+        the given virtual address (or None).
+        '''
+        rtup = self._map_index.getRangeLookup(va)
+        if rtup == None:
+            return None
+        return rtup[2]
 
     def getMemoryMap(self, va):
         """
         Get the va,size,perms,fname tuple for this memory map
         """
-        for mva, mmaxva, mmap, mbytes in self._map_defs:
-            if va >= mva and va < mmaxva:
-                return mmap
-        return None
+        rtup = self._map_index.getRangeLookup(va)
+        if rtup == None:
+            return None
+        return rtup[2][2]
 
     def getMemoryMaps(self):
-        return [ mmap for mva, mmaxva, mmap, mbytes in self._map_defs ]
+        return [ mdef[2] for mdef in self._map_defs ]
 
     def readMemory(self, va, size):
+        mdef = self._getMapDef(va)
+        if mdef == None:
+            raise envi.SegmentationViolation(va)
+
+        mva, msize, mperms, mfname = mdef[2]
+        if not mperms & MM_READ:
+            raise envi.SegmentationViolation(va)
 
-        for mva, mmaxva, mmap, mbytes in self._map_defs:
-            if va >= mva and va < mmaxva:
-                mva, msize, mperms, mfname = mmap
-                if not mperms & MM_READ:
-                    raise envi.SegmentationViolation(va)
-                offset = va - mva
-                return mbytes[offset:offset+size]
-        raise envi.SegmentationViolation(va)
+        offset = va - mva
+        return mdef[3][offset:offset+size]
 
     def writeMemory(self, va, bytes):
-        for mapdef in self._map_defs:
-            mva, mmaxva, mmap, mbytes = mapdef
-            if va >= mva and va < mmaxva:
-                mva, msize, mperms, mfname = mmap
-                if not mperms & MM_WRITE:
-                    raise envi.SegmentationViolation(va)
-                offset = va - mva
-                mapdef[3] = mbytes[:offset] + bytes + mbytes[offset+len(bytes):]
-                return
-
-        raise envi.SegmentationViolation(va)
+        mdef = self._getMapDef(va)
+        if mdef == None:
+            raise envi.SegmentationViolation(va)
+
+        mva, msize, mperms, mfname = mdef[2]
+        if not mperms & MM_WRITE:
+            raise envi.SegmentationViolation(va)
+
+        offset = va - mva
+        mbytes = mdef[3]
+        mdef[3] = mbytes[:offset] + bytes + mbytes[offset+len(bytes):]
 
     def getByteDef(self, va):
         """
@@ -462,12 +482,182 @@ class MemoryObject(IMemory):
         buffer.  Used internally for optimized memory
         handling.  Returns (offset, bytes)
         """
-        for mapdef in self._map_defs:
-            mva, mmaxva, mmap, mbytes = mapdef
-            if va >= mva and va < mmaxva:
-                offset = va - mva
-                return (offset, mbytes)
-        raise envi.SegmentationViolation(va)
+        mdef = self._getMapDef(va)
+        if mdef == None:
+            raise envi.SegmentationViolation(va)
+        return (va - mdef[0], mdef[3])
+
+class PagedMemoryObject(MemoryObject):
+    '''
+    A MemoryObject which never rebuilds the bytes for a memory map.
+
+    Each map keeps the bytes it was added with as an immutable base, and
+    writes go into fixed size (map relative) pages which are only created
+    when first dirtied.  Pages are shared between the live memory and any
+    snapshots, and are copied on write, so snapshots cost O(dirty pages)
+    and writes cost O(write size).
+
+    NOTE: getByteDef() must materialize the whole map once it has dirty
+          pages, so it is *not* the fast path here (the way it is for a
+          workspace).
+    '''
+    def __init__(self, arch=None, pagesize=4096):
+        MemoryObject.__init__(self, arch=arch)
+        self._mem_pagesize = pagesize # must be binary multiplicative
+        self._mem_pageshift = pagesize.bit_length() - 1
+
+    def addMemoryMap(self, va, perms, fname, bytez):
+        '''
+        Add a memory map to this object...
+        '''
+        msize = len(bytez)
+        mmap = (va, msize, perms, fname)
+        # [ va, maxva, mmap, basebytes, {pageidx:page}, set(owned pageidx) ]
+        hlpr = [va, va+msize, mmap, bytez, {}, set()]
+        self._map_defs.append(hlpr)
+        self._map_index.addRangeLookup(va, va+msize, hlpr)
+        return
+
+    def getMemorySnap(self):
+        '''
+        Take a memory snapshot which may be restored later.
+
+        The dirty pages are shared with the snapshot, so subsequent
+        writes will copy a page before modifying it.
+
+        Example: snap = mem.getMemorySnap()
+        '''
+        snap = []
+        for mdef in self._map_defs:
+            mdef[5] = set()
+            snap.append( (mdef[0], mdef[1], mdef[2], mdef[3], dict(mdef[4])) )
+        return snap
+
+    def setMemorySnap(self, snap):
+        '''
+        Restore a previously saved memory snapshot.
+
+        Example: mem.setMemorySnap(snap)
+        '''
+        self._map_defs = [ [mva, mmaxva, mmap, bytez, dict(pages), set()]
+                           for mva, mmaxva, mmap, bytez, pages in snap ]
+        self._reindexMapDefs()
+
+    def getDirtyPages(self):
+        '''
+        Returns a list of (pageva, pagebytez) tuples for every page which
+        has been written to since the memory map was added.
+        '''
+        ret = []
+        shift = self._mem_pageshift
+        for mdef in self._map_defs:
+            for pidx, page in mdef[4].items():
+                ret.append( (mdef[0] + (pidx << shift), str(page)) )
+        ret.sort()
+        return ret
+
+    def _readMapDef(self, mdef, offset, size):
+        # Read (up to) size bytes from a map def at offset
+        pages = mdef[4]
+        mbytes = mdef[3]
+        if not pages:
+            return mbytes[offset:offset+size]
+
+        endoff = min(offset + size, len(mbytes))
+        shift = self._mem_pageshift
+        pagesize = self._mem_pagesize
+
+        pidx = offset >> shift
+        pmax = (endoff - 1) >> shift
+
+        ret = []
+        while pidx <= pmax:
+            pstart = pidx << shift
+            coff = max(offset, pstart)
+            cend = min(endoff, pstart + pagesize)
+
+            page = pages.get(pidx)
+            if page == None:
+                ret.append(mbytes[coff:cend])
+            else:
+                ret.append(str(page[coff-pstart:cend-pstart]))
+
+            pidx += 1
+
+        return ''.join(ret)
+
+    def readMemory(self, va, size):
+        mdef = self._getMapDef(va)
+        if mdef == None:
+            raise envi.SegmentationViolation(va)
+
+        mva, msize, mperms, mfname = mdef[2]
+        if not mperms & MM_READ:
+            raise envi.SegmentationViolation(va)
+
+        return self._readMapDef(mdef, va - mva, size)
+
+    def writeMemory(self, va, bytes):
+        shift = self._mem_pageshift
+        pagesize = self._mem_pagesize
+
+        while bytes:
+            mdef = self._getMapDef(va)
+            if mdef == None:
+                raise envi.SegmentationViolation(va)
+
+            mva, msize, mperms, mfname = mdef[2]
+            if not mperms & MM_WRITE:
+                raise envi.SegmentationViolation(va)
+
+            mbytes = mdef[3]
+            pages = mdef[4]
+            owned = mdef[5]
+
+            offset = va - mva
+            endoff = min(offset + len(bytes), msize)
+            count = endoff - offset
+
+            done = 0
+            while offset < endoff:
+                pidx = offset >> shift
+                pstart = pidx << shift
+                chunk = min(endoff, pstart + pagesize) - offset
+
+                page = pages.get(pidx)
+                if pidx not in owned:
+                    # copy on write (from the base bytes or a shared page)
+                    if page == None:
+                        page = bytearray(mbytes[pstart:pstart+pagesize])
+                    else:
+                        page = bytearray(page)
+                    pages[pidx] = page
+                    owned.add(pidx)
+
+                poff = offset - pstart
+                page[poff:poff+chunk] = bytes[done:done+chunk]
+
+                done += chunk
+                offset += chunk
+
+            # Writes which run off the end of a map continue into the next
+            va += count
+            bytes = bytes[count:]
+
+    def getByteDef(self, va):
+        """
+        Returns (offset, bytes) for the map containing va.  If the map has
+        been written to, this returns a freshly materialized copy.
+        """
+        mdef = self._getMapDef(va)
+        if mdef == None:
+            raise envi.SegmentationViolation(va)
+
+        offset = va - mdef[0]
+        if not mdef[4]:
+            return (offset, mdef[3])
+
+        return (offset, self._readMapDef(mdef, 0, len(mdef[3])))
 
 class MemoryFile:
     '''
@@ -3,6 +3,7 @@ A home for the page lookup construct.  Basically it is a
 python object which implements a similar lookup mechanism
 to the i386 page table lookups...
 '''
+import bisect
 import collections
 
 # FIXME move functions in here too so there is procedural "speed" way
@@ -38,6 +39,103 @@ class PageLookup:
     # __getslice__
     # __setslice__
 
+class RangeLookup:
+    '''
+    A sorted index of [va, vamax) ranges which resolves an address to the
+    range which contains it using bisect on the range start addresses.  The
+    most recent hit is cached, since lookups tend to cluster.
+
+    Ranges are (va, vamax, obj) tuples, and getRangeLookup() returns the
+    tuple (or None).
+
+    NOTE: if ranges overlap (nested memory maps etc) the first *added* range
+          which contains the address wins, and lookups fall back to a linear
+          scan in the order the ranges were added.
+    '''
+
+    def __init__(self):
+        self.clearRangeLookup()
+
+    def addRangeLookup(self, va, vamax, obj):
+        # Empty ranges can never contain an address
+        if vamax <= va:
+            return
+
+        rtup = (va, vamax, obj)
+        idx = bisect.bisect_right(self._rl_vas, va)
+
+        # While the ranges are disjoint, only the neighbors can overlap
+        if not self._rl_overlap:
+            if idx > 0 and self._rl_ranges[idx-1][1] > va:
+                self._rl_overlap = True
+            elif idx < len(self._rl_vas) and self._rl_vas[idx] < vamax:
+                self._rl_overlap = True
+
+        self._rl_vas.insert(idx, va)
+        self._rl_ranges.insert(idx, rtup)
+        self._rl_order.append(rtup)
+        self._rl_last = None
+        return rtup
+
+    def delRangeLookup(self, va):
+        '''
+        Remove the range which begins at va (returns the range tuple).
+        '''
+        idx = bisect.bisect_left(self._rl_vas, va)
+        if idx == len(self._rl_vas) or self._rl_vas[idx] != va:
+            raise Exception('Address (0x%.8x) not a range start!' % va)
+
+        self._rl_vas.pop(idx)
+        self._rl_last = None
+        rtup = self._rl_ranges.pop(idx)
+        self._rl_order = [ r for r in self._rl_order if r is not rtup ]
+
+        if self._rl_overlap:
+            self._rl_overlap = False
+            vamax = -1
+            for rva, rvamax, robj in self._rl_ranges:
+                if rva < vamax:
+                    self._rl_overlap = True
+                    break
+                vamax = max(vamax, rvamax)
+
+        return rtup
+
+    def clearRangeLookup(self):
+        self._rl_vas = []
+        self._rl_ranges = []
+        self._rl_order = []
+        self._rl_last = None
+        self._rl_overlap = False
+
+    def getRangeLookup(self, va):
+        if self._rl_overlap:
+            for rtup in self._rl_order:
+                if va >= rtup[0] and va < rtup[1]:
+                    return rtup
+            return None
+
+        last = self._rl_last
+        if last != None and va >= last[0] and va < last[1]:
+            return last
+
+        idx = bisect.bisect_right(self._rl_vas, va) - 1
+        if idx < 0:
+            return None
+
+        rtup = self._rl_ranges[idx]
+        if va >= rtup[1]:
+            return None
+
+        self._rl_last = rtup
+        return rtup
+
+    def getRangeLookups(self):
+        '''
+        Return the list of (va, vamax, obj) tuples in address order.
+        '''
+        return list(self._rl_ranges)
+
 class MapLookup:
 
     '''
@@ -47,25 +145,28 @@ class MapLookup:
 
     def __init__(self):
         self._maps_list = []
+        self._maps_index = RangeLookup()
 
     def initMapLookup(self, va, size, obj=None):
         marray = [obj] * size
         # FIXME optimize by size!
         self._maps_list.append((va, va+size, marray))
+        self._maps_index.addRangeLookup(va, va+size, marray)
 
     def setMapLookup(self, va, size, obj):
-        for mva, mvamax, marray in self._maps_list:
-            if va >= mva and va < mvamax:
-                off = va - mva
-                marray[off:off+size] = [obj] * size
-                return
-        raise Exception('Address (0x%.8x) not in maps!' % va)
+        rtup = self._maps_index.getRangeLookup(va)
+        if rtup == None:
+            raise Exception('Address (0x%.8x) not in maps!' % va)
+
+        mva, mvamax, marray = rtup
+        off = va - mva
+        marray[off:off+size] = [obj] * size
 
     def getMapLookup(self, va):
-        for mva, mvamax, marray in self._maps_list:
-            if va >= mva and va < mvamax:
-                return marray[ va - mva ]
-        return None
+        rtup = self._maps_index.getRangeLookup(va)
+        if rtup == None:
+            return None
+        return rtup[2][ va - rtup[0] ]
 
     def __getslice__(self, start, end):
         print 'GET SLICE'
@@ -1,5 +1,5 @@
 import types
-import collections
+import bisect
 
 # Symbol Type Constants ( for serialization )
 SYMSTOR_SYM_SYMBOL      = 0
@@ -81,17 +81,21 @@ class SymbolResolver:
         self.casesens = casesens
         self.baseaddr = baseaddr    # Set if this is an RVA sym resolver
 
-        # Lets use 4096 byte buckes for now
-        self.bucketsize = 4096
-        self.bucketmask = self.widthmask ^ (self.bucketsize-1)
-
-        self.buckets = collections.defaultdict(list)
-
         # holds tuples by name/addr, instantiated on demand and subsequently
         # stored in symobjsbyaddr and symobjsbyname
         self.symnames = {}
         self.symaddrs = {}
 
+        # symbol tuples which have a size ( for containment lookups )
+        self.symranges = []
+        # sorted address index for "not exact" lookups ( built on demand )
+        self.symindex = None
+
+        # symbol cache files ( sorted by base ) which are looked up on demand
+        # as ( baseaddr, symfile, symfname, names ) tuples
+        self.symfiles = []
+        self.symfilebases = []
+
         # caches that hold instantiated Symbol objects
         self.symobjsbyaddr  = {}
         self.symobjsbyname  = {}
@@ -102,9 +106,10 @@ class SymbolResolver:
         """
         symval = long(sym)
         self.symaddrs.pop(symval, None)
+        self.symobjsbyaddr.pop(symval, None)
 
-        bbase = symval & self.bucketmask
-        #self.objbuckets[bbase].remove(sym)
+        self.symranges = [ t for t in self.symranges if t[0] != symval or t[2] != sym.name ]
+        self.symindex = None
 
         subres = None
         if sym.fname != None:
@@ -159,6 +164,15 @@ class SymbolResolver:
         if symtup != None:
             return self._symFromTup( symtup )
 
+        # Is it in a symbol cache file?
+        for symfinfo in self.symfiles:
+            if not symfinfo[3]:
+                continue
+
+            symtup = symfinfo[1].getSymTupByName(name, casesens=self.casesens)
+            if symtup != None:
+                return self._symFromTup( self._fileSymTup(symfinfo, symtup) )
+
     def delSymByName(self, name):
         if not self.casesens:
             name = name.lower()
@@ -183,10 +197,6 @@ class SymbolResolver:
         # Add a symbol object to our datastructures.
         self.symobjsbyaddr[sym.value] = sym
 
-        symmax = sym.value + sym.size
-
-        bbase = sym.value & self.bucketmask
-
         if sym.fname:
             subres = self.symobjsbyname.get(sym.fname)
             if subres != None:
@@ -213,29 +223,129 @@ class SymbolResolver:
         if symtup:
             return self._symFromTup(symtup)
 
+        if exact:
+            if self.symfiles:
+                symtup = self._getFileSymTupByAddr(va)
+                if symtup != None:
+                    return self._symFromTup(symtup)
+            return None
+
         # In the "not exact" case, go by the tuples...
-        # ...and try 2 buckets... ( more than 8k away is bunk )
-        if not exact:
-            bucketva = va & self.bucketmask
-            b1 = [ b for b in self.buckets[bucketva] if b[0] <= va ]
-            if not b1:
-                b1 = self.buckets[bucketva - self.bucketsize]
-
-            if b1:
-                b1.sort()
-                symtup = b1[-1]
-                sym = self.symobjsbyaddr.get(symtup[0])
-                if sym != None:
-                    return sym
-
-                return self._symFromTup(symtup)
+        else:
+            symtup = self._getNearSymTup(va, self.symindex or self._getSymIndex())
+            if self.symfiles:
+                symtup = self._getFileNearSymTup(va, symtup)
+
+            if symtup == None:
+                return None
+
+            sym = self.symobjsbyaddr.get(symtup[0])
+            if sym != None:
+                return sym
+
+            return self._symFromTup(symtup)
+
+    def getSymsByAddrs(self, vas, exact=True):
+        '''
+        Return a list of Symbol objects (or None) for a list of virtual
+        addresses ( for renderers resolving many addresses at once ).
+        '''
+        syms = {}
+        ret = []
+        for va in vas:
+            if va not in syms:
+                syms[va] = self.getSymByAddr(va, exact=exact)
+            ret.append(syms[va])
+        return ret
+
+    def _getSymIndex(self):
+        '''
+        Build (or return) the sorted address index which is used by
+        "not exact" lookups.
+        '''
+        if self.symindex != None:
+            return self.symindex
+
+        addrs = self.symaddrs.keys()
+        addrs.sort()
+
+        # Ranges are sorted by address ( and inner-most last ) along with
+        # the index of the inner-most range which contains each one.
+        ranges = list(set(self.symranges))
+        ranges.sort(key=lambda t: (t[0], -t[1]))
+
+        stack = []
+        parents = []
+        for i, symtup in enumerate(ranges):
+            while stack and ranges[stack[-1]][0] + ranges[stack[-1]][1] <= symtup[0]:
+                stack.pop()
+
+            parents.append(stack[-1] if stack else -1)
+            stack.append(i)
+
+        self.symindex = (addrs, [ t[0] for t in ranges ], ranges, parents)
+        return self.symindex
+
+    def _getNearSymTup(self, va, symindex):
+        # Return the nearest symbol tuple for va.  A symbol with a size
+        # only covers its range, and an unsized symbol covers up to the
+        # next symbol ( within the range of any symbol containing va ).
+        addrs = symindex[0]
+        i = bisect.bisect_right(addrs, va) - 1
+        if i < 0:
+            return self._getSymRangeTup(va, symindex)
+
+        symtup = self.symaddrs[addrs[i]]
+        if symtup[1]:
+            if va < symtup[0] + symtup[1]:
+                return symtup
+            return self._getSymRangeTup(va, symindex)
+
+        if not symindex[1]:
+            return symtup
+
+        rtup = self._getSymRangeTup(va, symindex)
+        if rtup != None:
+            if symtup[0] >= rtup[0]:
+                return symtup
+            return rtup
+
+        # Don't reach out of a range which ends before va
+        if self._getSymRangeTup(symtup[0], symindex) == None:
+            return symtup
+
+    def _getSymRangeTup(self, va, symindex):
+        # Return the inner-most sized symbol tuple which contains va
+        # ( any range which contains va also contains the start of the
+        # nearest range, so walk out through its containers )
+        addrs, rvas, ranges, parents = symindex
+        i = bisect.bisect_right(rvas, va) - 1
+        while i >= 0:
+            symtup = ranges[i]
+            if va < symtup[0] + symtup[1]:
+                return symtup
+            i = parents[i]
 
     def getSymList(self):
         """
         Return a list of the symbols which are contained in this resolver.
         """
         names = self.symnames.keys()
-        return [ self.getSymByName(name) for name in names ]
+        ret = [ self.getSymByName(name) for name in names ]
+
+        for symfinfo in self.symfiles:
+            if not symfinfo[3]:
+                continue
+
+            for symtup in symfinfo[1].getSymTups():
+                symname = symtup[2]
+                if not self.casesens:
+                    symname = symname.lower()
+
+                if self.symnames.get(symname) == None:
+                    ret.append( self._symFromTup( self._fileSymTup(symfinfo, symtup) ) )
+
+        return ret
 
     def getSymHint(self, va, hidx):
         """
@@ -255,11 +365,8 @@ class SymbolResolver:
         # Ugly list comprehensions for speed...
         [ self.symaddrs.__setitem__( n[0], n ) for n in symtups ]
 
-        for symtup in symtups:
-            # do the size range...
-            self.buckets[ symtup[0] & self.bucketmask ].append( symtup )
-            if symtup[1]:
-                [ self.buckets[b].append(symtup) for b in range(symtup[0], symtup[0] + symtup[1], self.bucketsize) ]
+        self.symranges.extend( [ n for n in symtups if n[1] ] )
+        self.symindex = None
 
     def _nomSymTupNames(self, symtups):
         if not self.casesens:
@@ -289,6 +396,74 @@ class SymbolResolver:
 
         self._nomSymTupNames(symtups)
 
+    def impSymCacheFile(self, symfile, symfname=None, baseaddr=0):
+        '''
+        Import a (mapped) SymbolCacheFile (see envi.symstore.symcache) at
+        the given base address ( and for the given sub-file ).  Symbols are
+        looked up from the file on demand rather than imported.
+
+        NOTE: symbol cache files in one resolver must not overlap.
+        '''
+        names = True
+        if symfname:
+            # If we have a sub-resolver, it answers the name lookups
+            subres = self.symobjsbyname.get(symfname)
+            if isinstance(subres, SymbolResolver):
+                subres.impSymCacheFile(symfile, symfname=symfname, baseaddr=baseaddr)
+                names = False
+
+        i = bisect.bisect_right(self.symfilebases, baseaddr)
+        self.symfilebases.insert(i, baseaddr)
+        self.symfiles.insert(i, (baseaddr, symfile, symfname, names))
+
+    def _fileSymTup(self, symfinfo, symtup):
+        # Make a symbol tuple from a symbol cache file's tuple
+        rva, size, name, symtype = symtup
+        return (rva + symfinfo[0], size, name, symtype, symfinfo[2])
+
+    def _getFileInfo(self, va):
+        # Only the symbol file with the nearest base address is checked
+        i = bisect.bisect_right(self.symfilebases, va) - 1
+        if i >= 0:
+            return self.symfiles[i]
+
+    def _getFileSymTupByAddr(self, va):
+        symfinfo = self._getFileInfo(va)
+        if symfinfo == None:
+            return None
+
+        symtup = symfinfo[1].getSymTupByRva(va - symfinfo[0])
+        if symtup != None:
+            return self._fileSymTup(symfinfo, symtup)
+
+    def _getFileNearSymTup(self, va, symtup):
+        # Given our nearest symbol tuple for va, return the nearest from
+        # either it or the symbol file ( as though the file were imported )
+        symfinfo = self._getFileInfo(va)
+        if symfinfo == None:
+            return symtup
+
+        baseaddr, symfile = symfinfo[:2]
+        nearrva = symfile.getNearestRva(va - baseaddr)
+        if nearrva == None:
+            return symtup
+
+        # Our symbol is nearer than any in the file
+        if symtup != None and symtup[0] > baseaddr + nearrva:
+            return symtup
+
+        filetup = symfile.getSymTupByRva(va - baseaddr, exact=False)
+        if filetup != None:
+            filetup = self._fileSymTup(symfinfo, filetup)
+            if symtup == None or filetup[0] >= symtup[0]:
+                return filetup
+            return symtup
+
+        # The file has nearer symbols ( but none cover va ) so only one
+        # of our ranges which contains va is left.
+        if symtup != None and symtup[1] and va < symtup[0] + symtup[1]:
+            return symtup
+
 class FileSymbol(Symbol, SymbolResolver):
     """
     A file symbol is both a symbol resolver of it's own, and
@@ -1,6 +1,9 @@
 import os
 import json
+import mmap
 import time
+import zlib
+import struct
 
 import cobra
 #import cobra.http as c_http
@@ -15,6 +18,258 @@ def symCacheHashFromPe(pe):
 def symCacheHashFromElf(elf):
     pass #FIXME
 
+# The binary symbol cache file format:
+#
+# header:   magic, version, symbol/range/bucket counts and table offsets
+# symbols:  (rva, size, nameoff, namelen, symtype, hashnext) sorted by rva
+# ranges:   (symidx, parent) for each sized symbol sorted by rva ( inner-most
+#           last ) where parent is the inner-most range which contains it
+# buckets:  symidx+1 of the first symbol in each name hash chain
+# names:    the utf8 symbol names
+symcache_magic = 'VSYMCACH'
+symcache_version = 1
+
+symcache_hdr = struct.Struct('<8sIIIIIIII')
+symcache_sym = struct.Struct('<QQIIII')
+symcache_range = struct.Struct('<Ii')
+symcache_bucket = struct.Struct('<I')
+
+def symCacheNameHash(name):
+    # Names are hashed lower case so case insensitive lookups work too
+    return zlib.crc32(name.lower()) & 0xffffffff
+
+def writeSymCacheFile(filename, symcache):
+    '''
+    Write a list of symbol tuples ( rva, size, name, symtype ) to a
+    binary symbol cache file.
+    '''
+    # A stable sort lets the last of several symbols at one rva win
+    # ( like SymbolResolver.impSymCache() )
+    symtups = sorted(symcache, key=lambda t: t[0])
+    count = len(symtups)
+
+    nbuckets = 1
+    while nbuckets < count:
+        nbuckets <<= 1
+
+    names = []
+    nameoff = 0
+    buckets = [ 0 ] * nbuckets
+    syms = []
+    for i, (rva, size, name, symtype) in enumerate(symtups):
+        if type(name) == unicode:
+            name = name.encode('utf8')
+
+        h = symCacheNameHash(name) & (nbuckets - 1)
+        syms.append( symcache_sym.pack(rva, size, nameoff, len(name), symtype, buckets[h]) )
+        buckets[h] = i + 1
+
+        names.append(name)
+        nameoff += len(name)
+
+    ranges = [ i for i in xrange(count) if symtups[i][1] ]
+    ranges.sort(key=lambda i: (symtups[i][0], -symtups[i][1]))
+
+    stack = []
+    rbytes = []
+    for ridx, i in enumerate(ranges):
+        rva = symtups[i][0]
+        while stack:
+            rtup = symtups[ranges[stack[-1]]]
+            if rtup[0] + rtup[1] > rva:
+                break
+            stack.pop()
+
+        parent = -1
+        if stack:
+            parent = stack[-1]
+
+        rbytes.append( symcache_range.pack(i, parent) )
+        stack.append(ridx)
+
+    symoff = symcache_hdr.size
+    rangeoff = symoff + (count * symcache_sym.size)
+    bucketoff = rangeoff + (len(ranges) * symcache_range.size)
+    nameoff = bucketoff + (nbuckets * symcache_bucket.size)
+
+    hdr = symcache_hdr.pack(symcache_magic, symcache_version, count, len(ranges),
+                            nbuckets, symoff, rangeoff, bucketoff, nameoff)
+
+    # Write a new file and move it into place ( the old one may be mapped )
+    tmpname = '%s.%d.tmp' % (filename, os.getpid())
+    fd = file(tmpname, 'wb')
+    fd.write(hdr)
+    fd.write(''.join(syms))
+    fd.write(''.join(rbytes))
+    fd.write(''.join([ symcache_bucket.pack(b) for b in buckets ]))
+    fd.write(''.join(names))
+    fd.close()
+
+    try:
+        os.rename(tmpname, filename)
+    except OSError, e:
+        os.unlink(filename)
+        os.rename(tmpname, filename)
+
+class SymbolCacheFile:
+    '''
+    A read-only (mmap'd) binary symbol cache file.  Symbols may be
+    looked up by name or rva without loading the whole file.
+    '''
+    def __init__(self, filename):
+        fd = file(filename, 'rb')
+        try:
+            self.mmap = mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ)
+        finally:
+            fd.close()
+
+        hdr = symcache_hdr.unpack_from(self.mmap, 0)
+        magic, version, self.count, self.rcount, self.nbuckets = hdr[:5]
+        self.symoff, self.rangeoff, self.bucketoff, self.nameoff = hdr[5:]
+
+        if magic != symcache_magic or version != symcache_version:
+            raise Exception('Invalid Symbol Cache File: %s' % filename)
+
+    def __len__(self):
+        return self.count
+
+    def close(self):
+        self.mmap.close()
+
+    def _getSymRec(self, i):
+        return symcache_sym.unpack_from(self.mmap, self.symoff + (i * symcache_sym.size))
+
+    def _getSymRva(self, i):
+        return struct.unpack_from('<Q', self.mmap, self.symoff + (i * symcache_sym.size))[0]
+
+    def _getRangeRec(self, i):
+        return symcache_range.unpack_from(self.mmap, self.rangeoff + (i * symcache_range.size))
+
+    def _getSymTupRec(self, rec):
+        rva, size, nameoff, namelen, symtype, hnext = rec
+        nameoff += self.nameoff
+        return (rva, size, self.mmap[nameoff:nameoff+namelen], symtype)
+
+    def getSymTup(self, i):
+        '''
+        Return the ( rva, size, name, symtype ) tuple at index i.
+        '''
+        return self._getSymTupRec(self._getSymRec(i))
+
+    def getSymTups(self):
+        '''
+        Return the list of all ( rva, size, name, symtype ) tuples.
+        '''
+        return [ self.getSymTup(i) for i in xrange(self.count) ]
+
+    def getSymTupByName(self, name, casesens=True):
+        '''
+        Return the ( rva, size, name, symtype ) tuple for the given
+        name (or None).
+        '''
+        if not self.count:
+            return None
+
+        if type(name) == unicode:
+            name = name.encode('utf8')
+
+        if not casesens:
+            name = name.lower()
+
+        h = symCacheNameHash(name) & (self.nbuckets - 1)
+        i = symcache_bucket.unpack_from(self.mmap, self.bucketoff + (h * symcache_bucket.size))[0]
+        while i:
+            rec = self._getSymRec(i - 1)
+            nameoff = self.nameoff + rec[2]
+            symname = self.mmap[nameoff:nameoff + rec[3]]
+            if not casesens:
+                symname = symname.lower()
+
+            if symname == name:
+                return self._getSymTupRec(rec)
+
+            i = rec[5]
+
+    def _bisect(self, count, getrva, rva):
+        # Return the index of the last entry with an rva <= the given rva
+        lo = 0
+        hi = count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if rva < getrva(mid):
+                hi = mid
+            else:
+                lo = mid + 1
+        return lo - 1
+
+    def _getRangeSymRva(self, i):
+        return self._getSymRva(self._getRangeRec(i)[0])
+
+    def getRangeSymTup(self, rva):
+        '''
+        Return the inner-most sized ( rva, size, name, symtype ) tuple which
+        contains the given rva (or None).
+        '''
+        i = self._bisect(self.rcount, self._getRangeSymRva, rva)
+        while i >= 0:
+            symidx, parent = self._getRangeRec(i)
+            rec = self._getSymRec(symidx)
+            if rva < rec[0] + rec[1]:
+                return self._getSymTupRec(rec)
+            i = parent
+
+    def getNearestRva(self, rva):
+        '''
+        Return the rva of the nearest symbol at or before the given rva
+        (or None).
+        '''
+        i = self._bisect(self.count, self._getSymRva, rva)
+        if i >= 0:
+            return self._getSymRva(i)
+
+    def getSymTupByRva(self, rva, exact=True):
+        '''
+        Return the ( rva, size, name, symtype ) tuple at the given rva
+        (or None).  With exact=False, return the nearest symbol ( using
+        the same rules as SymbolResolver.getSymByAddr() ).
+        '''
+        i = self._bisect(self.count, self._getSymRva, rva)
+        if i < 0:
+            if exact:
+                return None
+            return self.getRangeSymTup(rva)
+
+        rec = self._getSymRec(i)
+        if rec[0] == rva:
+            return self._getSymTupRec(rec)
+
+        if exact:
+            return None
+
+        if rec[1]:
+            if rva < rec[0] + rec[1]:
+                return self._getSymTupRec(rec)
+            return self.getRangeSymTup(rva)
+
+        if not self.rcount:
+            return self._getSymTupRec(rec)
+
+        rtup = self.getRangeSymTup(rva)
+        if rtup != None:
+            if rec[0] >= rtup[0]:
+                return self._getSymTupRec(rec)
+            return rtup
+
+        # Don't reach out of a range which ends before rva
+        if self.getRangeSymTup(rec[0]) == None:
+            return self._getSymTupRec(rec)
+
+def isSymCacheFile(filename):
+    fd = file(filename, 'rb')
+    magic = fd.read(len(symcache_magic))
+    fd.close()
+    return magic == symcache_magic
+
 class SymbolCache:
     '''
     A SymbolCache is a location where pre-parsed symbols for
@@ -35,6 +290,15 @@ class SymbolCache:
 
         self._sym_cachedir = os.path.abspath(dirname)
 
+    def _getCachePath(self, vhash):
+        cachefile = os.path.join( self._sym_cachedir, vhash )
+
+        abspath = os.path.abspath(cachefile)
+        if not abspath.startswith( self._sym_cachedir ):
+            raise Exception('Invalid Symbol Cache Hash: %s' % vhash)
+
+        return cachefile
+
     def setCacheSyms(self, vhash, symcache):
         '''
         Save a set of symbol cache tuples to the symbol cache.
@@ -44,15 +308,8 @@ class SymbolCache:
             cache = SymbolCache()
             cache.setCacheSyms( vhash, tups )
         '''
-        cachefile = os.path.join( self._sym_cachedir, vhash )
-
-        abspath = os.path.abspath(cachefile)
-        if not abspath.startswith( self._sym_cachedir ):
-            raise Exception('Invalid Symbol Cache Hash: %s' % vhash)
-
-        # FIXME check input path
-        fd = file(cachefile,'wb')
-        return json.dump(symcache, fd)
+        cachefile = self._getCachePath(vhash)
+        writeSymCacheFile(cachefile, symcache)
 
     def getCacheSyms(self, vhash):
         '''
@@ -64,24 +321,49 @@ class SymbolCache:
             for rva, size, name, stype in cache.getCacheSyms():
                 dostuff()
         '''
-        cachefile = os.path.join( self._sym_cachedir, vhash )
-
-        abspath = os.path.abspath(cachefile)
-        if not abspath.startswith( self._sym_cachedir ):
-            raise Exception('Invalid Symbol Cache Hash: %s' % vhash)
-
+        cachefile = self._getCachePath(vhash)
         if not os.path.isfile(cachefile):
             return None
 
         try:
 
-            print('Loading Cache File: %s' % cachefile)
+            if isSymCacheFile(cachefile):
+                symfile = SymbolCacheFile(cachefile)
+                try:
+                    return symfile.getSymTups()
+                finally:
+                    symfile.close()
+
+            # An older json symbol cache
             fd = file(cachefile,'rb')
             return json.load(fd)
 
         except Exception, e:
             return None
 
+    @cobra.nocobra
+    def getCacheFile(self, vhash):
+        '''
+        Retrieve a (mapped) SymbolCacheFile for the given file hash or
+        None.  ( Older json caches are re-written in the binary format )
+        '''
+        cachefile = self._getCachePath(vhash)
+        if not os.path.isfile(cachefile):
+            return None
+
+        try:
+
+            if not isSymCacheFile(cachefile):
+                fd = file(cachefile,'rb')
+                symcache = json.load(fd)
+                fd.close()
+                writeSymCacheFile(cachefile, symcache)
+
+            return SymbolCacheFile(cachefile)
+
+        except Exception, e:
+            return None
+
 class SymbolCachePath:
 
     def __init__(self, path):
@@ -107,7 +389,19 @@ class SymbolCachePath:
             if ret != None:
                 return ret
 
+    def getCacheFile(self, symhash):
+        '''
+        Retrieve a (mapped) SymbolCacheFile from the first local symbol
+        cache which has the given hash ( or None ).
+        '''
+        for symcache in self.symcaches:
+            if not isinstance(symcache, SymbolCache):
+                continue
+
+            ret = symcache.getCacheFile(symhash)
+            if ret != None:
+                return ret
+
     def setCacheSyms(self, symhash, symcache):
         if self.symcaches:
             self.symcaches[0].setCacheSyms(symhash,symcache)
-
@@ -0,0 +1,81 @@
+import random
+import unittest
+
+import envi.bytesig as e_bytesig
+
+class ByteSigTest(unittest.TestCase):
+
+    def bruteScan(self, sigs, bytes, offset, size):
+        ret = []
+        for start in xrange(offset, offset + size):
+            for sbytes, smasks, val in sigs:
+                if start + len(sbytes) > offset + size:
+                    continue
+                for i in xrange(len(sbytes)):
+                    if ord(bytes[start + i]) & ord(smasks[i]) != ord(sbytes[i]):
+                        break
+                else:
+                    ret.append( (start, val) )
+        return ret
+
+    def test_bytesig_scan(self):
+        scanner = e_bytesig.SignatureScanner()
+        sigs = [
+            ('\x55\x8b\xec', '\xff\xff\xff', 'ebp'),
+            ('\x8b\xff\x55\x8b\xec', '\xff\xff\xff\xff\xff', 'hotpatch'),
+            ('\x6a\x00\x68\x00\x00\x00\x00\xe8', '\xff\x00\xff\x00\x00\x00\x00\xff', 'seh'),
+            ('\x50\x00', '\xf8\x00', 'push'),   # no unmasked bytes
+            ('\x8b\xec', '\xff\xff', 'mov'),    # the suffix of another anchor
+        ]
+        for sbytes, smasks, val in sigs:
+            scanner.addSignature(sbytes, masks=smasks, val=val)
+        # duplicates are ignored
+        scanner.addSignature('\x55\x8b\xec', val='woot')
+
+        bytes = '\x90\x8b\xff\x55\x8b\xec\x6a\x01\x68\x41\x41\x41\x41\xe8\x53\x55\x8b'
+        matches = list(scanner.scan(bytes))
+        self.assertEqual(matches, self.bruteScan(sigs, bytes, 0, len(bytes)))
+        self.assertTrue( (1, 'hotpatch') in matches )
+        self.assertTrue( (3, 'ebp') in matches )
+        self.assertTrue( (4, 'mov') in matches )
+        self.assertTrue( (6, 'seh') in matches )
+        # the last "push ebp; mov ebp,..." is truncated
+        self.assertFalse( (15, 'ebp') in matches )
+
+        # only matches entirely within the offset/size are found
+        self.assertEqual(list(scanner.scan(bytes, offset=2, size=4)), [ (3, 'ebp'), (3, 'push'), (4, 'mov') ])
+
+    def test_bytesig_scan_random(self):
+        rand = random.Random(0x41)
+        alphabet = '\x00\x55\x8b\xec\xff\x6a\x90'
+
+        scanner = e_bytesig.SignatureScanner()
+        sigs = []
+        for i in xrange(60):
+            size = rand.randint(1, 8)
+            sbytes = ''.join([ rand.choice(alphabet) for j in xrange(size) ])
+            smasks = ''.join([ rand.choice('\xff\xff\xff\xf0\x00') for j in xrange(size) ])
+            # masked bits of sig bytes must be zero to ever match
+            sbytes = ''.join([ chr(ord(b) & ord(m)) for b, m in zip(sbytes, smasks) ])
+            if sbytes + smasks in [ s[0] + s[1] for s in sigs ]:
+                continue
+            sigs.append( (sbytes, smasks, i) )
+            scanner.addSignature(sbytes, masks=smasks, val=i)
+
+        bytes = ''.join([ rand.choice(alphabet) for j in xrange(4096) ])
+        self.assertEqual(list(scanner.scan(bytes, offset=7, size=4000)), self.bruteScan(sigs, bytes, 7, 4000))
+
+    def test_bytesig_tree_scan(self):
+        tree = e_bytesig.SignatureTree()
+        tree.addSignature('\x55\x8b\xec', val='ebp')
+        tree.addSignature('\x56\x8b\xf1', val='esi')
+
+        bytes = '\x90\x55\x8b\xec\x56\x8b\xf1\x90'
+        matches = list(tree.scanSignatures(bytes))
+        self.assertEqual(matches, [ (1, 'ebp'), (4, 'esi') ])
+        for offset, val in matches:
+            self.assertEqual(tree.getSignature(bytes, offset), val)
+
+        # adding a sig recompiles the scanner
+        tree.addSignature('\x90\x55', val='nop')
+        self.assertEqual(list(tree.scanSignatures(bytes)), [ (0, 'nop'), (1, 'ebp'), (4, 'esi') ])
@@ -0,0 +1,80 @@
+import struct
+import unittest
+
+import envi
+import envi.memory as e_mem
+import envi.codeflow as e_codeflow
+
+class FuncMemory(e_mem.MemoryObject):
+
+    def __init__(self):
+        e_mem.MemoryObject.__init__(self, arch=envi.ARCH_I386)
+        self.psize = 4
+        self.funcs = {}
+        self.parsed = []
+
+    def isFunction(self, va):
+        return self.funcs.get(va) != None
+
+    def parseOpcode(self, va, arch=envi.ARCH_DEFAULT):
+        self.parsed.append(va)
+        return e_mem.MemoryObject.parseOpcode(self, va, arch=arch)
+
+class FuncCodeFlow(e_codeflow.CodeFlowContext):
+
+    def __init__(self, mem, **kwargs):
+        e_codeflow.CodeFlowContext.__init__(self, mem, **kwargs)
+        self.funcorder = []
+
+    def _cb_function(self, fva, fmeta):
+        self._mem.funcs[fva] = fmeta
+        self.funcorder.append(fva)
+
+class CodeFlowTest(unittest.TestCase):
+
+    def getChainMemory(self, count):
+        # count functions which each "call <next>; ret" ( and a last ret )
+        mem = FuncMemory()
+        code = ('\xe8' + struct.pack('<i', 1) + '\xc3') * count + '\xc3'
+        mem.addMemoryMap(0x41410000, e_mem.MM_RWX, 'code', code + '\x00' * 16)
+        return mem
+
+    def test_codeflow_deep(self):
+        # Deep enough to blow the python stack if the flow recursed
+        count = 3000
+        mem = self.getChainMemory(count)
+        cf = FuncCodeFlow(mem)
+        cf.addEntryPoint(0x41410000)
+
+        fvas = [ 0x41410000 + (i * 6) for i in xrange(count + 1) ]
+        # deepest function callbacks come first
+        self.assertEqual(cf.funcorder, list(reversed(fvas)))
+        self.assertEqual(mem.funcs[fvas[0]]['CallsFrom'], [ fvas[1] ])
+        self.assertEqual(mem.funcs[fvas[-1]]['CallsFrom'], [])
+        self.assertEqual(cf.getCallsFrom(fvas[1]), [ fvas[2] ])
+
+    def test_codeflow_deref(self):
+        mem = FuncMemory()
+        # call [0x41410010]; ret ... 0x41410010: pointer to ret
+        code = '\xff\x15\x10\x00\x41\x41\xc3'.ljust(16, '\x00')
+        code += struct.pack('<I', 0x41410020).ljust(16, '\x00') + '\xc3'
+        mem.addMemoryMap(0x41410000, e_mem.MM_RWX, 'code', code + '\x00' * 16)
+
+        cf = FuncCodeFlow(mem)
+        self.assertEqual(cf.addCodeFlow(0x41410000), [ 0x41410020 ])
+        self.assertEqual(cf.funcorder, [ 0x41410020 ])
+
+    def test_codeflow_opdone(self):
+        mem = self.getChainMemory(3)
+
+        class DoneCodeFlow(FuncCodeFlow):
+            def _cb_opdone(self, va):
+                return va in self._mem.parsed
+
+        cf = DoneCodeFlow(mem)
+        cf.addCodeFlow(0x41410006)
+        parsed = list(mem.parsed)
+
+        # Only the opcodes which weren't already handled are decoded
+        cf.addEntryPoint(0x41410000)
+        self.assertEqual(mem.parsed[len(parsed):], [ 0x41410000, 0x41410005 ])
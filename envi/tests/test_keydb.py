@@ -0,0 +1,53 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import envi.keydb as e_keydb
+
+class KeyDbTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def getKeyDb(self, items, meta=None):
+        filename = os.path.join(self.tmpdir, 'test.keydb')
+        e_keydb.writeKeyDb(filename, items, meta=meta)
+        db = e_keydb.KeyDb(filename)
+        self.addCleanup(db.close)
+        return db
+
+    def test_keydb_lookups(self):
+        items = [ ('key%d' % i, 'val%d' % i * (i % 7)) for i in xrange(1000) ]
+        items.append( (u'unicode\u2026', 'woot') )
+        db = self.getKeyDb(items, meta={'strings':['a', None]})
+
+        self.assertEqual(len(db), 1001)
+        self.assertEqual(db.meta, {'strings':['a', None]})
+        for key, val in items:
+            self.assertEqual(db.get(key), val)
+
+        self.assertEqual(db.get('key1000'), None)
+        self.assertEqual(db.get('key1000', 'default'), 'default')
+        self.assertTrue('key10' in db)
+        self.assertFalse('key' in db)
+
+        self.assertEqual(sorted(db.items()), sorted([ (k.encode('utf8'), v) for (k, v) in items ]))
+
+    def test_keydb_empty(self):
+        db = self.getKeyDb([])
+        self.assertEqual(len(db), 0)
+        self.assertEqual(db.meta, None)
+        self.assertEqual(db.get('woot'), None)
+        self.assertEqual(db.items(), [])
+
+    def test_keydb_bad(self):
+        filename = os.path.join(self.tmpdir, 'bad.keydb')
+        with open(filename, 'wb') as fd:
+            fd.write('\x00' * 256)
+        self.assertRaises(Exception, e_keydb.KeyDb, filename)
+
+        self.assertRaises(Exception, e_keydb.writeKeyDb, filename, [ ('woot', 'A' * 0x10000) ])
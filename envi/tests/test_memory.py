@@ -1,6 +1,9 @@
 import unittest
 
+import envi
 import envi.memory as e_mem
+import envi.pagelookup as e_page
+import envi.transcache as e_tcache
 
 class EnviMemoryTest(unittest.TestCase):
 
@@ -18,3 +21,143 @@ class EnviMemoryTest(unittest.TestCase):
         self.assertEqual(mem.readMemory(0x41410040, 3), 'BBB')
         # Test a cross page read
         self.assertEqual(mem.readMemory(0x41410000 + (cache.pagesize - 2), 4), 'BBBB')
+
+    def test_envi_memory_paged(self):
+        mem = e_mem.PagedMemoryObject(pagesize=4096)
+        mem.addMemoryMap(0x41410000, e_mem.MM_RWX, 'stack', 'B'*16384)
+        mem.addMemoryMap(0x41414000, e_mem.MM_RWX, 'heap', 'C'*16384)
+
+        # A cross page write, untouched pages come from the base bytes
+        mem.writeMemory(0x41410ffe, 'VISI')
+        self.assertEqual(mem.readMemory(0x41410ffd, 6), 'BVISIB')
+        self.assertEqual(len(mem.getDirtyPages()), 2)
+
+        # A write off the end of a map continues into the next one
+        mem.writeMemory(0x41413fff, 'XY')
+        self.assertEqual(mem.readMemory(0x41413ffe, 2), 'BX')
+        self.assertEqual(mem.readMemory(0x41414000, 2), 'YC')
+
+        snap = mem.getMemorySnap()
+        mem.writeMemory(0x41410fff, 'WOOT')
+        self.assertEqual(mem.readMemory(0x41410ffe, 6), 'VWOOTB')
+
+        # Restoring must not see writes made after the snapshot (shared pages)
+        mem.setMemorySnap(snap)
+        self.assertEqual(mem.readMemory(0x41410ffe, 6), 'VISIBB')
+        mem.writeMemory(0x41410ffe, 'AA')
+        mem.setMemorySnap(snap)
+        self.assertEqual(mem.readMemory(0x41410ffe, 6), 'VISIBB')
+
+        offset, bytez = mem.getByteDef(0x41410ffe)
+        self.assertEqual(offset, 0xffe)
+        self.assertEqual(len(bytez), 16384)
+        self.assertEqual(bytez[offset:offset+4], 'VISI')
+
+    def test_envi_pagelookup_ranges(self):
+        rl = e_page.RangeLookup()
+        rl.addRangeLookup(0x3000, 0x4000, 'c')
+        rl.addRangeLookup(0x1000, 0x2000, 'a')
+        rl.addRangeLookup(0x2000, 0x2800, 'b')
+        rl.addRangeLookup(0x5000, 0x5000, 'empty')
+
+        self.assertIsNone(rl.getRangeLookup(0xfff))
+        self.assertEqual(rl.getRangeLookup(0x1000)[2], 'a')
+        self.assertEqual(rl.getRangeLookup(0x1fff)[2], 'a')
+        self.assertEqual(rl.getRangeLookup(0x2000)[2], 'b')
+        self.assertIsNone(rl.getRangeLookup(0x2800))
+        self.assertEqual(rl.getRangeLookup(0x3fff)[2], 'c')
+        self.assertIsNone(rl.getRangeLookup(0x5000))
+
+        rl.delRangeLookup(0x2000)
+        self.assertIsNone(rl.getRangeLookup(0x2000))
+        self.assertEqual([ r[2] for r in rl.getRangeLookups() ], ['a', 'c'])
+
+        ml = e_page.MapLookup()
+        ml.initMapLookup(0x41410000, 0x100)
+        ml.initMapLookup(0x41400000, 0x100)
+        ml.setMapLookup(0x41400010, 4, 'woot')
+        self.assertEqual(ml.getMapLookup(0x41400013), 'woot')
+        self.assertIsNone(ml.getMapLookup(0x41400014))
+        self.assertIsNone(ml.getMapLookup(0x41400100))
+        self.assertRaises(Exception, ml.setMapLookup, 0x41400100, 1, 'x')
+
+    def test_envi_memory_nested_maps(self):
+        # Overlapping maps resolve to the first one added
+        mem = e_mem.MemoryObject()
+        mem.addMemoryMap(0x1800, e_mem.MM_RWX, 'small', 's' * 0x100)
+        mem.addMemoryMap(0x1000, e_mem.MM_RWX, 'big', 'b' * 0x3000)
+
+        self.assertEqual(mem.getMemoryMap(0x1850)[3], 'small')
+        self.assertEqual(mem.getMemoryMap(0x2000)[3], 'big')
+        self.assertEqual(mem.getMemoryMap(0x1850)[3], 'small')
+        self.assertEqual(mem.getMemoryMap(0x1000)[3], 'big')
+        self.assertTrue(mem.isValidPointer(0x2000))
+        self.assertFalse(mem.isValidPointer(0x4000))
+        self.assertEqual(mem.readMemory(0x18ff, 1), 's')
+        self.assertEqual(mem.readMemory(0x1900, 1), 'b')
+
+        rl = e_page.RangeLookup()
+        rl.addRangeLookup(0x1000, 0x4000, 'big')
+        rl.addRangeLookup(0x1800, 0x1900, 'small')
+        self.assertEqual(rl.getRangeLookup(0x1850)[2], 'big')
+        rl.delRangeLookup(0x1000)
+        self.assertEqual(rl.getRangeLookup(0x1850)[2], 'small')
+        self.assertIsNone(rl.getRangeLookup(0x2000))
+        self.assertFalse(rl._rl_overlap)
+
+    def test_envi_emu_transcache(self):
+        emu = envi.getArchModule('i386').getEmulator()
+        # inc eax; inc eax; ret
+        emu.addMemoryMap(0x41410000, e_mem.MM_RWX, 'code', '\x40\x40\xc3' + '\x90' * 8192)
+
+        op = emu.parseOpcode(0x41410000)
+        self.assertEqual(op.mnem, 'inc')
+        # the rest of the block was translated too
+        self.assertEqual(len(emu._emu_tcache), 3)
+        self.assertIs(emu.parseOpcode(0x41410001), emu._emu_tcache.getOpcode(0x41410001))
+
+        snap = emu.getEmuSnap()
+
+        # self modifying code must not use the translations
+        emu.writeMemory(0x41410001, '\x48')
+        self.assertEqual(emu.parseOpcode(0x41410001).mnem, 'dec')
+        self.assertEqual(emu.parseOpcode(0x41410000).mnem, 'inc')
+
+        emu.setProgramCounter(0x41410000)
+        emu.setRegister(envi.archs.i386.REG_EAX, 10)
+        emu.stepi()
+        emu.stepi()
+        self.assertEqual(emu.getRegister(envi.archs.i386.REG_EAX), 10)
+
+        # restoring a snapshot (even from another emulator) is the same
+        emu2 = envi.getArchModule('i386').getEmulator()
+        emu2.addMemoryMap(0x41410000, e_mem.MM_RWX, 'code', '\x40\x40\xc3' + '\x90' * 8192)
+        emu2.setEmuSnap(emu.getEmuSnap())
+        self.assertEqual(emu2.parseOpcode(0x41410001).mnem, 'dec')
+
+        emu.setEmuSnap(snap)
+        self.assertEqual(emu.readMemory(0x41410001, 1), '\x40')
+        self.assertEqual(emu.parseOpcode(0x41410001).mnem, 'inc')
+
+    def test_envi_opcode_cache(self):
+        opcache = e_tcache.OpcodeCache(maxsize=4)
+        self.assertIsNone(opcache.getOpcode(0x1000, 'i386'))
+
+        opcache.addOpcode(0x1000, 'i386', 'a')
+        opcache.addOpcode(0x1000, 'amd64', 'b')
+        opcache.addOpcode(0x2000, 'i386', 'c')
+        self.assertEqual(opcache.getOpcode(0x1000, 'i386'), 'a')
+
+        # the least recently used entries are evicted
+        opcache.addOpcode(0x3000, 'i386', 'd')
+        opcache.addOpcode(0x4000, 'i386', 'e')
+        self.assertIsNone(opcache.getOpcode(0x1000, 'amd64'))
+        self.assertEqual(opcache.getOpcode(0x1000, 'i386'), 'a')
+        self.assertEqual(opcache.getOpcode(0x4000, 'i386'), 'e')
+        self.assertEqual(opcache.getStats(), {'hits':3, 'misses':2, 'size':3, 'maxsize':4})
+
+        # adds which race with a clear are dropped
+        gen = opcache.generation
+        opcache.clearCache()
+        opcache.addOpcode(0x3000, 'i386', 'd', gen=gen)
+        self.assertEqual(len(opcache), 0)
@@ -1,7 +1,13 @@
-import envi.symstore.resolver as e_sym_resolv
-
+import os
+import json
+import random
+import shutil
+import tempfile
 import unittest
 
+import envi.symstore.symcache as e_symcache
+import envi.symstore.resolver as e_sym_resolv
+
 class SymResolverTests(unittest.TestCase):
     def setUp(self):
         self.symres = e_sym_resolv.SymbolResolver()
@@ -58,3 +64,79 @@ class SymResolverTests(unittest.TestCase):
         # boom.
         sym = self.symres.getSymByAddr(0x16010, exact=False)
         assert(sym != None)
+
+    def test_getSymByAddr_nearest(self):
+        symcache = [
+            (0x1000, 0, 'unsized', e_sym_resolv.SYMSTOR_SYM_SYMBOL),
+            (0x20000, 0x10000, 'section', e_sym_resolv.SYMSTOR_SYM_SECTION),
+            (0x20100, 0x100, 'func', e_sym_resolv.SYMSTOR_SYM_FUNCTION),
+            (0x28000, 0, 'inner', e_sym_resolv.SYMSTOR_SYM_SYMBOL),
+        ]
+        self.symres.impSymCache(symcache, baseaddr=0x40000000)
+        base = 0x40000000
+
+        self.assertEqual(self.symres.getSymByAddr(base + 0x10, exact=False), None)
+        self.assertEqual(self.symres.getSymByAddr(base + 0x1001), None)
+        # more than 8k away from an unsized symbol
+        self.assertEqual(self.symres.getSymByAddr(base + 0x1f000, exact=False).name, 'unsized')
+
+        self.assertEqual(self.symres.getSymByAddr(base + 0x20010, exact=False).name, 'section')
+        self.assertEqual(self.symres.getSymByAddr(base + 0x201ff, exact=False).name, 'func')
+        # past the end of func but still in the section
+        self.assertEqual(self.symres.getSymByAddr(base + 0x20200, exact=False).name, 'section')
+        self.assertEqual(self.symres.getSymByAddr(base + 0x2ffff, exact=False).name, 'inner')
+        # unsized symbols only reach to the end of the range they are in
+        self.assertEqual(self.symres.getSymByAddr(base + 0x30000, exact=False), None)
+
+        vas = [ base + 0x201ff, base + 0x10, base + 0x201ff, base + 0x20100 ]
+        syms = self.symres.getSymsByAddrs(vas, exact=False)
+        self.assertEqual([ s and s.name for s in syms ], ['func', None, 'func', 'func'])
+        self.assertEqual(self.symres.getSymsByAddrs(vas), [ None, None, None, syms[0] ])
+
+        self.symres.delSymbol(self.symres.getSymByName('func'))
+        self.assertEqual(self.symres.getSymByAddr(base + 0x201ff, exact=False).name, 'section')
+
+    def getSymCache(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        return e_symcache.SymbolCache(dirname=tmpdir)
+
+    def test_symcache_file(self):
+        rand = random.Random(10)
+        symtups = [ (0, 0x100000, 'woot', e_sym_resolv.SYMSTOR_SYM_SECTION) ]
+        for i in xrange(2000):
+            size = rand.choice([ 0, 0, rand.randint(1, 0x100) ])
+            symtups.append( (rand.randint(0, 0x110000), size, 'Sym_%d' % i, e_sym_resolv.SYMSTOR_SYM_FUNCTION) )
+
+        symcache = self.getSymCache()
+        symcache.setCacheSyms('pe.woot', symtups)
+        self.assertEqual(sorted(symcache.getCacheSyms('pe.woot')), sorted(symtups))
+        self.assertIsNone(symcache.getCacheSyms('pe.nope'))
+
+        # older json caches are upgraded when mapped
+        with open(os.path.join(symcache._sym_cachedir, 'pe.json'), 'wb') as fd:
+            json.dump(symtups, fd)
+        self.assertEqual(sorted(map(tuple, symcache.getCacheSyms('pe.json'))), sorted(symtups))
+        symfile = symcache.getCacheFile('pe.json')
+        self.addCleanup(symfile.close)
+        self.assertTrue(e_symcache.isSymCacheFile(os.path.join(symcache._sym_cachedir, 'pe.json')))
+
+        # resolvers answer the same from the mapped file as from tuples
+        base = 0x41410000
+        tupres = e_sym_resolv.SymbolResolver(casesens=False)
+        fileres = e_sym_resolv.SymbolResolver(casesens=False)
+        for res in (tupres, fileres):
+            res.addSymbol(e_sym_resolv.FileSymbol('foo', base, 0, width=4))
+        tupres.impSymCache(symtups, symfname='foo', baseaddr=base)
+        fileres.impSymCacheFile(symfile, symfname='foo', baseaddr=base)
+
+        for i in xrange(3000):
+            va = base + rand.randint(0, 0x120000)
+            for exact in (True, False):
+                self.assertEqual(repr(tupres.getSymByAddr(va, exact=exact)), repr(fileres.getSymByAddr(va, exact=exact)))
+
+        for name in ('Sym_10', 'sym_1999', 'Sym_2001'):
+            self.assertEqual(repr(tupres.getSymByName('foo').getSymByName(name)), repr(fileres.getSymByName('foo').getSymByName(name)))
+
+        self.assertEqual(fileres.getSymByName('foo').Sym_77.value, base + symtups[78][0])
+        self.assertEqual(len(fileres.getSymByName('foo').getSymList()), len(tupres.getSymByName('foo').getSymList()))
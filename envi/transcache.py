@@ -0,0 +1,146 @@
+'''
+A translated block cache for emulators.
+
+Emulators spend much of their time re-decoding the same instructions
+(every branch path of every function re-runs the same blocks).  The
+TranslationCache holds the opcodes decoded from the *original* bytes of
+an emulator's memory maps (never from pages it has written to), so
+entries never go stale and may be shared by any emulators which were
+created from the same memory maps (see WorkspaceEmulator).
+
+Whenever an instruction is decoded, the rest of its straight line block
+(up to the next branch/call/return) is decoded along with it.
+
+The OpcodeCache is a bounded (least recently used) cache of the opcodes
+decoded from a memory object by (va, arch) which its owner clears when
+the memory changes (see VivWorkspace.parseOpcode).  It may be shared by
+emulators built from the same memory (see Emulator.setOpcodeCache).
+'''
+import threading
+
+import envi
+
+# Instructions which end a translated block
+BLOCK_END_FLAGS = envi.IF_NOFALL | envi.IF_BRANCH | envi.IF_CALL | envi.IF_RET
+
+# The number of bytes read to decode an instruction
+OPCODE_WINDOW = 16
+
+class TranslationCache:
+
+    def __init__(self, maxblock=32, maxsize=0x40000):
+        self.maxblock = maxblock
+        self.maxsize = maxsize
+        self._tc_ops = {}
+
+    def __len__(self):
+        return len(self._tc_ops)
+
+    def getOpcode(self, va):
+        '''
+        Return the cached opcode for va (or None).
+        '''
+        return self._tc_ops.get(va)
+
+    def addBlock(self, ops):
+        '''
+        Add a list of decoded opcodes to the cache.
+        '''
+        if len(self._tc_ops) >= self.maxsize:
+            self._tc_ops.clear()
+
+        for op in ops:
+            self._tc_ops[op.va] = op
+
+    def clearCache(self):
+        self._tc_ops.clear()
+
+class OpcodeCache:
+    '''
+    A bounded (approximately) least recently used cache of decoded
+    opcodes keyed by (va, arch name).
+
+    The entries are kept in two generations of dicts: new entries ( and
+    hits from the old generation ) go in the new generation, and once it
+    holds maxsize/2 entries the old generation is discarded and the new
+    one takes its place.  ( Much cheaper than keeping an exact LRU order
+    on every lookup. )
+
+    The owner of the cache must call clearCache() whenever the bytes or
+    maps of its memory change.  Each clear bumps the cache "generation"
+    so sharers of the cache (and adds racing with a clear) can tell that
+    the cache no longer describes the bytes they decoded from.
+
+    Example:
+        gen = opcache.generation
+        op = opcache.getOpcode(va, archname)
+        if op is None:
+            op = archmod.archParseOpcode(bytez, off, va)
+            opcache.addOpcode(va, archname, op, gen=gen)
+    '''
+    def __init__(self, maxsize=0x8000):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.generation = 0
+        self._oc_new = {}
+        self._oc_old = {}
+        # Only adds/clears lock ( so an add may not race a clear )
+        self._oc_lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._oc_new) + len(self._oc_old)
+
+    def getOpcode(self, va, arch):
+        '''
+        Return the cached opcode for (va, arch) (or None).
+        '''
+        key = (va, arch)
+        # ( "is None" because opcodes implement a costly __eq__ )
+        op = self._oc_new.get(key)
+        if op is None:
+            op = self._oc_old.pop(key, None)
+            if op is None:
+                self.misses += 1
+                return None
+
+            with self._oc_lock:
+                self._addOpcode(key, op)
+
+        self.hits += 1
+        return op
+
+    def addOpcode(self, va, arch, op, gen=None):
+        '''
+        Add a decoded opcode to the cache.  If gen is specified, the
+        opcode is only added if the cache has not been cleared since
+        gen ( the cache generation before the bytes were read ).
+        '''
+        with self._oc_lock:
+            if gen != None and gen != self.generation:
+                return
+            self._addOpcode((va, arch), op)
+
+    def _addOpcode(self, key, op):
+        new = self._oc_new
+        if len(new) >= self.maxsize / 2:
+            self._oc_old = new
+            new = self._oc_new = {}
+        new[key] = op
+
+    def clearCache(self):
+        with self._oc_lock:
+            self.generation += 1
+            self._oc_new = {}
+            self._oc_old = {}
+
+    def getStats(self):
+        '''
+        Return a dict of the cache hit/miss counts and size.
+        '''
+        return {
+            'hits':self.hits,
+            'misses':self.misses,
+            'size':len(self),
+            'maxsize':self.maxsize,
+        }
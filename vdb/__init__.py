@@ -30,6 +30,7 @@ import envi.cli as e_cli
 import envi.bits as e_bits
 import envi.memory as e_mem
 import envi.config as e_config
+import envi.defconfig as e_defconfig
 import envi.memcanvas as e_canvas
 import envi.symstore.resolver as e_resolv
 
@@ -113,38 +114,8 @@ class VdbTrace:
     def __getattr__(self, name):
         return getattr(self.db.getTrace(), name)
 
-defconfig = {
-
-    'vdb':{
-        'BreakOnEntry':False,
-        'BreakOnMain':False,
-
-        'SymbolCacheActive':True,
-        'SymbolCachePath':e_config.gethomedir('.envi','symcache'),
-
-        'KillOnQuit': False,
-    },
-
-    'cli':{
-        'verbose':False,
-        'aliases': {
-            '<f1>':'stepi',
-            '<f2>':'go -I 1',
-            '<f5>':'go',
-        }
-    },
-
-}
-
-docconfig = {
-    'vdb':{
-        'BreakOnMain':'Should the debugger break on main() if known?',
-        'BreakOnEntry':'Should the debugger break on the entry to the main module? (only works if you exec (and not attach to) the process)',
-
-        'SymbolCacheActive':'Should we cache symbols for subsequent loads?',
-        'SymbolCachePaths':'Path elements ( ; seperated) to search/cache symbols (filepath,cobra)',
-    }
-}
+defconfig = e_defconfig.defconfig
+docconfig = e_defconfig.docconfig
 
 class WrapExcThread(threading.Thread):
     '''
@@ -745,9 +716,7 @@ class Vdb(e_cli.EnviMutableCli, v_notif.Notifier, v_util.TraceManager):
         t = self.trace
         t.requireAttached()
         self.vprint("Taking Snapshot...")
-        snap = vs_snap.takeSnapshot(t)
-        self.vprint("Saving To File")
-        snap.saveToFile(alist[0])
+        snap = vs_snap.takeSnapshot(t, filename=alist[0])
         self.vprint("Done")
         snap.release()
 
@@ -1594,10 +1563,15 @@ class Vdb(e_cli.EnviMutableCli, v_notif.Notifier, v_util.TraceManager):
         Usage: bt
         """
         self.vprint("      [   PC   ] [ Frame  ] [ Location ]")
-        idx = 0
-        for pc,frame in self.trace.getStackTrace():
-            self.vprint("[%3d] 0x%.8x 0x%.8x %s" % (idx,pc,frame,self.reprPointer(pc)))
-            idx += 1
+        frames = self.trace.getStackTrace()
+        syms = self.trace.getSymsByAddrs([ pc for pc,frame in frames ], exact=False)
+        for idx,(pc,frame) in enumerate(frames):
+            sym = syms[idx]
+            if pc and sym != None:
+                loc = "%s + %d" % (repr(sym),pc-long(sym))
+            else:
+                loc = self.reprPointer(pc)
+            self.vprint("[%3d] 0x%.8x 0x%.8x %s" % (idx,pc,frame,loc))
 
     def do_lm(self, args):
         """
@@ -3,6 +3,7 @@ Graphcore contains all the base graph manipulation objects.
 '''
 import os
 import json
+import heapq
 import itertools
 import threading
 import collections
@@ -24,6 +25,31 @@ def ldict():
 def pdict():
     return collections.defaultdict(ldict)
 
+class NodeBits(dict):
+    '''
+    A lazily populated { nid: bitidx } dict used to build (python long)
+    bitsets of the nodes in a path for loop detection.
+
+    Example:
+        nbits = NodeBits()
+        mask |= 1 << nbits[nid]
+    '''
+    def __missing__(self, nid):
+        idx = self[nid] = len(self)
+        return idx
+
+def unwindPath(plink):
+    '''
+    Searches build paths as (prevlink, elem) linked tuples (ending in
+    None) so extending one is O(1).  Return the list of elems.
+    '''
+    ret = []
+    while plink != None:
+        plink, elem = plink
+        ret.append(elem)
+    ret.reverse()
+    return ret
+
 class Graph:
 
     '''
@@ -529,18 +555,17 @@ class Graph:
                 
 
     def pathSearchOne(self, *args, **kwargs):
-        for p in self.pathSearch(*args, **kwargs):
-            return p
+        return self.pathSearchShortest(*args, **kwargs)
 
-    def pathSearch(self, n1, n2=None, edgecb=None, tocb=None):
+    def pathSearch(self, n1, n2=None, edgecb=None, tocb=None, maxdepth=None, maxpath=None):
         '''
-        Search for the shortest path from one node to another
-        with the option to filter based on edges using
-        edgecb.  edgecb should be a function:
+        Search for the (loop free) paths from one node to another
+        with the option to filter based on edges using edgecb.
+        edgecb should be a function:
 
-        def myedgecb(graph, eid, n1, n2, depth)
+        def myedgecb(graph, edge, depth)
 
-        which returns True if it's OK to traverse this node
+        which returns True if it's OK to traverse this edge
         in the search.
 
         Additionally, n2 may be None and the caller may specify
@@ -550,28 +575,35 @@ class Graph:
 
         which must return True on finding the target node
 
-        Returns a list of edge ids...
-        '''
+        Options:
+            maxdepth - maximum number of edges in a path
+            maxpath  - maximum number of paths to yield
 
+        Yields lists of edge ids...
+
+        NOTE: paths are walked depth first (to keep memory use down) so
+              use pathSearchShortest or pathSearchKShortest for paths
+              in order of length.
+        '''
         if n2 == None and tocb == None:
             raise Exception('You must use either n2 or tocb!')
 
-        root = vg_pathcore.newPathNode(nid=n1, eid=None)
+        nbits = NodeBits()
 
-        todo = [(root, 0),]
-
-        # FIXME make this a deque so it can be FIFO
-        while len(todo):
+        cnt = 0
+        todo = collections.deque([ (n1, None, 1 << nbits[n1], 0) ]) # [ nid, plink, nodemask, depth ]
+        while todo:
 
-            pnode,depth = todo.pop() # popleft()
-            ppnode, pkids, pprops = pnode
+            nid, plink, mask, depth = todo.pop()
+            if maxdepth != None and depth >= maxdepth:
+                continue
 
-            nid = pprops.get('nid')
             for edge in self.getRefsFromByNid(nid):
 
                 eid, srcid, dstid, eprops = edge
 
-                if vg_pathcore.isPathLoop(pnode, 'nid', dstid):
+                bit = 1 << nbits[dstid]
+                if mask & bit:
                     continue
 
                 # Check if the callback is present and likes us...
@@ -579,39 +611,140 @@ class Graph:
                     if not edgecb(self, edge, depth):
                         continue
 
+                newlink = (plink, eid)
+
                 # Are we the match?
-                match = False
-                if dstid == n2:
-                    match = True
+                if dstid == n2 or (tocb and tocb(self, dstid)):
+                    yield unwindPath(newlink)
 
-                if tocb and tocb(self, dstid):
-                    match = True
+                    cnt += 1
+                    if maxpath != None and cnt >= maxpath:
+                        return
 
-                if match:
+                # Add the next set of choices to evaluate.
+                todo.append( (dstid, newlink, mask | bit, depth + 1) )
 
-                    m = vg_pathcore.newPathNode(pnode, nid=dstid, eid=eid)
-                    path = vg_pathcore.getPathToNode(m)
+    def _pathSearchShortest(self, n1, ismatch, edgecb=None, depth=0, maxdepth=None, skipnids=(), skipeids=()):
+        # Breadth first search with a visited set, returning the list
+        # of edges in the shortest path (or None)
+        visited = set(skipnids)
+        visited.add(n1)
 
-                    ret = []
-                    for ppnode, pkids, pprops in path:
-                        eid = pprops.get('eid')
-                        if eid != None:
-                            ret.append(eid)
+        todo = collections.deque([ (n1, None, depth) ])
+        while todo:
 
-                    yield ret
+            nid, plink, depth = todo.popleft()
+            if maxdepth != None and depth >= maxdepth:
+                continue
 
-                # Add the next set of choices to evaluate.
-                branch = vg_pathcore.newPathNode(pnode, nid=dstid, eid=eid)
-                todo.append((branch, depth+1))
+            for edge in self.getRefsFromByNid(nid):
+
+                dstid = edge[2]
+                if dstid in visited or edge[0] in skipeids:
+                    continue
+
+                if edgecb != None and not edgecb(self, edge, depth):
+                    continue
+
+                newlink = (plink, edge)
+                if ismatch(dstid):
+                    return unwindPath(newlink)
+
+                visited.add(dstid)
+                todo.append( (dstid, newlink, depth + 1) )
+
+        return None
+
+    def _getMatchCallback(self, n2, tocb):
+        if n2 == None and tocb == None:
+            raise Exception('You must use either n2 or tocb!')
+
+        def ismatch(nid):
+            return nid == n2 or (tocb != None and tocb(self, nid))
+        return ismatch
+
+    def pathSearchShortest(self, n1, n2=None, edgecb=None, tocb=None, maxdepth=None):
+        '''
+        Return the list of edge ids for the shortest path from one node
+        to another (or None).  See pathSearch for edgecb/tocb.
+
+        NOTE: each node is only visited once, so this is O(nodes+edges)
+              (where pathSearch may walk every path).
+        '''
+        ismatch = self._getMatchCallback(n2, tocb)
+        path = self._pathSearchShortest(n1, ismatch, edgecb=edgecb, maxdepth=maxdepth)
+        if path == None:
+            return None
+        return [ edge[0] for edge in path ]
+
+    def pathSearchKShortest(self, n1, n2=None, k=None, edgecb=None, tocb=None, maxdepth=None):
+        '''
+        Yield the lists of edge ids for the k shortest (loop free) paths
+        from one node to another, shortest first.  See pathSearch for
+        edgecb/tocb.  If k is None, all the paths are (lazily) yielded.
+
+        ( this is Yen's algorithm, so each path costs a handful of
+          pathSearchShortest() runs rather than a walk of every path )
+        '''
+        ismatch = self._getMatchCallback(n2, tocb)
+
+        path = self._pathSearchShortest(n1, ismatch, edgecb=edgecb, maxdepth=maxdepth)
+        if path == None:
+            return
+
+        cnt = 0
+        found = [ path ]
+        seen = set([ tuple([ edge[0] for edge in path ]) ])
+        candidates = []
+        tiebreak = itertools.count()
+
+        while True:
+
+            yield [ edge[0] for edge in path ]
+
+            cnt += 1
+            if k != None and cnt >= k:
+                return
 
-        #return []
+            # Each node of the last path may "spur" off to a new path
+            for i in xrange(len(path)):
+
+                rootpath = path[:i]
+                spurnid = path[i][1]
+
+                # Don't re-find the paths which share this root path
+                skipeids = set([ p[i][0] for p in found if len(p) > i and p[:i] == rootpath ])
+                skipnids = [ edge[1] for edge in rootpath ]
+
+                spur = self._pathSearchShortest(spurnid, ismatch, edgecb=edgecb, depth=i,
+                                                maxdepth=maxdepth, skipnids=skipnids,
+                                                skipeids=skipeids)
+                if spur == None:
+                    continue
+
+                newpath = rootpath + spur
+                key = tuple([ edge[0] for edge in newpath ])
+                if key in seen:
+                    continue
+
+                seen.add(key)
+                heapq.heappush(candidates, (len(newpath), tiebreak.next(), newpath))
+
+            if not candidates:
+                return
+
+            path = heapq.heappop(candidates)[2]
+            found.append(path)
 
     def pathSearchFrom(self, n1, nodecb, edgecb=None):
         '''
         Search from the specified node (breadth first) until you
         find a node where nodecb(graph, nid) == True.  See
-        pathSearchFromTo for docs on edgecb...
+        pathSearch for docs on edgecb...
+
+        Returns the list of edge ids for the path (or None).
         '''
+        return self.pathSearchShortest(n1, tocb=nodecb, edgecb=edgecb)
 
 class HierGraph(Graph):
     '''
@@ -741,19 +874,19 @@ class HierGraph(Graph):
                     checkstuff(node,edge)
         '''
         cnt = 0
-        todo = [(node,[],[node[0],])] # [ node, path, nids ]
+        nbits = NodeBits()
+        todo = [(node, None, 0, 1 << nbits[node[0]], [node[0],])] # [ node, plink, pathlen, nodemask, nids ]
 
         while todo:
 
-            # nids is a speed hack...
-            pnode,path,nids = todo.pop()
+            # nodemask is a speed hack ( nids only matter for loopcnt )
+            pnode,plink,plen,mask,nids = todo.pop()
 
             edges = self.getRefsFrom(pnode)
 
             if len(edges) == 0: # leaf/root...
 
-                path.append( (pnode,None) )
-                yield path
+                yield unwindPath( (plink, (pnode,None)) )
 
                 cnt += 1
                 if maxpath != None and cnt >= maxpath:
@@ -761,19 +894,17 @@ class HierGraph(Graph):
 
                 continue
 
-            if maxlen and len(path) >= maxlen:
+            if maxlen and plen >= maxlen:
                 continue
 
             for edge in edges:
-                # yep... coppies...
-                # ( still faster than keeping/culling tree )
-                newpath = list(path)
-                newpath.append((pnode,edge))
+                newlink = (plink, (pnode,edge))
 
                 etoid = edge[2]
-                if nids.count(etoid) > loopcnt:
+                bit = 1 << nbits[etoid]
+                if mask & bit and (not loopcnt or nids.count(etoid) > loopcnt):
 
-                    yield newpath
+                    yield unwindPath(newlink)
 
                     cnt += 1
                     if maxpath != None and cnt >= maxpath:
@@ -781,11 +912,13 @@ class HierGraph(Graph):
 
                     continue
 
-                newnids = list(nids)
-                newnids.append(etoid)
+                newnids = nids
+                if loopcnt:
+                    newnids = list(nids)
+                    newnids.append(etoid)
 
                 nnode = self.getNode(etoid)
-                todo.append((nnode,newpath,newnids))
+                todo.append((nnode,newlink,plen+1,mask | bit,newnids))
 
     def getHierPathsThru(self, node, maxpath=None, maxlen=None):
         '''
@@ -808,16 +941,17 @@ class HierGraph(Graph):
         (See getHierPathsFrom for details )
         '''
         cnt = 0
-        todo = [(node,[(node,None)],[node[0],])] # [ node, path, nids ]
+        nbits = NodeBits()
+        todo = [(node, (None, (node,None)), 1, 1 << nbits[node[0]])] # [ node, plink, pathlen, nodemask ]
 
         while todo:
 
-            # nids is a speed hack...
-            pnode,path,nids = todo.pop()
+            pnode,plink,plen,mask = todo.pop()
 
             edges = self.getRefsTo(pnode)
             if len(edges) == 0: # leaf/root...
 
+                path = unwindPath(plink)
                 path.reverse()
                 yield path
 
@@ -827,22 +961,14 @@ class HierGraph(Graph):
 
                 continue
 
-            if maxlen and len(path) >= maxlen:
+            if maxlen and plen >= maxlen:
                 continue
 
             for edge in edges:
-                # yep... coppies...
-                # ( still faster than keeping/culling tree )
                 etoid = edge[1]
-                nnode = self.getNode(etoid)
-
-                newpath = list(path)
-                newpath.append((nnode,edge))
-
-                if etoid in nids:
+                bit = 1 << nbits[etoid]
+                if mask & bit:
                     continue
 
-                newnids = list(nids)
-                newnids.append(etoid)
-
-                todo.append((nnode,newpath,newnids))
+                nnode = self.getNode(etoid)
+                todo.append((nnode,(plink,(nnode,edge)),plen+1,mask | bit))
@@ -8,9 +8,47 @@ import visgraph.layouts as vg_layouts
 # coulomb's constant approximation
 ke = 8.98755
 
+# The most nodes in a quadtree leaf ( and the smallest leaf, which may
+# hold more when nodes are on top of each other )
+qt_leafmax = 8
+qt_minsize = 1.0
+
 def irand():
     return random.randint(100, 200)
 
+def buildQuadTree(xs, ys, idxs, x0, y0, size):
+    '''
+    Build a (Barnes-Hut) quadtree for the node indexes idxs whose
+    positions ( xs[i], ys[i] ) are within the square at x0, y0 of the
+    given size.  Each tree node is a tuple of:
+
+        ( count, comx, comy, x0, y0, size, children, idxs )
+
+    where comx/comy is the center of "mass" of the nodes and children
+    is None for a leaf ( which holds its node indexes ).
+    '''
+    count = len(idxs)
+    comx = sum([ xs[i] for i in idxs ]) / count
+    comy = sum([ ys[i] for i in idxs ]) / count
+
+    if count <= qt_leafmax or size <= qt_minsize:
+        return (count, comx, comy, x0, y0, size, None, idxs)
+
+    half = size / 2.0
+    xmid = x0 + half
+    ymid = y0 + half
+
+    quads = ( [], [], [], [] )
+    for i in idxs:
+        quads[ (xs[i] >= xmid) | ((ys[i] >= ymid) << 1) ].append(i)
+
+    kids = []
+    for q, qidxs in enumerate(quads):
+        if qidxs:
+            kids.append( buildQuadTree(xs, ys, qidxs, x0 + half * (q & 1), y0 + half * (q >> 1), half) )
+
+    return (count, comx, comy, x0, y0, size, kids, None)
+
 class vector:
 
     def __init__(self, force=0.0, angle=0.0):
@@ -55,6 +93,7 @@ class ForceLayout(vg_layouts.GraphLayout):
         #self._f_minforce = 4        # When is the graph "stable enough"
         self._f_springrate = 0.1    # Used in hooke calcs
         self._f_minavgforce = 0.25
+        self._f_theta = 0.5         # Barnes-Hut approximation threshold
 
     def setMaxTickMove(self, mmax):
         '''
@@ -64,6 +103,15 @@ class ForceLayout(vg_layouts.GraphLayout):
         '''
         self._f_mmax = mmax
 
+    def setBarnesHutTheta(self, theta):
+        '''
+        Set the Barnes-Hut threshold for the repulsion calculations.  A
+        group of nodes whose (quadtree) square is smaller than theta times
+        its distance from a node repels it as one node.  Larger values
+        are faster and less accurate ( 0 calculates every node pair ).
+        '''
+        self._f_theta = theta
+
     def getLayoutSize(self):
         return 99999,99999
 
@@ -127,13 +175,24 @@ class ForceLayout(vg_layouts.GraphLayout):
             #self._shiftGraphLayout( graph, offset - x, 0 - y )
             #offset += ( xmax - x )
 
+        self._setClusterPositions( cgraphs )
+
         # Now lets calculate some straight line edges
         self._setEdgePoints()
 
     def _shiftGraphLayout(self, graph, dx, dy):
-        nodes = graph.getNodes()
-        # ugly speed hack... "ephemeral list comprehension"
-        [ graph.setNodeProp(n, 'position', (n[1]['position'][0] + dx, n[1]['position'][1] + dy) ) for n in nodes ]
+        # ( positions are written directly, see _tickPhysicsEngine )
+        for nid, nprops in graph.getNodes():
+            x, y = nprops['position']
+            nprops['position'] = (x + dx, y + dy)
+
+    def _setClusterPositions(self, cgraphs):
+        # The cluster graphs have their own copies of the node props, so
+        # copy their positions back to ours ( directly, like the random
+        # layout, rather than re-indexing the graph for each node )
+        for graph in cgraphs:
+            for nid, nprops in graph.getNodes():
+                self.graph.getNodeProps(nid)['position'] = nprops['position']
 
     def _getLayoutGeom(self, graph):
         # return x,y,xmax,ymax for this graph
@@ -194,6 +253,8 @@ class ForceLayout(vg_layouts.GraphLayout):
             #self._shiftGraphLayout( graph, offset - x, 0 - y )
             #offset += ( xmax - x )
 
+        self._setClusterPositions( cgraphs )
+
         # Now lets calculate some straight line edges
         self._setEdgePoints()
         return needmore
@@ -206,49 +267,120 @@ class ForceLayout(vg_layouts.GraphLayout):
 
     def _tickPhysicsEngine(self, graph):
 
-        totforce = 0
-
         nodes = graph.getNodes()
 
-        for nid, nprops in nodes:
-
-            vect = vector()
-
-            # For each other node, calculate the coulomb repulsion
-            # as a directional vector and sum them
-            vadd = vect.addVect
-            repul = self._coulombRepulsion
-
-            # Speed hack (ephemeral list comprehension)
-            [ vadd( *repul(nprops, n2props ) ) for (n2id,n2props) in nodes if n2id != nid ]
-
-            # Now lets calculate some edge "spring" forces and add
-            # those in too...
-            for eid,n1,n2,einfo in graph.getRefsFromByNid( nid ):
-                n2props = graph.getNodeProps( n2 )
-                force,angle = self._hookeAttraction( nprops, n2props )
-                vect.addVect(force, angle)
+        # Work on position lists ( indexed like nodes )
+        nidx = {}
+        xs = []
+        ys = []
+        for i, (nid, nprops) in enumerate(nodes):
+            x, y = nprops['position']
+            nidx[nid] = i
+            xs.append(float(x))
+            ys.append(float(y))
+
+        fxs, fys = self._getRepulsionForces(xs, ys)
+
+        # Now lets calculate some edge "spring" forces and add
+        # those in too ( to both ends of each edge )...
+        rate = self._f_springrate
+        for eid, n1, n2, einfo in graph.getEdges():
+            i = nidx[n1]
+            j = nidx[n2]
+            dx = (xs[j] - xs[i]) * rate
+            dy = (ys[j] - ys[i]) * rate
+            fxs[i] += dx
+            fys[i] += dy
+            fxs[j] -= dx
+            fys[j] -= dy
 
-            for eid,n1,n2,einfo in graph.getRefsToByNid( nid ):
-                n2props = graph.getNodeProps( n1 )
-                force,angle = self._hookeAttraction( nprops, n2props )
-                vect.addVect(force, angle)
+        totforce = 0
+        mmax = self._f_mmax
+        for i, (nid, nprops) in enumerate(nodes):
 
-            # All repulsive forces are added to this node's vect
-            # time to add some drag....
+            # FIXME allow the graph to specify drag per node
             drag = nprops.get('drag')
             if drag == None:
                 drag = self._f_drag
-            vect.addDrag( drag )
-            # FIXME allow the graph to specify drag per node
 
-            newpos = vect.getMovement( *nprops['position'], maxmov=self._f_mmax)
-            graph.setNodeProp( (nid,nprops), 'position', newpos)
+            dx = fxs[i] * drag
+            dy = fys[i] * drag
+            totforce += math.hypot(dx, dy)
+
+            if mmax:
+                dx = max(-mmax, min(dx, mmax))
+                dy = max(-mmax, min(dy, mmax))
 
-            totforce += vect.force
+            # Every force was calculated from the old positions, so the
+            # new ones are written back directly ( setNodeProp() would
+            # re-index the graph by position for each node )
+            nprops['position'] = (xs[i] + dx, ys[i] + dy)
 
         return totforce
 
+    def _getRepulsionForces(self, xs, ys):
+        '''
+        Return the ( fxs, fys ) lists of the total coulomb repulsion on
+        each of the nodes at positions xs/ys ( using a Barnes-Hut
+        quadtree ).
+        '''
+        count = len(xs)
+        fxs = [ 0.0 ] * count
+        fys = [ 0.0 ] * count
+        if count < 2:
+            return fxs, fys
+
+        kq2 = ke * ( self._f_charge * self._f_charge )
+        theta2 = self._f_theta * self._f_theta
+
+        x0 = min(xs)
+        y0 = min(ys)
+        size = max(max(xs) - x0, max(ys) - y0) + 1.0
+        root = buildQuadTree(xs, ys, range(count), x0, y0, size)
+
+        sqrt = math.sqrt
+        for i in xrange(count):
+            xi = xs[i]
+            yi = ys[i]
+            fx = 0.0
+            fy = 0.0
+
+            todo = [ root ]
+            while todo:
+                qcount, qx, qy, qx0, qy0, qsize, kids, idxs = todo.pop()
+
+                if kids == None:
+                    for j in idxs:
+                        dx = xs[j] - xi
+                        dy = ys[j] - yi
+                        d2 = dx * dx + dy * dy
+                        # ( skips i and anything right on top of it )
+                        if not d2:
+                            continue
+                        f = kq2 / (d2 * sqrt(d2))
+                        fx -= f * dx
+                        fy -= f * dy
+                    continue
+
+                dx = qx - xi
+                dy = qy - yi
+                d2 = dx * dx + dy * dy
+
+                # Far enough away (and not containing i) to be one node?
+                if qsize * qsize < theta2 * d2:
+                    if not (qx0 <= xi < qx0 + qsize and qy0 <= yi < qy0 + qsize):
+                        f = qcount * kq2 / (d2 * sqrt(d2))
+                        fx -= f * dx
+                        fy -= f * dy
+                        continue
+
+                todo.extend(kids)
+
+            fxs[i] = fx
+            fys[i] = fy
+
+        return fxs, fys
+
     def _coulombRepulsion(self, n1props, n2props ):
         x1,y1 = n1props.get('position')
         x2,y2 = n2props.get('position')
@@ -112,6 +112,53 @@ class GraphCoreTest(unittest.TestCase):
         self.assertPathsThru( self.getSampleGraph1(),'b',[('a','b','d','f'),('a','b','e','f')])
         self.assertPathsThru( self.getSampleGraph2(),'b',[('a','b'),('a','b','c'),])
 
+    def getPathNids(self, g, n1, eids):
+        return (n1,) + tuple([ g.getEdge(eid)[2] for eid in eids ])
+
+    def test_visgraph_pathsearch(self):
+        g = self.getSampleGraph1()
+
+        paths = [ self.getPathNids(g, 'a', p) for p in g.pathSearch('a', 'f') ]
+        self.assertEqual(sorted(paths), sorted(s1paths))
+
+        paths = [ self.getPathNids(g, 'a', p) for p in g.pathSearch('a', 'f', maxdepth=2) ]
+        self.assertEqual(paths, [('a','c','f')])
+
+        self.assertEqual(len(list(g.pathSearch('a', 'f', maxpath=2))), 2)
+
+        # edgecb may veto edges
+        def edgecb(graph, edge, depth):
+            return edge[2] != 'd'
+        paths = [ self.getPathNids(g, 'a', p) for p in g.pathSearch('a', 'f', edgecb=edgecb) ]
+        self.assertEqual(sorted(paths), [('a','b','e','f'), ('a','c','f')])
+
+        # loops are not followed
+        g = self.getSampleGraph3()
+        paths = [ self.getPathNids(g, 'a', p) for p in g.pathSearch('a', 'd') ]
+        self.assertEqual(paths, [('a','b','c','d')])
+
+    def test_visgraph_pathsearch_shortest(self):
+        g = self.getSampleGraph1()
+
+        self.assertEqual(self.getPathNids(g, 'a', g.pathSearchShortest('a', 'f')), ('a','c','f'))
+        self.assertEqual(self.getPathNids(g, 'a', g.pathSearchOne('a', 'f')), ('a','c','f'))
+        self.assertIsNone(g.pathSearchShortest('f', 'a'))
+        self.assertIsNone(g.pathSearchShortest('a', 'f', maxdepth=1))
+
+        path = g.pathSearchFrom('a', lambda graph, nid: nid in ('d','e'))
+        self.assertEqual(len(path), 2)
+
+        paths = [ self.getPathNids(g, 'a', p) for p in g.pathSearchKShortest('a', 'f') ]
+        self.assertEqual(paths[0], ('a','c','f'))
+        self.assertEqual(sorted(paths), sorted(s1paths))
+
+        paths = list(g.pathSearchKShortest('a', 'f', k=2))
+        self.assertEqual(len(paths), 2)
+        self.assertEqual(len(paths[1]), 3)
+
+        paths = [ self.getPathNids(g, 'a', p) for p in g.pathSearchKShortest('a', tocb=lambda graph, nid: nid == 'f') ]
+        self.assertEqual(sorted(paths), sorted(s1paths))
+
     def test_visgraph_nodeprops(self):
         g = v_graphcore.Graph()
         a = g.addNode('a')
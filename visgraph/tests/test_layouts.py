@@ -1,6 +1,9 @@
+import math
+import random
 import unittest
 
 import visgraph.graphcore as v_graphcore
+import visgraph.layouts.force as v_force
 import visgraph.layouts.dynadag as v_dynadag
 
 class GraphLayoutTest(unittest.TestCase):
@@ -83,3 +86,43 @@ class GraphLayoutTest(unittest.TestCase):
         self.assertEqual(g2.getNode('d')[1].get('position'),(20,80))
         self.assertEqual(g2.getNode('e')[1].get('position'),(20,120))
 
+    def test_visgraph_force(self):
+        g2 = self.sampGraph2()
+        g2.addNode('f') # a cluster of its own
+        for nid,nprops in g2.getNodes():
+            nprops['size'] = (10,10)
+
+        lyt = v_force.ForceLayout(g2)
+        lyt.layoutGraph()
+
+        positions = [ nprops.get('position') for nid,nprops in g2.getNodes() ]
+        self.assertEqual(len(set(positions)), 6)
+        self.assertEqual(min([ x for x,y in positions ]), 5)
+        self.assertEqual(min([ y for x,y in positions ]), 5)
+
+        for eid,n1,n2,einfo in g2.getEdges():
+            self.assertEqual(einfo['edge_points'], [g2.getNodeProps(n1)['position'], g2.getNodeProps(n2)['position']])
+
+    def test_visgraph_force_repulsion(self):
+        rand = random.Random(1)
+        xs = [ float(rand.randint(0, 5000)) for i in range(300) ]
+        ys = [ float(rand.randint(0, 5000)) for i in range(300) ]
+
+        lyt = v_force.ForceLayout(v_graphcore.Graph())
+        afxs, afys = lyt._getRepulsionForces(xs, ys)
+        lyt.setBarnesHutTheta(0)
+        fxs, fys = lyt._getRepulsionForces(xs, ys)
+
+        # the exact forces are the sum of the pairwise coulomb vectors
+        vect = v_force.vector()
+        n1props = {'position':(xs[0], ys[0])}
+        for i in range(1, len(xs)):
+            vect.addVect( *lyt._coulombRepulsion(n1props, {'position':(xs[i], ys[i])}) )
+        fx, fy = vect.getMovement(0, 0)
+        self.assertAlmostEqual(fx, fxs[0])
+        self.assertAlmostEqual(fy, fys[0])
+
+        # and the (Barnes-Hut) approximation is close
+        for i in range(len(xs)):
+            delta = math.hypot(afxs[i] - fxs[i], afys[i] - fys[i])
+            self.assertTrue(delta < 0.1 * math.hypot(fxs[i], fys[i]))
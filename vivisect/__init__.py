@@ -10,6 +10,7 @@ import sys
 import time
 import Queue
 import string
+import bisect
 import struct
 import weakref
 import hashlib
@@ -26,33 +27,41 @@ from ConfigParser import ConfigParser
 import vivisect.contrib # This should go first
 
 # The envi imports...
-import vdb
+# ( the debugger, c parser, symbol cache and emulator/arch modules are
+# imported when first used to keep "import vivisect" fast )
 import envi
 import envi.bits as e_bits
 import envi.memory as e_mem
 import envi.config as e_config
 import envi.bytesig as e_bytesig
+import envi.transcache as e_tcache
 import envi.symstore.resolver as e_resolv
-import envi.symstore.symcache as e_symcache
 
 import vstruct
-import vstruct.cparse as vs_cparse
 import vstruct.primitives as vs_prims
 
 import vivisect.base as viv_base
 import vivisect.parsers as viv_parsers
 import vivisect.codegraph as viv_codegraph
+import vivisect.impemu.pool as viv_imp_pool
 import vivisect.impemu.lookup as viv_imp_lookup
 
 from vivisect.exc import *
 from vivisect.const import *
 from vivisect.defconfig import *
 
-import vivisect.analysis.generic.emucode as v_emucode
-
 def guid(size=16):
     return hexlify(os.urandom(size))
 
+# struct formats for unpacking memory maps as arrays of pointers
+ptr_fmts = { 2:'H', 4:'I', 8:'Q' }
+
+# The number of bytes scanned at a time by findPointers()
+PTR_SCAN_CHUNK = 0x10000
+
+# Printable characters for string detection
+printable_re = re.compile('[%s]*' % re.escape(string.printable))
+
 class VivWorkspace(e_mem.MemoryObject, viv_base.VivWorkspaceCore):
 
     def __init__(self):
@@ -84,10 +93,6 @@ class VivWorkspace(e_mem.MemoryObject, viv_base.VivWorkspaceCore):
         self._dead_data = []
         self.iscode = {}
 
-        self.xrefs = []
-        self.xrefs_by_to = {}
-        self.xrefs_by_from = {}
-
         # XXX - make config option
         self.greedycode = 0
 
@@ -124,6 +129,9 @@ class VivWorkspace(e_mem.MemoryObject, viv_base.VivWorkspaceCore):
         self.nextchanid = 1
 
         self._cached_emus = {}
+        self._emu_tcaches = {}  # emulator class: shared TranslationCache
+        self._op_cache = e_tcache.OpcodeCache(maxsize=self.config.viv.analysis.opcache_size)
+        self._emu_pool = viv_imp_pool.EmulatorPool(self)
 
         # The function entry signature decision tree
         # FIXME add to export
@@ -218,17 +226,29 @@ class VivWorkspace(e_mem.MemoryObject, viv_base.VivWorkspaceCore):
 
         Use logread/logwrite to enable memory access tracking.
         """
+        eclass = self._getEmulatorClass()
+        return eclass(self, logwrite=logwrite, logread=logread)
+
+    def getPoolEmulator(self, logwrite=False, logread=False):
+        """
+        Get a (reset) WorkspaceEmulator from the workspace emulator pool.
+        Use it in a with block to return it to the pool when done:
+
+        with vw.getPoolEmulator() as emu:
+            emu.runFunction(fva, maxhit=1)
+        """
+        eclass = self._getEmulatorClass()
+        return self._emu_pool.getEmulator(eclass, logwrite=logwrite, logread=logread)
+
+    def _getEmulatorClass(self):
         plat = self.getMeta('Platform')
         arch = self.getMeta('Architecture')
 
-        eclass = viv_imp_lookup.workspace_emus.get( (plat,arch) )
-        if eclass == None:
-            eclass = viv_imp_lookup.workspace_emus.get(arch)
-
+        eclass = viv_imp_lookup.getWorkspaceEmulator(arch, plat=plat)
         if eclass == None:
             raise Exception("WorkspaceEmulation not supported on %s yet!" % arch)
 
-        return eclass(self, logwrite=logwrite, logread=logread)
+        return eclass
 
     def getCachedEmu(self, emuname):
         """
@@ -488,7 +508,18 @@ class VivWorkspace(e_mem.MemoryObject, viv_base.VivWorkspaceCore):
         Return the (probably big) list of events which define this
         workspace.
         '''
-        return self._event_list
+        if self._event_state == None:
+            return self._event_list
+
+        # Storage modules which load state in bulk (rather than from
+        # events) give us the event index it was loaded at and a
+        # callable to build the events for it.
+        mark, state = self._event_state
+        if callable(state):
+            state = state()
+            self._event_state = (mark, state)
+
+        return self._event_list[:mark] + state + self._event_list[mark:]
 
     def exportWorkspaceChanges(self):
         '''
@@ -497,6 +528,15 @@ class VivWorkspace(e_mem.MemoryObject, viv_base.VivWorkspaceCore):
         '''
         return self._event_list[self._event_saved:]
 
+    def flushEvents(self):
+        '''
+        Part of the workspace server interface used by clients ( see
+        initWorkspaceClient() ).  Clients call it to make sure the server
+        has every event they have fired.  A workspace applies events as
+        they are fired, so there is nothing to do.
+        '''
+        pass
+
     def initWorkspaceClient(self, remotevw):
         """
         Initialize this workspace as a workspace
@@ -746,30 +786,75 @@ class VivWorkspace(e_mem.MemoryObject, viv_base.VivWorkspaceCore):
         for mva, msize, mperm, mname in self.getMemoryMaps():
 
             offset, bytes = self.getByteDef(mva)
-            maxsize = len(bytes) - size
+            maxoff = len(bytes) - (2 * size)
+
+            # Walk the (ordered) candidate pointers, hopping over any
+            # locations between them the way a byte by byte scan would.
+            cursor = 0
+            for offset, x in self._findPointerCandidates(bytes, maxoff):
+                while cursor <= offset:
+                    hit = self.locstore.findLocation(mva + cursor, offset - cursor + 1)
+                    if hit == None:
+                        ret.append((mva + offset, x))
+                        cursor = offset + size
+                        break
+
+                    lva, loctup = hit
+                    cursor = lva - mva + loctup[L_SIZE]
 
-            while offset + size < maxsize:
-                dbg = 0
-                va = mva + offset
+        if cache:
+            self.setTransMeta('findPointers', ret)
 
-                loctup = self.getLocation(va)
-                if loctup != None:
-                    offset += loctup[L_SIZE]
-                    continue
+        return ret
+
+    def _findPointerCandidates(self, bytes, maxoff):
+        '''
+        Yield (offset, value) tuples (in offset order) for each offset
+        below maxoff in bytes where the pointer sized value is a valid
+        pointer.  The bytes are unpacked a chunk at a time as arrays of
+        words (one array per alignment) and checked against the sorted
+        memory map ranges.
+        '''
+        size = self.psize
+
+        fmt = ptr_fmts.get(size)
+        if fmt != None:
+            fmt = '>%d' + fmt if self.bigend else '<%d' + fmt
 
-                x = e_bits.parsebytes(bytes, offset, size, bigend=self.bigend)
-                if self.isValidPointer(x):
-                    ret.append((va, x))
-                    offset += size
+        maps = sorted([ (mva, mva + msize) for mva, msize, mperm, mname in self.getMemoryMaps() ])
+        if not maps:
+            return
+
+        mstarts = [ m[0] for m in maps ]
+        mends = [ m[1] for m in maps ]
+        minva = maps[0][0]
+        maxva = max(mends)
+
+        for chunk in xrange(0, maxoff, PTR_SCAN_CHUNK):
+            endoff = min(chunk + PTR_SCAN_CHUNK, maxoff)
+
+            found = []
+            for align in xrange(size):
+                first = chunk + align
+                count = (endoff - first + size - 1) / size
+                if count <= 0:
                     continue
-                        
 
-                offset += 1
+                if fmt != None:
+                    words = struct.unpack_from(fmt % count, bytes, first)
+                else:
+                    words = [ e_bits.parsebytes(bytes, first + (i * size), size, bigend=self.bigend) for i in xrange(count) ]
 
-        if cache:
-            self.setTransMeta('findPointers', ret)
+                for i, x in enumerate(words):
+                    if x < minva or x >= maxva:
+                        continue
+                    if x >= mends[bisect.bisect_right(mstarts, x) - 1]:
+                        continue
+                    found.append((first + (i * size), x))
 
-        return ret
+            found.sort()
+            for item in found:
+                yield item
 
     def detectString(self, va):
         '''
@@ -784,30 +869,31 @@ class VivWorkspace(e_mem.MemoryObject, viv_base.VivWorkspaceCore):
 
         offset, bytes = self.getByteDef(va)
         maxlen = len(bytes) - offset
-        count = 0
-        while count < maxlen:
-            # If we hit another thing, then probably not.
-            # Ignore when count==0 so detection can check something
-            # already set as a location.
-            if (count > 0):
-                loc = self.getLocation(va+count)
-                if loc != None:
-                    if loc[L_LTYPE] == LOC_STRING:
-                        return loc[L_VA] - (va + count) + loc[L_SIZE]
-                    return -1
 
-            c = bytes[offset+count]
-            # The "strings" algo basically says 4 or more...
-            if ord(c) == 0 and count >= 4:
-                return count
+        # Find the run of printable characters (and the byte after it)
+        # and then look for any other location inside it at once.
+        count = printable_re.match(bytes, offset, offset + maxlen).end() - offset
+        if count < maxlen:
+            hit = self.locstore.findLocation(va + 1, count)
+            if hit != None:
+                lva, loc = hit
+                if loc[L_LTYPE] == LOC_STRING:
+                    return loc[L_VA] - lva + loc[L_SIZE]
+                return -1
 
-            elif ord(c) == 0 and (count == dlen or count == plen):
+            # The "strings" algo basically says 4 or more...
+            if ord(bytes[offset + count]) == 0 and (count >= 4 or count == dlen or count == plen):
                 return count
 
-            if c not in string.printable:
-                return -1
+        else:
+            # We ran off the end of the map, but another location
+            # may still come first.
+            hit = self.locstore.findLocation(va + 1, count - 1)
+            if hit != None:
+                lva, loc = hit
+                if loc[L_LTYPE] == LOC_STRING:
+                    return loc[L_VA] - lva + loc[L_SIZE]
 
-            count += 1
         return -1
 
     def isProbablyString(self, va):
@@ -881,13 +967,14 @@ class VivWorkspace(e_mem.MemoryObject, viv_base.VivWorkspaceCore):
         if self.iscode.get(va):
             return False
         self.iscode[va] = True
-        emu = self.getEmulator()
+        import vivisect.analysis.generic.emucode as v_emucode
         wat = v_emucode.watcher(self, va)
-        emu.setEmulationMonitor(wat)
-        try:
-            emu.runFunction(va, maxhit=1)
-        except Exception, e:
-            return False
+        with self.getPoolEmulator() as emu:
+            emu.setEmulationMonitor(wat)
+            try:
+                emu.runFunction(va, maxhit=1)
+            except Exception, e:
+                return False
  
         if wat.looksgood():
             return True
@@ -903,9 +990,9 @@ class VivWorkspace(e_mem.MemoryObject, viv_base.VivWorkspaceCore):
 
         Example: op = m.parseOpcode(0x7c773803)
 
-        note: differs from the IMemory interface by checking loclist
+        note: differs from the IMemory interface by checking locations
+        note: the returned opcode may be shared ( see getOpcodeCache() )
         '''
-        off, b = self.getByteDef(va)
         if arch == envi.ARCH_DEFAULT:
             loctup = self.getLocation(va)
             # XXX - in the case where we've set a location on what should be an 
@@ -914,7 +1001,31 @@ class VivWorkspace(e_mem.MemoryObject, viv_base.VivWorkspaceCore):
             if loctup != None and loctup[ L_TINFO ] and loctup[ L_LTYPE ] == LOC_OP:
                 arch = loctup[ L_TINFO ]
 
-        return self.imem_archs[ (arch & envi.ARCH_MASK) >> 16 ].archParseOpcode(b, off, va)
+        archmod = self.imem_archs[ (arch & envi.ARCH_MASK) >> 16 ]
+        archname = archmod.getArchName()
+
+        opcache = self._op_cache
+        op = opcache.getOpcode(va, archname)
+        if op is not None:
+            return op
+
+        gen = opcache.generation
+        off, b = self.getByteDef(va)
+        op = archmod.archParseOpcode(b, off, va)
+        opcache.addOpcode(va, archname, op, gen=gen)
+        return op
+
+    def getOpcodeCache(self):
+        '''
+        Get the envi.transcache.OpcodeCache of opcodes decoded by
+        parseOpcode() ( which is cleared whenever the workspace memory
+        changes ).  Emulators for the workspace share it, and its
+        getStats() reports the cache hits and misses.
+
+        Example:
+            stats = vw.getOpcodeCache().getStats()
+        '''
+        return self._op_cache
 
     def makeOpcode(self, va, op=None, arch=envi.ARCH_DEFAULT):
         """
@@ -1358,9 +1469,7 @@ class VivWorkspace(e_mem.MemoryObject, viv_base.VivWorkspaceCore):
         """
         Return the entire list of XREF tuples for this workspace.
         """
-        if rtype:
-            return [ xtup for xtup in self.xrefs if xtup[XR_RTYPE] == rtype ]
-        return self.xrefs
+        return self.xrefstore.getXrefs(rtype=rtype)
 
     def getXrefsFrom(self, va, rtype=None):
         """
@@ -1372,27 +1481,34 @@ class VivWorkspace(e_mem.MemoryObject, viv_base.VivWorkspaceCore):
         for fromva, tova, rtype, rflags in vw.getXrefsFrom(0x41414141):
             dostuff(tova)
         """
-        ret = []
-        xrefs = self.xrefs_by_from.get(va, None)
-        if xrefs == None:
-            return ret
-        if rtype == None:
-            return xrefs
-        return [ xtup for xtup in xrefs if xtup[XR_RTYPE] == rtype ]
+        return self.xrefstore.getXrefsFrom(va, rtype=rtype)
 
     def getXrefsTo(self, va, rtype=None):
         """
         Get a list of xrefs which point to the given va. Optionally,
         specify an rtype to get only xrefs of that type.
         """
-        # FIXME make xrefs use MapLookup!
-        ret = []
-        xrefs = self.xrefs_by_to.get(va, None)
-        if xrefs == None:
-            return ret
-        if rtype == None:
-            return xrefs
-        return [ xtup for xtup in xrefs if xtup[XR_RTYPE] == rtype ]
+        return self.xrefstore.getXrefsTo(va, rtype=rtype)
+
+    def getXrefsFromRange(self, va, size, rtype=None):
+        """
+        Return the (fromva ordered) list of xrefs whose origin is in
+        the range [va, va+size).  Optionally, only return xrefs whose type
+        field is rtype if specified.
+
+        example:
+        for fromva, tova, rtype, rflags in vw.getXrefsFromRange(fva, fsize):
+            dostuff(tova)
+        """
+        return self.xrefstore.getXrefsFromRange(va, size, rtype=rtype)
+
+    def getXrefsToRange(self, va, size, rtype=None):
+        """
+        Return the (tova ordered) list of xrefs which point into the
+        range [va, va+size).  Optionally, specify an rtype to get only
+        xrefs of that type.
+        """
+        return self.xrefstore.getXrefsToRange(va, size, rtype=rtype)
 
     def addMemoryMap(self, va, perms, fname, bytes):
         """
@@ -1404,6 +1520,13 @@ class VivWorkspace(e_mem.MemoryObject, viv_base.VivWorkspaceCore):
     def delMemoryMap(self, va):
         raise "OMG"
 
+    def writeMemory(self, va, bytes):
+        e_mem.MemoryObject.writeMemory(self, va, bytes)
+        # Emulators made from now on have different map bytes
+        self._op_cache.clearCache()
+        self._emu_tcaches.clear()
+        self._emu_pool.clear()
+
     def addSegment(self, va, size, name, filename):
         """
         Add a "segment" to the workspace.  A segment is generally some meaningful
@@ -1473,7 +1596,7 @@ class VivWorkspace(e_mem.MemoryObject, viv_base.VivWorkspaceCore):
         Callers are expected to do their own xref analysis (ie, makeCode() etc)
         """
         ref = (fromva,tova,reftype,rflags)
-        if ref in self.getXrefsFrom(fromva):
+        if self.xrefstore.hasXref(ref):
             return
         self._fireEvent(VWE_ADDXREF, (fromva, tova, reftype, rflags))
 
@@ -1482,7 +1605,7 @@ class VivWorkspace(e_mem.MemoryObject, viv_base.VivWorkspaceCore):
         Remove the given xref.  This *will* exception if the
         xref doesn't already exist...
         """
-        if ref not in self.getXrefsFrom(ref[XR_FROM]):
+        if not self.xrefstore.hasXref(tuple(ref)):
             raise Exception("Unknown Xref: %x %x %d" % ref)
         self._fireEvent(VWE_DELXREF, ref)
 
@@ -1747,6 +1870,7 @@ class VivWorkspace(e_mem.MemoryObject, viv_base.VivWorkspaceCore):
             src = "struct woot { int x; int y; };"
             vw.setUserStructSource( src )
         '''
+        import vstruct.cparse as vs_cparse
         # First, we make sure it compiles...
         ctor = vs_cparse.ctorFromCSource( ssrc )
         # Then, build one to get the name from it...
@@ -1784,7 +1908,7 @@ class VivWorkspace(e_mem.MemoryObject, viv_base.VivWorkspaceCore):
         Add a location tuple.
         """
         ltup = (va, size, ltype, tinfo)
-        #loc = self.locmap.getMapLookup(va)
+        #loc = self.getLocation(va)
         #if loc != None:
             #raise Exception('Duplicate Location: (is: %r wants: %r)' % (loc,ltup))
 
@@ -1796,13 +1920,7 @@ class VivWorkspace(e_mem.MemoryObject, viv_base.VivWorkspaceCore):
         Return a list of location objects from the workspace
         of a particular type.
         """
-        if ltype == None:
-            return list(self.loclist)
-
-        if linfo == None:
-            return [ loc for loc in self.loclist if loc[2] == ltype ]
-
-        return [ loc for loc in self.loclist if (loc[2] == ltype and loc[3] == linfo) ]
+        return self.locstore.getLocations(ltype=ltype, linfo=linfo)
 
     def isLocation(self, va, range=False):
         """
@@ -1832,7 +1950,7 @@ class VivWorkspace(e_mem.MemoryObject, viv_base.VivWorkspaceCore):
         (specify range=True to potentially match a va that is inside
         a location rather than the beginning of one)
         """
-        return self.locmap.getMapLookup(va)
+        return self.locstore.getLocation(va)
 
     def getLocationRange(self, va, size):
         """
@@ -1841,24 +1959,25 @@ class VivWorkspace(e_mem.MemoryObject, viv_base.VivWorkspaceCore):
         to provide a complete accounting of linear workspace.
         """
         ret = []
+        done = set()
         endva = va+size
-        undefva = None
-        while va < endva:
-            ltup = self.getLocation(va)
-            if ltup == None:
-                if undefva == None:
-                    undefva = va
-                va += 1
-            else:
-                if undefva != None:
-                    ret.append((undefva, va-undefva, LOC_UNDEF, None))
-                    undefva = None
-                ret.append(ltup)
-                va += ltup[L_SIZE]
+        for ltup in self.locstore.getLocationsInRange(va, size):
+            lva = ltup[L_VA]
+            # A location split by the ones added over it comes back
+            # once for each of its fragments...
+            lkey = ltup[:L_TINFO]
+            if lkey in done:
+                continue
+            done.add(lkey)
+
+            if lva > va:
+                ret.append((va, lva-va, LOC_UNDEF, None))
+            ret.append(ltup)
+            va = max(va, lva + ltup[L_SIZE])
 
         # Mop up any hanging udefs
-        if undefva != None:
-            ret.append((undefva, va-undefva, LOC_UNDEF, None))
+        if va < endva:
+            ret.append((va, endva-va, LOC_UNDEF, None))
 
         return ret
 
@@ -1934,19 +2053,9 @@ class VivWorkspace(e_mem.MemoryObject, viv_base.VivWorkspaceCore):
         the given va, otherwise search backward for a location until
         you find one or hit the edge of the segment.
         """
-        va -= 1
-        ret = self.locmap.getMapLookup(va)
-        if ret != None:
-            return ret
         if adjacent:
-            return None
-        va -= 1
-        while va > 0:
-            ret = self.locmap.getMapLookup(va)
-            if ret != None:
-                return ret
-            va -= 1
-        return None
+            return self.locstore.getLocation(va - 1)
+        return self.locstore.getPrevLocation(va)
 
     def vaByName(self, name):
         return self.va_by_name.get(name, None)
@@ -2024,6 +2133,8 @@ class VivWorkspace(e_mem.MemoryObject, viv_base.VivWorkspaceCore):
     def saveWorkspace(self, fullsave=True):
 
         if self.server != None:
+            # The server saves our changes ( once it has them all )
+            self.server.flushEvents()
             return
 
         modname = self.getMeta("StorageModule")
@@ -2080,6 +2191,7 @@ class VivWorkspace(e_mem.MemoryObject, viv_base.VivWorkspaceCore):
         if not self.config.vdb.SymbolCacheActive:
             return
 
+        import envi.symstore.symcache as e_symcache
         pathstr = self.config.vdb.SymbolCachePath
         symcache = e_symcache.SymbolCachePath(pathstr)
 
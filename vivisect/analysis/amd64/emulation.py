@@ -123,30 +123,29 @@ def buildFunctionApi(vw, fva, emu, emumon):
 
 def analyzeFunction(vw, fva):
 
-    emu = vw.getEmulator()
     emumon = AnalysisMonitor(vw, fva)
+    with vw.getPoolEmulator() as emu:
+        emu.setEmulationMonitor(emumon)
+        emu.runFunction(fva, maxhit=1)
 
-    emu.setEmulationMonitor(emumon)
-    emu.runFunction(fva, maxhit=1)
+        # Do we already have API info in meta?
+        # NOTE: do *not* use getFunctionApi here, it will make one!
+        api = vw.getFunctionMeta(fva, 'api')
+        if api == None:
+            api = buildFunctionApi(vw, fva, emu, emumon)
 
-    # Do we already have API info in meta?
-    # NOTE: do *not* use getFunctionApi here, it will make one!
-    api = vw.getFunctionMeta(fva, 'api')
-    if api == None:
-        api = buildFunctionApi(vw, fva, emu, emumon)
+        rettype,retname,callconv,callname,callargs = api
 
-    rettype,retname,callconv,callname,callargs = api
+        argc = len(callargs)
+        cc = emu.getCallingConvention(callconv)
+        stcount = cc.getNumStackArgs(emu, argc)
+        stackidx = argc - stcount
+        baseoff = cc.getStackArgOffset(emu, argc)
 
-    argc = len(callargs)
-    cc = emu.getCallingConvention(callconv)
-    stcount = cc.getNumStackArgs(emu, argc)
-    stackidx = argc - stcount
-    baseoff = cc.getStackArgOffset(emu, argc)
+        # Register our stack args as function locals
+        for i in xrange( stcount ):
 
-    # Register our stack args as function locals
-    for i in xrange( stcount ):
+            vw.setFunctionLocal(fva, baseoff + ( i * 8 ), LSYM_FARG, i+stackidx)
 
-        vw.setFunctionLocal(fva, baseoff + ( i * 8 ), LSYM_FARG, i+stackidx)
-
-    emumon.addAnalysisResults(vw, emu)
+        emumon.addAnalysisResults(vw, emu)
 
@@ -7,6 +7,7 @@ if they are code by emulation behaviorial analysis.
 import envi
 import vivisect
 import vivisect.reports as viv_rep
+import vivisect.parallel as viv_parallel
 from envi.archs.i386.opconst import *
 import vivisect.impemu.monitor as viv_imp_monitor
 
@@ -102,6 +103,32 @@ class watcher(viv_imp_monitor.EmulationMonitor):
             self.hasret = True
             emu.stopEmu()
 
+def emulateVa(vw, va):
+    '''
+    Emulate from va and return a (looksgood, iscode) tuple for the
+    behavior we saw (or None if emulation failed).
+    '''
+    wat = watcher(vw, va)
+    with vw.getPoolEmulator() as emu:
+        emu.setEmulationMonitor(wat)
+        try:
+            emu.runFunction(va, maxhit=1)
+        except Exception, e:
+            return None
+
+    looksgood = wat.looksgood()
+    return looksgood, not looksgood and wat.iscode()
+
+def skipVa(vw, va):
+    if vw.getLocation(va) != None:
+        return True
+    if vw.isDeadData(va):
+        return True
+    # Make sure it's executable
+    if not vw.isExecutable(va):
+        return True
+    return False
+
 def analyze(vw):
 
     flist = vw.getFunctions()
@@ -116,33 +143,22 @@ def analyze(vw):
         vatodo = [ va for va, name in vw.getNames() if vw.getLocation(va) == None ]
         vatodo.extend( [tova for fromva, tova, reftype, rflags in vw.getXrefs(rtype=REF_PTR) if vw.getLocation(tova) == None] )
 
-        for va in set(vatodo):
-            if vw.getLocation(va) != None:
-                continue
-            if vw.isDeadData(va):
-                continue
+        # Skip it if we've tried it already.
+        vatodo = [ va for va in set(vatodo) if not tried.get(va) ]
 
-            # Make sure it's executable
-            if not vw.isExecutable(va):
-                continue
-
-            # Skip it if we've tried it already.
-            if tried.get(va):
-                continue
+        # The emulation is done (speculatively) by analysis workers
+        for va, res in viv_parallel.parallelMap(vw, vatodo, emulateVa, skip=skipVa):
 
             tried[va] = True
-            emu = vw.getEmulator()
-            wat = watcher(vw, va)
-            emu.setEmulationMonitor(wat)
-            try:
-                emu.runFunction(va, maxhit=1)
-            except Exception, e:
+            if res == None:
                 continue
-            if wat.looksgood():
+
+            looksgood, iscode = res
+            if looksgood:
                 docode.append(va)
             # flag to tell us to be greedy w/ finding code
             # XXX - visi is going to hate this..
-            elif wat.iscode() and vw.greedycode:
+            elif iscode and vw.greedycode:
                 bcode.append(va)
             else:
                 if vw.isProbablyString(va):
@@ -19,30 +19,35 @@ def analyze(vw):
     brute force find other function entry points based on the
     entry signatures db.
     """
-    # FIXME make the below code an undefined space iterator
-    # and use in findPointers too
     for mapva,mapsize,mapflags,fname in vw.getMemoryMaps():
 
         # Segment permissions check for likely code stuff at all
         if not mapflags & e_mem.MM_EXEC:
             continue
 
-        i = 0
+        # Find all the signature matches in the map in one pass (and
+        # then skip the ones which earlier functions have defined)
+        offset, bytes = vw.getByteDef(mapva)
         maxsize = mapsize - 4
-        while i < maxsize:
-            va = mapva + i
-            loctup = vw.getLocation(va)
-            if loctup != None:
-                i += loctup[vivisect.L_SIZE]
+
+        lastva = None
+        for sigoff, sigval in vw.sigtree.scanSignatures(bytes, offset=offset, size=mapsize):
+
+            if sigoff - offset >= maxsize:
+                break
+
+            va = mapva + (sigoff - offset)
+            if va == lastva:
                 continue
 
-            i+=1
+            lastva = va
+            if vw.getLocation(va) != None:
+                continue
 
             try:
 
-                if vw.isFunctionSignature(va):
-                    #print "MATCH MATCH MATCH: 0x%.8x" % va
-                    vw.makeFunction(va)
+                #print "MATCH MATCH MATCH: 0x%.8x" % va
+                vw.makeFunction(va)
 
             except vivisect.InvalidLocation, msg:
                 if vw.verbose: vw.vprint("InvalidLocation: %s" % msg)
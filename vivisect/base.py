@@ -8,13 +8,14 @@ import envi.memory as e_mem
 import envi.pagelookup as e_page
 import envi.codeflow as e_codeflow
 
-import vstruct.cparse as vs_cparse
 import vstruct.builder as vs_builder
 import vstruct.constants as vs_const
 
 import vivisect.const as viv_const
 import vivisect.impapi as viv_impapi
 import vivisect.analysis as viv_analysis
+import vivisect.locstore as viv_locstore
+import vivisect.xrefstore as viv_xrefstore
 import vivisect.codegraph as viv_codegraph
 
 from envi.threads import firethread
@@ -148,9 +149,9 @@ class VivWorkspaceCore(object,viv_impapi.ImportApi):
 
     def __init__(self):
         viv_impapi.ImportApi.__init__(self)
-        self.loclist = []
         self.bigend   = False
-        self.locmap   = e_page.MapLookup()
+        self.locstore = viv_locstore.LocationStore()
+        self.xrefstore = viv_xrefstore.XrefStore()
         self.blockmap = e_page.MapLookup()
         self._mods_loaded = False
 
@@ -165,6 +166,8 @@ class VivWorkspaceCore(object,viv_impapi.ImportApi):
 
         self._event_list = []
         self._event_saved = 0 # The index of the last "save" event...
+        self._event_state = None # (index, events) for state loaded in bulk (see exportWorkspace)
+        self._storage_states = [] # resources (mmaps etc) held by the storage module for the workspace
 
         # Give ourself a structure namespace!
         self.vsbuilder = vs_builder.VStructBuilder()
@@ -190,8 +193,9 @@ class VivWorkspaceCore(object,viv_impapi.ImportApi):
 
     def _handleADDLOCATION(self, loc):
         lva, lsize, ltype, linfo = loc
-        self.locmap.setMapLookup(lva, lsize, loc)
-        self.loclist.append(loc)
+        if self.getMemoryMap(lva) == None:
+            raise Exception('Address (0x%.8x) not in maps!' % lva)
+        self.locstore.addLocation(loc)
 
         # A few special handling cases...
         if ltype == LOC_IMPORT:
@@ -202,8 +206,7 @@ class VivWorkspaceCore(object,viv_impapi.ImportApi):
     def _handleDELLOCATION(self, loc):
         # FIXME delete xrefs
         lva, lsize, ltype, linfo = loc
-        self.locmap.setMapLookup(lva, lsize, None)
-        self.loclist.remove(loc)
+        self.locstore.delLocation(loc)
 
     def _handleADDSEGMENT(self, einfo):
         self.segments.append(einfo)
@@ -275,26 +278,10 @@ class VivWorkspaceCore(object,viv_impapi.ImportApi):
         self.blockmap.setMapLookup(va, size, None)
 
     def _handleADDXREF(self, einfo):
-        fromva, tova, reftype, rflags = einfo
-        xr_to = self.xrefs_by_to.get(tova, None)
-        xr_from = self.xrefs_by_from.get(fromva, None)
-        if xr_to == None:
-            xr_to = []
-            self.xrefs_by_to[tova] = xr_to
-
-        if xr_from == None:
-            xr_from = []
-            self.xrefs_by_from[fromva] = xr_from
-
-        if einfo not in xr_to: # Just check one for now
-            xr_to.append(einfo)
-            xr_from.append(einfo)
-            self.xrefs.append(einfo)
+        self.xrefstore.addXref(tuple(einfo))
 
     def _handleDELXREF(self, einfo):
-        fromva, tova, reftype, refflags = einfo
-        self.xrefs_by_to[tova].remove(einfo)
-        self.xrefs_by_from[fromva].remove(einfo)
+        self.xrefstore.delXref(tuple(einfo))
 
     def _handleSETNAME(self, einfo):
         va,name = einfo
@@ -317,8 +304,12 @@ class VivWorkspaceCore(object,viv_impapi.ImportApi):
         va, perms, fname, mbytes = einfo
         e_mem.MemoryObject.addMemoryMap(self, va, perms, fname, mbytes)
 
+        # Emulators made from now on have different maps
+        self._op_cache.clearCache()
+        self._emu_tcaches.clear()
+        self._emu_pool.clear()
+
         blen = len(mbytes)
-        self.locmap.initMapLookup(va, blen)
         self.blockmap.initMapLookup(va, blen)
 
         # On loading a new memory map, we need to crush a few
@@ -565,6 +556,7 @@ class VivWorkspaceCore(object,viv_impapi.ImportApi):
     def _mcb_ustruct(self, name, ssrc):
         # All meta values in the "ustruct" namespace are user defined
         # structure defintions in C.
+        import vstruct.cparse as vs_cparse
         sname = name.split(':')[1]
         ctor = vs_cparse.ctorFromCSource( ssrc )
         self.vsbuilder.addVStructCtor( sname, ctor )
@@ -629,6 +621,10 @@ class VivCodeFlowContext(e_codeflow.CodeFlowContext):
         vw.setVaSetRow('NoReturnCalls', (lva,))
 
     # NOTE: self._mem is the viv workspace...
+    def _cb_opdone(self, va):
+        # Known locations are never flowed through again (see _cb_opcode)
+        return self._mem.isLocation(va)
+
     def _cb_opcode(self, va, op, branches):
 
         loc = self._mem.getLocation(va)
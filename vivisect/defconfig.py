@@ -1,4 +1,4 @@
-import vdb
+import envi.defconfig as e_defconfig
 
 defconfig = {
     'viv':{
@@ -27,17 +27,17 @@ defconfig = {
             },
         },
         'analysis':{
+            'workers':0,
+            'opcache_size':0x8000,
             'pointertables':{
                 'table_min_len':4,
             },
         },
     },
-    'cli':vdb.defconfig.get('cli'), # FIXME make our own...
-    'vdb':vdb.defconfig.get('vdb'),
+    'cli':e_defconfig.defconfig.get('cli'), # FIXME make our own...
+    'vdb':e_defconfig.defconfig.get('vdb'),
 }
 
-defconfig.get('cli').update(vdb.defconfig.get('cli'))
-
 # Config elements docs
 docconfig = {
 
@@ -67,6 +67,8 @@ docconfig = {
         },
 
         'analysis':{
+            'workers':'How many worker processes should analysis use? (0 for none, -1 for one per cpu)',
+            'opcache_size':'How many decoded opcodes should the workspace cache?',
             'pointertables':{
                 'table_min_len':'How many pointers must be in a row to make a table?',
             },
@@ -74,5 +76,5 @@ docconfig = {
 
     },
 
-    'vdb':vdb.docconfig.get('vdb'),
+    'vdb':e_defconfig.docconfig.get('vdb'),
 }
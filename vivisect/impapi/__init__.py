@@ -1,74 +1,205 @@
 '''
 Calling convention and API definitions for various APIs/archs.
 '''
-import imp
+import os
 import sys
-import vstruct.primitives
+import struct
+import threading
+
+import envi.keydb as e_keydb
+
+# The prebuilt api db files are shared by every ImportApi
+_impapi_dbs = {}
+_impapi_lock = threading.Lock()
+
+# The api definitions in a prebuilt db are packed as the string table
+# indexes of rettype, retname and callconv, the arg count, the indexes of
+# each (argtype, argname) and then the (case preserved) funcname.
+impapi_hdr = struct.Struct('<HHHB')
+impapi_arg = struct.Struct('<HH')
+
+class ImpApiDb:
+    '''
+    A prebuilt (mmap'd) db of api definitions which are unpacked only
+    when they are looked up ( and cached, as the same apis tend to be
+    looked up over and over ).
+    '''
+    def __init__(self, filename):
+        self.cache = {}
+        self.keydb = e_keydb.KeyDb(filename)
+        self.strings = self.keydb.meta.get('strings')
+        self.apitypes = self.keydb.meta.get('apitypes')
+
+    def __len__(self):
+        return len(self.keydb)
+
+    def _unpackApi(self, bytez):
+        strs = self.strings
+        rtype, rname, cconv, argc = impapi_hdr.unpack_from(bytez)
+
+        args = []
+        offset = impapi_hdr.size
+        for i in xrange(argc):
+            atype, aname = impapi_arg.unpack_from(bytez, offset)
+            args.append( (strs[atype], strs[aname]) )
+            offset += impapi_arg.size
+
+        return ( strs[rtype], strs[rname], strs[cconv], bytez[offset:], tuple(args) )
+
+    def get(self, normname, default=None):
+        ret = self.cache.get(normname)
+        if ret == None:
+            # Misses are cached as False
+            ret = False
+            bytez = self.keydb.get(normname)
+            if bytez != None:
+                ret = self._unpackApi(bytez)
+            self.cache[normname] = ret
+
+        if ret == False:
+            return default
+
+        return ret
+
+    def items(self):
+        return [ (normname, self._unpackApi(bytez)) for (normname, bytez) in self.keydb.items() ]
+
+def packImpApiDefs(apidefs):
+    '''
+    Pack a dict of normname: api definition tuples into a list of (normname,
+    bytes) tuples and the string table they use.
+    '''
+    strings = [ None, ]
+    stridx = { None:0 }
+    def getidx(s):
+        idx = stridx.get(s)
+        if idx == None:
+            idx = len(strings)
+            strings.append(s)
+            stridx[s] = idx
+        return idx
+
+    items = []
+    for normname, (rtype, rname, cconv, fname, args) in apidefs.items():
+        packed = [ impapi_hdr.pack(getidx(rtype), getidx(rname), getidx(cconv), len(args)) ]
+        for atype, aname in args:
+            packed.append( impapi_arg.pack(getidx(atype), getidx(aname)) )
+        packed.append(fname)
+        items.append( (normname, ''.join(packed)) )
+
+    return items, strings
+
+def getImpApiDbPath(api, arch):
+    return os.path.join(os.path.dirname(__file__), api, '%s.keydb' % arch)
+
+def getImpApiModule(api, arch):
+    modname = 'vivisect.impapi.%s.%s' % ( api, arch )
+    __import__( modname )
+    return sys.modules[ modname ]
+
+def buildImpApiDb(api, arch):
+    '''
+    (Re)build the prebuilt key db file for an impapi module.
+    '''
+    mod = getImpApiModule(api, arch)
+    items, strings = packImpApiDefs(mod.api)
+    meta = { 'apitypes':mod.apitypes, 'strings':strings }
+    e_keydb.writeKeyDb(getImpApiDbPath(api, arch), items, meta=meta)
+
+def getImpApiDb(api, arch):
+    '''
+    Return the (shared) key db of api definitions for the given api/arch
+    or None if there is no prebuilt db file.
+    '''
+    api = api.lower()
+    arch = arch.lower()
+    with _impapi_lock:
+        db = _impapi_dbs.get( (api, arch) )
+        if db == None:
+            dbpath = getImpApiDbPath(api, arch)
+            if not os.path.isfile(dbpath):
+                return None
+
+            db = ImpApiDb(dbpath)
+            _impapi_dbs[ (api, arch) ] = db
+
+        return db
 
 class ImportApi:
 
     def __init__(self):
-        self._api_lookup = {}
+        # api dicts/dbs in the order they were added ( the last wins )
+        self._api_lookups = []
         self._apitype_lookup = {}
 
     def getImpApiType(self, tname):
         return self._apitype_lookup.get( tname )
 
     def updateApiDef(self, apidict):
-        self._api_lookup.update( apidict )
+        if not self._api_lookups or type(self._api_lookups[-1]) != dict:
+            self._api_lookups.append( {} )
+        self._api_lookups[-1].update( apidict )
+
+    def _getImpApi(self, normname):
+        for lookup in reversed(self._api_lookups):
+            ret = lookup.get( normname )
+            if ret != None:
+                return ret
 
     def getImpApi(self, funcname):
         '''
         An API definition consists of the following:
             ( rettype, retname, callconv, funcname, ( (argtype, argname), ...) )
         '''
-        return self._api_lookup.get( funcname.lower() )
+        return self._getImpApi( funcname.lower() )
 
     def getImpApiCallConv(self, funcname):
-        ret = self._api_lookup.get( funcname.lower() )
+        ret = self._getImpApi( funcname.lower() )
         if ret == None:
             return None
         return ret[2]
 
     def getImpApiArgs(self, funcname):
-        ret = self._api_lookup.get( funcname.lower() )
+        ret = self._getImpApi( funcname.lower() )
         if ret == None:
             return None
         return ret[4]
 
     def getImpApiRetType(self, funcname):
-        ret = self._api_lookup.get( funcname.lower() )
+        ret = self._getImpApi( funcname.lower() )
         if ret == None:
             return None
         return ret[0]
 
     def getImpApiRetName(self, funcname):
-        ret = self._api_lookup.get( funcname.lower() )
+        ret = self._getImpApi( funcname.lower() )
         if ret == None:
             return None
         return ret[1]
 
     def getImpApiArgTypes(self, funcname):
-        ret = self._api_lookup.get( funcname.lower() )
+        ret = self._getImpApi( funcname.lower() )
         if ret == None:
             return None
         return [ argt for (argt,argn) in ret[4] ]
 
     def getImpApiArgNames(self, funcname):
-        ret = self._api_lookup.get( funcname.lower() )
+        ret = self._getImpApi( funcname.lower() )
         if ret == None:
             return None
         return [ argn for (argt,argn) in ret[4] ]
 
     def addImpApi(self, api, arch):
-        api = api.lower()
-        arch = arch.lower()
-        modname = 'vivisect.impapi.%s.%s' % ( api, arch )
-        #mod = imp.load_module( modname, *imp.find_module( modname ) )
-        __import__( modname )
-        mod = sys.modules[ modname ]
-        self._api_lookup.update( mod.api )
-        self._apitype_lookup.update( mod.apitypes )
+        db = getImpApiDb(api, arch)
+        if db == None:
+            # No prebuilt db, fall back to the python module
+            mod = getImpApiModule(api.lower(), arch.lower())
+            self.updateApiDef( mod.api )
+            self._apitype_lookup.update( mod.apitypes )
+            return
+
+        self._api_lookups.append( db )
+        self._apitype_lookup.update( db.apitypes )
 
 def getImportApi( api, arch ):
     impapi = ImportApi()
@@ -0,0 +1,24 @@
+'''
+Rebuild the prebuilt key db files for the impapi modules.
+
+( run this after changing one of the vivisect.impapi.<api>.<arch> modules )
+
+Usage: python -m vivisect.impapi.builddb
+'''
+import sys
+
+import vivisect.impapi as viv_impapi
+
+impapi_mods = (
+    ('windows', 'i386'),
+    ('windows', 'amd64'),
+    ('winkern', 'i386'),
+)
+
+def main(argv):
+    for api, arch in impapi_mods:
+        viv_impapi.buildImpApiDb(api, arch)
+        print('%s' % viv_impapi.getImpApiDbPath(api, arch))
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -43,7 +43,6 @@ class WorkspaceEmulator:
         self.path = self.newCodePathNode()
         self.curpath = self.path
         self.op = None
-        self.opcache = {}
         self.emumon = None
         self.psize = self.getPointerSize()
 
@@ -53,11 +52,20 @@ class WorkspaceEmulator:
 
         self.strictops = True   # shoudl we bail on emulation if unsupported instruction encountered
 
+        self._emu_pool = None    # Set while checked out of an EmulatorPool
+        self._emu_poolgen = None
+        self._emu_resetpoint = None
+
         # Map in all the memory associated with the workspace
         for va, size, perms, fname in vw.getMemoryMaps():
             offset, bytes = vw.getByteDef(va)
             self.addMemoryMap(va, perms, fname, bytes)
 
+        # Our maps are the workspace maps, so share translated blocks
+        # with the other emulators for the workspace
+        self._emu_tcache = vw._emu_tcaches.setdefault(self.__class__, self._emu_tcache)
+        self.setOpcodeCache(vw.getOpcodeCache())
+
         for regidx in self.taintregs:
             rname = self.getRegisterName(regidx)
             regval = self.setVivTaint( 'uninitreg', regidx )
@@ -124,6 +132,66 @@ class WorkspaceEmulator:
             # no need to do tainting here, since SP will always be in the
             #   first map
 
+    def setResetPoint(self):
+        '''
+        Save the current state of the emulator as the one resetEmulator()
+        will return it to.  ( see vivisect.impemu.pool )
+        '''
+        # Restart the taint va counter from the same place on reset
+        taintnext = self.taintva.next()
+        self.taintva = itertools.count(taintnext, 8192)
+
+        self._emu_resetpoint = (
+            self.getEmuSnap(),
+            set(self._emu_dirty),
+            dict(self._emu_opts),
+            list(self._emu_segments),
+            dict(self.hooks),
+            dict(self.taints),
+            taintnext,
+            (self.stack_map_mask, self.stack_map_base, self.stack_map_top, self.stack_pointer),
+        )
+
+    def resetEmulator(self, logwrite=False, logread=False):
+        '''
+        Return the emulator to the state saved by setResetPoint() which
+        is the same as building a new emulator ( registers, memory, taints
+        and code path tree ) without the cost of doing so.
+        '''
+        esnap, dirty, opts, segs, hooks, taints, taintnext, stackinfo = self._emu_resetpoint
+
+        self._emu_dirty = set(dirty)
+        self.setEmuSnap(esnap)
+
+        self._emu_opts = dict(opts)
+        self._emu_segments = list(segs)
+        self.hooks = dict(hooks)
+        self.taints = dict(taints)
+        self.taintva = itertools.count(taintnext, 8192)
+        self.stack_map_mask, self.stack_map_base, self.stack_map_top, self.stack_pointer = stackinfo
+
+        self.funcva = None
+        self.emustop = False
+        self.uninit_use = {}
+        self.logwrite = logwrite
+        self.logread = logread
+        self.path = self.newCodePathNode()
+        self.curpath = self.path
+        self.op = None
+        self.emumon = None
+
+        self._safe_mem = True
+        self._func_only = True
+        self.strictops = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc, val, tb):
+        # Pooled emulators go back to their pool
+        if self._emu_pool != None:
+            self._emu_pool.putEmulator(self)
+
     def stopEmu(self):
         '''
         This is called by monitor to stop emulation
@@ -149,13 +217,12 @@ class WorkspaceEmulator:
         self.emumon = emumon
 
     def parseOpcode(self, pc):
-        # We can make an opcode *faster* with the workspace because of
-        # getByteDef etc... use it.
-        op = self.opcache.get(pc)
-        if op == None:
-            op = envi.Emulator.parseOpcode(self, pc)
-            self.opcache[pc] = op
-        return op
+        # Instruction reads are only logged if we don't translate them
+        if self.logread:
+            return e_mem.PagedMemoryObject.parseOpcode(self, pc)
+
+        self._useVirtAddr(pc)
+        return envi.Emulator.parseOpcode(self, pc)
 
     def checkCall(self, starteip, endeip, op):
         """
@@ -537,7 +604,7 @@ class WorkspaceEmulator:
         if self._safe_mem and not probeok:
             return
 
-        return e_mem.MemoryObject.writeMemory(self, va, bytes)
+        return envi.Emulator.writeMemory(self, va, bytes)
 
     def logUninitRegUse(self, regid):
         self.uninit_use[regid] = True
@@ -565,7 +632,7 @@ class WorkspaceEmulator:
         if self._safe_mem and not probeok:
             return 'A' * size
 
-        return e_mem.MemoryObject.readMemory(self, va, size)
+        return e_mem.PagedMemoryObject.readMemory(self, va, size)
 
     # Some APIs for telling if pointers are in runtime memory regions
 
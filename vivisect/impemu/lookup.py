@@ -1,18 +1,36 @@
 '''
 Home for the registered emulators of different types...
+
+The emulator modules ( and their envi arch modules ) are only imported
+the first time one is asked for.
 '''
-import vivisect.impemu.platarch.h8 as v_i_h8
-import vivisect.impemu.platarch.arm as v_i_arm
-import vivisect.impemu.platarch.i386 as v_i_i386
-import vivisect.impemu.platarch.amd64 as v_i_amd64
-import vivisect.impemu.platarch.msp430 as v_i_msp430
-import vivisect.impemu.platarch.windows as v_i_windows
+import sys
 
+# arch or (platform, arch): (module name, class name)
 workspace_emus  = {
-    'h8' :v_i_h8.H8WorkspaceEmulator,
-    'arm' :v_i_arm.ArmWorkspaceEmulator,
-    'i386'  :v_i_i386.i386WorkspaceEmulator,
-    'amd64' :v_i_amd64.Amd64WorkspaceEmulator,
-    'msp430' :v_i_msp430.Msp430WorkspaceEmulator,
-    ('windows','i386'):v_i_windows.Windowsi386Emulator,
+    'h8' :('vivisect.impemu.platarch.h8', 'H8WorkspaceEmulator'),
+    'arm' :('vivisect.impemu.platarch.arm', 'ArmWorkspaceEmulator'),
+    'i386'  :('vivisect.impemu.platarch.i386', 'i386WorkspaceEmulator'),
+    'amd64' :('vivisect.impemu.platarch.amd64', 'Amd64WorkspaceEmulator'),
+    'msp430' :('vivisect.impemu.platarch.msp430', 'Msp430WorkspaceEmulator'),
+    ('windows','i386'):('vivisect.impemu.platarch.windows', 'Windowsi386Emulator'),
 }
+
+def getWorkspaceEmulator(arch, plat=None):
+    '''
+    Return the WorkspaceEmulator class for the given architecture (and
+    optionally platform) or None.
+
+    Example:
+        eclass = getWorkspaceEmulator('i386', plat='windows')
+    '''
+    emuinfo = workspace_emus.get( (plat,arch) )
+    if emuinfo == None:
+        emuinfo = workspace_emus.get(arch)
+
+    if emuinfo == None:
+        return None
+
+    modname, clsname = emuinfo
+    __import__(modname)
+    return getattr(sys.modules[modname], clsname)
@@ -0,0 +1,81 @@
+'''
+A pool of reusable WorkspaceEmulators.
+
+Building a WorkspaceEmulator maps in every workspace memory map, collects
+the import hooks and creates the stack and register taints.  Analysis
+passes which emulate many candidates take an emulator from the pool
+instead, which is reset to the state it was built in rather than being
+rebuilt.
+
+Example:
+
+    with vw.getPoolEmulator() as emu:
+        emu.runFunction(fva, maxhit=1)
+'''
+import threading
+
+class EmulatorPool:
+    '''
+    Free lists of reset-able emulators (per emulator class) for a workspace.
+
+    NOTE: The emulators are only valid for the workspace memory they were
+          built from, so the workspace must clear() the pool whenever its
+          memory maps (or bytes) change.
+    '''
+    def __init__(self, vw, maxfree=8):
+        self.vw = vw
+        self.maxfree = maxfree
+        self.lock = threading.Lock()
+        self.freelists = {}
+        self.generation = 0
+
+    def getEmulator(self, eclass, logwrite=False, logread=False):
+        '''
+        Get an emulator of the given class from the pool (or build one).
+        The emulator must be returned using putEmulator() ( or by using
+        it in a with block ) once the caller is done with it.
+        '''
+        with self.lock:
+            gen = self.generation
+            freelist = self.freelists.get(eclass)
+            emu = None
+            if freelist:
+                emu = freelist.pop()
+
+        if emu == None:
+            emu = eclass(self.vw)
+            emu.setResetPoint()
+
+        emu.resetEmulator(logwrite=logwrite, logread=logread)
+        emu._emu_pool = self
+        emu._emu_poolgen = gen
+        return emu
+
+    def putEmulator(self, emu):
+        '''
+        Return an emulator (from getEmulator()) to the pool.
+        '''
+        if emu._emu_pool is not self:
+            return
+
+        emu._emu_pool = None
+        # Drop our references to the last run
+        emu.emumon = None
+        emu.op = None
+
+        with self.lock:
+            if emu._emu_poolgen != self.generation:
+                return
+
+            freelist = self.freelists.setdefault(emu.__class__, [])
+            if len(freelist) < self.maxfree:
+                freelist.append(emu)
+
+    def clear(self):
+        '''
+        Discard all the pooled emulators ( including any which are
+        currently checked out when they are returned ).
+        '''
+        with self.lock:
+            self.generation += 1
+            self.freelists.clear()
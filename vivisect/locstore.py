@@ -0,0 +1,421 @@
+'''
+A compact storage construct for workspace location tuples.
+
+Rather than keeping a (va, size, ltype, tinfo) tuple in a list, a dict
+*and* one slot per byte of every memory map, the LocationStore keeps sorted
+array columns.  The address space is carved into fixed size buckets and
+each bucket holds parallel arrays of:
+
+    * the bucket relative offset of the entry va
+    * the entry size
+    * the location type
+    * an index into a table of (deduplicated) tinfo values
+
+Point and range lookups are done with bisect, and a per-type index of the
+buckets containing each location type keeps getLocations(ltype) from
+walking the whole workspace.
+
+The entries never overlap.  When a location is added over the top of
+existing ones, the bytes they still own are kept as "fragment" entries
+(which resolve to the original location tuple) and the original tuples
+are kept in a "shadowed" list so they are still returned by getLocations().
+This matches the semantics of the old byte-per-slot location map.
+'''
+import sys
+import array
+import bisect
+import collections
+
+# Offsets in a bucket are stored as unsigned shorts
+BUCKET_SHIFT = 16
+
+# The location type column value for fragment entries
+LTYPE_FRAG = 0xff
+
+class LocationStore:
+
+    def __init__(self):
+        self._ls_shift = BUCKET_SHIFT
+        self._ls_buckets = {}   # bidx: (offs, sizes, types, infos)
+        self._ls_bidxs = []     # sorted list of non-empty bucket indexes
+        self._ls_bytype = collections.defaultdict(dict) # ltype: {bidx:count}
+
+        self._ls_infos = [ None, ]
+        self._ls_infoidx = { None:0 }
+
+        self._ls_shadowed = []
+        self._ls_count = 0
+        self._ls_maxsize = 0
+
+    def __len__(self):
+        return self._ls_count + len(self._ls_shadowed)
+
+    def _getInfoIndex(self, tinfo):
+        try:
+            idx = self._ls_infoidx.get(tinfo)
+            if idx == None:
+                idx = len(self._ls_infos)
+                self._ls_infos.append(tinfo)
+                self._ls_infoidx[tinfo] = idx
+            return idx
+
+        except TypeError:
+            # Unhashable tinfo values just don't get deduplicated
+            self._ls_infos.append(tinfo)
+            return len(self._ls_infos) - 1
+
+    def _rawToLoc(self, raw):
+        eva, esize, etype, einfo = raw
+        if etype == LTYPE_FRAG:
+            return self._ls_infos[einfo]
+        return (eva, esize, etype, self._ls_infos[einfo])
+
+    def _getRaw(self, bidx, b, i):
+        return ( (bidx << self._ls_shift) + b[0][i], b[1][i], b[2][i], b[3][i] )
+
+    def _findRawIndex(self, va):
+        # Return (bidx, bucket, index) for the entry containing va (or None)
+        # ( unresolved branch targets etc make va == None common )
+        if va == None:
+            return None
+
+        shift = self._ls_shift
+        bidx = va >> shift
+
+        b = self._ls_buckets.get(bidx)
+        if b != None:
+            off = va - (bidx << shift)
+            i = bisect.bisect_right(b[0], off) - 1
+            if i >= 0:
+                if off < b[0][i] + b[1][i]:
+                    return bidx, b, i
+                return None
+
+        # Could an entry from a previous bucket span this va?
+        if self._ls_maxsize <= (va & ((1 << shift) - 1)):
+            return None
+
+        pos = bisect.bisect_left(self._ls_bidxs, bidx) - 1
+        if pos < 0:
+            return None
+
+        pbidx = self._ls_bidxs[pos]
+        pb = self._ls_buckets[pbidx]
+        i = len(pb[0]) - 1
+        if va < (pbidx << shift) + pb[0][i] + pb[1][i]:
+            return pbidx, pb, i
+        return None
+
+    def _getRawRange(self, va, size):
+        # Return the list of raw entries which overlap [va, va+size)
+        ret = []
+        if size <= 0:
+            return ret
+
+        shift = self._ls_shift
+        endva = va + size
+
+        first = self._findRawIndex(va)
+        if first != None:
+            ret.append(self._getRaw(*first))
+
+        bidxs = self._ls_bidxs
+        pos = bisect.bisect_left(bidxs, va >> shift)
+        while pos < len(bidxs):
+            bidx = bidxs[pos]
+            bbase = bidx << shift
+            if bbase >= endva:
+                break
+
+            b = self._ls_buckets[bidx]
+            offs = b[0]
+
+            i = bisect.bisect_left(offs, max(va - bbase, 0))
+            endoff = endva - bbase
+            while i < len(offs) and offs[i] < endoff:
+                if bbase + offs[i] != va or first == None:
+                    ret.append(self._getRaw(bidx, b, i))
+                i += 1
+
+            pos += 1
+
+        return ret
+
+    def _insertRaw(self, eva, esize, etype, einfo):
+        shift = self._ls_shift
+        bidx = eva >> shift
+        off = eva - (bidx << shift)
+
+        b = self._ls_buckets.get(bidx)
+        if b == None:
+            b = ( array.array('H'), array.array('i'), array.array('B'), array.array('i') )
+            self._ls_buckets[bidx] = b
+            bisect.insort(self._ls_bidxs, bidx)
+
+        offs, sizes, types, infos = b
+        i = bisect.bisect_left(offs, off)
+        offs.insert(i, off)
+        sizes.insert(i, esize)
+        types.insert(i, etype)
+        infos.insert(i, einfo)
+
+        tcounts = self._ls_bytype[etype]
+        tcounts[bidx] = tcounts.get(bidx, 0) + 1
+
+        if etype != LTYPE_FRAG:
+            self._ls_count += 1
+
+        if esize > self._ls_maxsize:
+            self._ls_maxsize = esize
+
+    def _deleteRaw(self, eva):
+        shift = self._ls_shift
+        bidx = eva >> shift
+        b = self._ls_buckets[bidx]
+        offs, sizes, types, infos = b
+
+        i = bisect.bisect_left(offs, eva - (bidx << shift))
+        etype = types[i]
+
+        del offs[i]
+        del sizes[i]
+        del types[i]
+        del infos[i]
+
+        if etype != LTYPE_FRAG:
+            self._ls_count -= 1
+
+        tcounts = self._ls_bytype[etype]
+        tcounts[bidx] -= 1
+        if not tcounts[bidx]:
+            tcounts.pop(bidx)
+
+        if not len(offs):
+            self._ls_buckets.pop(bidx)
+            self._ls_bidxs.remove(bidx)
+
+    def _clearRange(self, va, size):
+        # Remove ownership of [va, va+size) from any existing entries
+        endva = va + size
+        for raw in self._getRawRange(va, size):
+            eva, esize, etype, einfo = raw
+            self._deleteRaw(eva)
+
+            loc = self._rawToLoc(raw)
+            if etype != LTYPE_FRAG:
+                self._ls_shadowed.append(loc)
+
+            # Whatever the entry still owns becomes a fragment of it
+            fidx = None
+            eend = eva + esize
+            if eva < va:
+                fidx = self._getInfoIndex(loc)
+                self._insertRaw(eva, va - eva, LTYPE_FRAG, fidx)
+
+            if eend > endva:
+                if fidx == None:
+                    fidx = self._getInfoIndex(loc)
+                self._insertRaw(endva, eend - endva, LTYPE_FRAG, fidx)
+
+    def addLocation(self, loc):
+        '''
+        Add a (va, size, ltype, tinfo) location tuple to the store.
+        '''
+        lva, lsize, ltype, tinfo = loc
+
+        # Empty locations own no bytes
+        if lsize <= 0:
+            self._ls_shadowed.append(loc)
+            return
+
+        self._clearRange(lva, lsize)
+        self._insertRaw(lva, lsize, ltype, self._getInfoIndex(tinfo))
+
+    def delLocation(self, loc):
+        '''
+        Remove a location tuple from the store (clearing the bytes
+        it covers).
+        '''
+        lva, lsize, ltype, tinfo = loc
+        self._clearRange(lva, lsize)
+        try:
+            self._ls_shadowed.remove(loc)
+        except ValueError:
+            pass
+
+    def getLocation(self, va):
+        '''
+        Return the location tuple which contains va (or None).
+        '''
+        # NOTE: this is *the* hot path, so the common case is inlined
+        if va == None:
+            return None
+
+        shift = self._ls_shift
+        bidx = va >> shift
+        b = self._ls_buckets.get(bidx)
+        if b != None:
+            offs = b[0]
+            off = va - (bidx << shift)
+            i = bisect.bisect_right(offs, off) - 1
+            if i >= 0:
+                lsize = b[1][i]
+                if off >= offs[i] + lsize:
+                    return None
+
+                ltype = b[2][i]
+                if ltype == LTYPE_FRAG:
+                    return self._ls_infos[ b[3][i] ]
+                return ( va - off + offs[i], lsize, ltype, self._ls_infos[ b[3][i] ] )
+
+        ret = self._findRawIndex(va)
+        if ret == None:
+            return None
+        return self._rawToLoc(self._getRaw(*ret))
+
+    def findLocation(self, va, size):
+        '''
+        Return a (va, loc) tuple for the lowest address in [va, va+size)
+        which is owned by a location (or None).  The loc tuple is the
+        same one getLocation() would return for that address.
+        '''
+        if size <= 0:
+            return None
+
+        first = self._findRawIndex(va)
+        if first != None:
+            return va, self._rawToLoc(self._getRaw(*first))
+
+        shift = self._ls_shift
+        endva = va + size
+
+        bidxs = self._ls_bidxs
+        pos = bisect.bisect_left(bidxs, va >> shift)
+        while pos < len(bidxs):
+            bidx = bidxs[pos]
+            bbase = bidx << shift
+            if bbase >= endva:
+                break
+
+            b = self._ls_buckets[bidx]
+            i = bisect.bisect_left(b[0], max(va - bbase, 0))
+            if i < len(b[0]):
+                eva = bbase + b[0][i]
+                if eva >= endva:
+                    break
+                return eva, self._rawToLoc(self._getRaw(bidx, b, i))
+
+            pos += 1
+
+        return None
+
+    def getPrevLocation(self, va):
+        '''
+        Return the location which owns the highest address below
+        va (or None).
+        '''
+        shift = self._ls_shift
+        bidx = va >> shift
+
+        b = self._ls_buckets.get(bidx)
+        if b != None:
+            i = bisect.bisect_left(b[0], va - (bidx << shift)) - 1
+            if i >= 0:
+                return self._rawToLoc(self._getRaw(bidx, b, i))
+
+        pos = bisect.bisect_left(self._ls_bidxs, bidx) - 1
+        if pos < 0:
+            return None
+
+        pbidx = self._ls_bidxs[pos]
+        pb = self._ls_buckets[pbidx]
+        return self._rawToLoc(self._getRaw(pbidx, pb, len(pb[0]) - 1))
+
+    def getLocationsInRange(self, va, size):
+        '''
+        Return the (address ordered) list of location tuples which
+        own bytes in the range [va, va+size).
+        '''
+        return [ self._rawToLoc(raw) for raw in self._getRawRange(va, size) ]
+
+    def getLocations(self, ltype=None, linfo=None):
+        '''
+        Return the (address ordered) list of location tuples, optionally
+        only those of the given type (and tinfo).
+        '''
+        ret = []
+        infos = self._ls_infos
+        shift = self._ls_shift
+
+        if ltype == None:
+            for bidx in self._ls_bidxs:
+                offs, sizes, types, tinfos = self._ls_buckets[bidx]
+                bbase = bidx << shift
+                ret.extend([ (bbase + offs[i], sizes[i], types[i], infos[tinfos[i]])
+                             for i in xrange(len(offs)) if types[i] != LTYPE_FRAG ])
+
+            shadowed = self._ls_shadowed
+
+        else:
+            for bidx in sorted(self._ls_bytype.get(ltype, ())):
+                offs, sizes, types, tinfos = self._ls_buckets[bidx]
+                bbase = bidx << shift
+                ret.extend([ (bbase + offs[i], sizes[i], ltype, infos[tinfos[i]])
+                             for i in xrange(len(offs)) if types[i] == ltype ])
+
+            shadowed = [ loc for loc in self._ls_shadowed if loc[2] == ltype ]
+
+            if linfo != None:
+                ret = [ loc for loc in ret if loc[3] == linfo ]
+                shadowed = [ loc for loc in shadowed if loc[3] == linfo ]
+
+        if shadowed:
+            ret.extend(shadowed)
+            ret.sort()
+
+        return ret
+
+    def getColumns(self):
+        '''
+        Return a (picklable) tuple of the raw store columns.  This allows
+        storage modules to save (and restore with setColumns()) the store
+        without walking every location.
+        '''
+        buckets = []
+        for bidx in self._ls_bidxs:
+            offs, sizes, types, infos = self._ls_buckets[bidx]
+            buckets.append( (bidx, offs.tostring(), sizes.tostring(), types.tostring(), infos.tostring()) )
+
+        return (self._ls_shift, sys.byteorder, buckets, self._ls_infos, self._ls_shadowed, self._ls_maxsize)
+
+    def setColumns(self, cols):
+        '''
+        Replace the contents of the store with columns from getColumns().
+        '''
+        shift, byteorder, buckets, infos, shadowed, maxsize = cols
+
+        self.__init__()
+        self._ls_shift = shift
+        self._ls_infos = list(infos)
+        self._ls_shadowed = list(shadowed)
+        self._ls_maxsize = maxsize
+
+        for idx, tinfo in enumerate(self._ls_infos):
+            try:
+                self._ls_infoidx.setdefault(tinfo, idx)
+            except TypeError:
+                pass
+
+        for bidx, offs, sizes, types, tinfos in buckets:
+            b = ( array.array('H', offs), array.array('i', sizes), array.array('B', types), array.array('i', tinfos) )
+            if byteorder != sys.byteorder:
+                for a in b:
+                    a.byteswap()
+
+            self._ls_buckets[bidx] = b
+            self._ls_bidxs.append(bidx)
+
+            for etype, count in collections.Counter(b[2]).items():
+                self._ls_bytype[etype][bidx] = count
+                if etype != LTYPE_FRAG:
+                    self._ls_count += count
@@ -0,0 +1,596 @@
+'''
+Speculative parallel execution of analysis loops.
+
+Many analysis passes are loops of the form:
+
+    for item in items:
+        if skip(vw, item):
+            continue
+        result = compute(vw, item)  # expensive (emulation etc)
+        apply(vw, item, result)     # cheap workspace updates
+
+parallelMap() runs compute() for upcoming items in forked worker processes
+(which share the workspace state copy-on-write) while the parent consumes
+the results strictly in order.  Each worker records which parts of the
+workspace it read, and any events it fired.  When the parent gets to an
+item, the worker result is only used if none of the events applied since
+that worker was forked touch what it read; otherwise compute() is simply
+run again inline.  Accepted worker events are merged through _fireEvent.
+
+The results are therefore deterministic and identical to the serial loop,
+provided compute() only modifies the workspace by firing events, and only
+reads the workspace through what is tracked: the dicts in tracked_dicts,
+the location and xref stores, the block map, the dead data ranges and the
+code flow context.  Code flow context state is changed outside of events
+(as a side effect of them), so reading any of it conflicts with any event
+which may change it.
+
+The number of workers is set by the viv.analysis.workers config option
+(values below 2 run the loop serially).
+'''
+import os
+import bisect
+import signal
+import collections
+import cPickle as pickle
+
+from vivisect.const import *
+
+# Workspace dict attributes whose key reads are tracked in workers
+tracked_dicts = (
+    'funcmeta',
+    'name_by_va',
+    'va_by_name',
+    'metadata',
+    'comments',
+    'vasets',
+    'frefs',
+    'symhints',
+    'func_args',
+)
+
+# Code flow context dicts (changed as a side effect of events)
+tracked_cfctx = (
+    '_funcs',
+    '_fcalls',
+    '_cf_noret',
+    '_cf_noflow',
+    '_cf_blocks',
+)
+
+# Events whose handlers (or the code which fires them) change the cfctx
+cfctx_events = (
+    VWE_ADDLOCATION,
+    VWE_DELLOCATION,
+    VWE_ADDFUNCTION,
+    VWE_DELFUNCTION,
+    VWE_SETFUNCMETA,
+    VWE_ADDCODEBLOCK,
+    VWE_SETMETA,
+)
+
+# A key which conflicts with every key in the same namespace
+ANYKEY = '*'
+
+class TrackingDict(dict):
+    '''
+    A dict which records the keys read from it (or ANYKEY if it is
+    iterated) as (name, key) tuples in the tracker's current ReadSet.
+    '''
+    def __init__(self, name, tracker, *args):
+        dict.__init__(self, *args)
+        self._td_name = name
+        self._td_tracker = tracker
+
+    def _read(self, key):
+        self._td_tracker.reads.keys.add( (self._td_name, key) )
+
+    def _any(self):
+        self._td_tracker.reads.keys.add( (self._td_name, ANYKEY) )
+
+    def get(self, key, default=None):
+        self._read(key)
+        return dict.get(self, key, default)
+
+    def __getitem__(self, key):
+        self._read(key)
+        return dict.__getitem__(self, key)
+
+    def __contains__(self, key):
+        self._read(key)
+        return dict.__contains__(self, key)
+
+    def has_key(self, key):
+        return self.__contains__(key)
+
+    def setdefault(self, key, default=None):
+        self._read(key)
+        return dict.setdefault(self, key, default)
+
+    def pop(self, key, *args):
+        self._read(key)
+        return dict.pop(self, key, *args)
+
+    def __iter__(self):
+        self._any()
+        return dict.__iter__(self)
+
+    def __len__(self):
+        self._any()
+        return dict.__len__(self)
+
+    def keys(self):
+        self._any()
+        return dict.keys(self)
+
+    def values(self):
+        self._any()
+        return dict.values(self)
+
+    def items(self):
+        self._any()
+        return dict.items(self)
+
+    def iterkeys(self):
+        self._any()
+        return dict.iterkeys(self)
+
+    def itervalues(self):
+        self._any()
+        return dict.itervalues(self)
+
+    def iteritems(self):
+        self._any()
+        return dict.iteritems(self)
+
+class TrackingList(list):
+    '''
+    A list which records any read of it as (name, ANYKEY) in the
+    tracker's current ReadSet.
+    '''
+    def __init__(self, name, tracker, *args):
+        list.__init__(self, *args)
+        self._tl_name = name
+        self._tl_tracker = tracker
+
+    def _any(self):
+        self._tl_tracker.reads.keys.add( (self._tl_name, ANYKEY) )
+
+    def __getitem__(self, idx):
+        self._any()
+        return list.__getitem__(self, idx)
+
+    def __getslice__(self, i, j):
+        self._any()
+        return list.__getslice__(self, i, j)
+
+    def __contains__(self, item):
+        self._any()
+        return list.__contains__(self, item)
+
+    def __iter__(self):
+        self._any()
+        return list.__iter__(self)
+
+    def __len__(self):
+        self._any()
+        return list.__len__(self)
+
+    def index(self, item, *args):
+        self._any()
+        return list.index(self, item, *args)
+
+    def count(self, item):
+        self._any()
+        return list.count(self, item)
+
+class ReadSet:
+    '''
+    The workspace reads made by a worker.
+    '''
+    def __init__(self):
+        self.keys = set()       # (name, key) tuples from TrackingDicts
+        self.locvas = set()     # point location lookups
+        self.locranges = []     # (va, size) location range lookups
+        self.keyranges = []     # (name, va, size) range lookups of va keys
+
+    def conflicts(self, writes):
+        '''
+        Return True if any of the (name, key) or ('loc', va, size) write
+        tuples touch something in the read set.
+        '''
+        keys = self.keys
+        names = set( name for name, key in keys )
+        names.update( name for name, va, size in self.keyranges )
+        locvas = None
+
+        for w in writes:
+            if w == None:
+                return True
+
+            if w[0] == 'loc':
+                wva, wsize = w[1], w[2]
+                if ('loc', ANYKEY) in keys:
+                    return True
+
+                if locvas == None:
+                    locvas = sorted(self.locvas)
+
+                i = bisect.bisect_left(locvas, wva)
+                if i < len(locvas) and locvas[i] < wva + wsize:
+                    return True
+
+                for rva, rsize in self.locranges:
+                    if wva < rva + rsize and rva < wva + wsize:
+                        return True
+                continue
+
+            name, key = w
+            if key == ANYKEY:
+                if name in names:
+                    return True
+                continue
+
+            if (name, key) in keys or (name, ANYKEY) in keys:
+                return True
+
+            for rname, rva, rsize in self.keyranges:
+                if rname == name and rva <= key < rva + rsize:
+                    return True
+
+        return False
+
+def getEventWrites(event, einfo):
+    '''
+    Return the list of (name, key) / ('loc', va, size) tuples describing
+    what the given event modifies (None for "could be anything").
+    '''
+    ret = []
+    if event in cfctx_events:
+        ret.append( ('cfctx', ANYKEY) )
+
+    if event in (VWE_ADDLOCATION, VWE_DELLOCATION):
+        return ret + [ ('loc', einfo[L_VA], einfo[L_SIZE]) ]
+
+    if event in (VWE_ADDXREF, VWE_DELXREF):
+        return [ ('xrefs_by_from', einfo[XR_FROM]), ('xrefs_by_to', einfo[XR_TO]) ]
+
+    if event == VWE_SETNAME:
+        # the previous name (if any) is removed from va_by_name too
+        return [ ('name_by_va', einfo[0]), ('va_by_name', ANYKEY) ]
+
+    if event == VWE_SETFUNCMETA:
+        return ret + [ ('funcmeta', einfo[0]) ]
+
+    if event == VWE_SETFUNCARGS:
+        return [ ('funcmeta', einfo[0]), ('func_args', einfo[0]) ]
+
+    if event == VWE_ADDFUNCTION:
+        return ret + [ ('funcmeta', einfo[0]), ('blocks', ANYKEY) ]
+
+    if event == VWE_ADDCODEBLOCK:
+        return ret + [ ('funcmeta', einfo[CB_FUNCVA]), ('blocks', ANYKEY) ]
+
+    if event == VWE_COMMENT:
+        return [ ('comments', einfo[0]) ]
+
+    if event == VWE_SETMETA:
+        # deaddata: meta callbacks add to the dead data ranges
+        if einfo[0].startswith('deaddata:'):
+            ret.append( ('deaddata', ANYKEY) )
+        return ret + [ ('metadata', einfo[0]) ]
+
+    if event in (VWE_SETVASETROW, VWE_DELVASETROW):
+        return [ ('vasets', einfo[0]) ]
+
+    if event == VWE_ADDFREF:
+        return [ ('frefs', (einfo[0], einfo[1])) ]
+
+    if event == VWE_SYMHINT:
+        return [ ('symhints', (einfo[0], einfo[1])) ]
+
+    if event == VWE_AUTOANALFIN:
+        return []
+
+    return [ None ]
+
+class ReadTracker:
+    '''
+    Hooks the workspace (in a worker!) to record reads into the
+    current ReadSet.
+    '''
+    def __init__(self, vw):
+        self.reads = ReadSet()
+
+        for name in tracked_dicts:
+            setattr(vw, name, TrackingDict(name, self, getattr(vw, name)))
+
+        for name in tracked_cfctx:
+            setattr(vw.cfctx, name, TrackingDict('cfctx', self, getattr(vw.cfctx, name)))
+
+        vw._dead_data = TrackingList('deaddata', self, vw._dead_data)
+
+        ls = vw.locstore
+        self._getLocation = ls.getLocation
+        self._getPrevLocation = ls.getPrevLocation
+        self._getLocations = ls.getLocations
+        self._getLocationsInRange = ls.getLocationsInRange
+        self._getMapLookup = vw.blockmap.getMapLookup
+
+        xs = vw.xrefstore
+        self._hasXref = xs.hasXref
+        self._getXrefs = xs.getXrefs
+        self._getXrefsFrom = xs.getXrefsFrom
+        self._getXrefsTo = xs.getXrefsTo
+        self._getXrefsFromRange = xs.getXrefsFromRange
+        self._getXrefsToRange = xs.getXrefsToRange
+
+        ls.getLocation = self.getLocation
+        ls.getPrevLocation = self.getPrevLocation
+        ls.getLocations = self.getLocations
+        ls.getLocationsInRange = self.getLocationsInRange
+        vw.blockmap.getMapLookup = self.getMapLookup
+
+        xs.hasXref = self.hasXref
+        xs.getXrefs = self.getXrefs
+        xs.getXrefsFrom = self.getXrefsFrom
+        xs.getXrefsTo = self.getXrefsTo
+        xs.getXrefsFromRange = self.getXrefsFromRange
+        xs.getXrefsToRange = self.getXrefsToRange
+
+    def getLocation(self, va):
+        self.reads.locvas.add(va)
+        return self._getLocation(va)
+
+    def getPrevLocation(self, va):
+        self.reads.keys.add( ('loc', ANYKEY) )
+        return self._getPrevLocation(va)
+
+    def getLocations(self, ltype=None, linfo=None):
+        self.reads.keys.add( ('loc', ANYKEY) )
+        return self._getLocations(ltype=ltype, linfo=linfo)
+
+    def getLocationsInRange(self, va, size):
+        self.reads.locranges.append( (va, size) )
+        return self._getLocationsInRange(va, size)
+
+    def getMapLookup(self, va):
+        self.reads.keys.add( ('blocks', ANYKEY) )
+        return self._getMapLookup(va)
+
+    def hasXref(self, xref):
+        self.reads.keys.add( ('xrefs_by_from', xref[XR_FROM]) )
+        return self._hasXref(xref)
+
+    def getXrefs(self, rtype=None):
+        self.reads.keys.add( ('xrefs_by_from', ANYKEY) )
+        return self._getXrefs(rtype=rtype)
+
+    def getXrefsFrom(self, va, rtype=None):
+        self.reads.keys.add( ('xrefs_by_from', va) )
+        return self._getXrefsFrom(va, rtype=rtype)
+
+    def getXrefsTo(self, va, rtype=None):
+        self.reads.keys.add( ('xrefs_by_to', va) )
+        return self._getXrefsTo(va, rtype=rtype)
+
+    def getXrefsFromRange(self, va, size, rtype=None):
+        self.reads.keyranges.append( ('xrefs_by_from', va, size) )
+        return self._getXrefsFromRange(va, size, rtype=rtype)
+
+    def getXrefsToRange(self, va, size, rtype=None):
+        self.reads.keyranges.append( ('xrefs_by_to', va, size) )
+        return self._getXrefsToRange(va, size, rtype=rtype)
+
+def _writeAll(fd, buf):
+    while buf:
+        n = os.write(fd, buf)
+        buf = buf[n:]
+
+def _readAll(fd):
+    chunks = []
+    while True:
+        buf = os.read(fd, 1024 * 1024)
+        if not buf:
+            break
+        chunks.append(buf)
+    return ''.join(chunks)
+
+class Worker:
+    '''
+    A forked process which runs compute(vw, item) for a batch of items.
+    '''
+    def __init__(self, vw, items, compute):
+        self.mark = len(vw._event_list)
+        self.results = None
+
+        rfd, wfd = os.pipe()
+        self.pid = os.fork()
+        if self.pid == 0:
+            os.close(rfd)
+            self._workerMain(vw, items, compute, wfd)
+
+        os.close(wfd)
+        self.rfd = rfd
+
+    def _workerMain(self, vw, items, compute, wfd):
+        try:
+            buf = ''
+            try:
+                results = []
+                tracker = ReadTracker(vw)
+                for item in items:
+                    tracker.reads = ReadSet()
+                    mark = len(vw._event_list)
+                    try:
+                        results.append( (True, compute(vw, item), vw._event_list[mark:], tracker.reads) )
+                    except Exception, e:
+                        results.append( (False, None, vw._event_list[mark:], tracker.reads) )
+
+                buf = pickle.dumps(results, protocol=2)
+
+            except Exception, e:
+                pass
+
+            _writeAll(wfd, buf)
+
+        finally:
+            os._exit(0)
+
+    def getResults(self):
+        '''
+        Return the list of (ok, result, events, reads) tuples for the
+        batch (or None if the worker failed).
+        '''
+        if self.rfd == None:
+            return self.results
+
+        try:
+            buf = _readAll(self.rfd)
+        finally:
+            os.close(self.rfd)
+            os.waitpid(self.pid, 0)
+            self.rfd = None
+
+        if buf:
+            try:
+                self.results = pickle.loads(buf)
+            except Exception, e:
+                pass
+
+        return self.results
+
+    def cancel(self):
+        if self.rfd == None:
+            return
+
+        os.close(self.rfd)
+        self.rfd = None
+        try:
+            os.kill(self.pid, signal.SIGKILL)
+        except OSError, e:
+            pass
+        os.waitpid(self.pid, 0)
+
+def getWorkerCount(vw):
+    '''
+    Return the number of analysis worker processes configured for the
+    workspace (or 0 if analysis should not be parallel).
+    '''
+    if not hasattr(os, 'fork'):
+        return 0
+
+    # Workspace clients must see the events in order from the server
+    if vw.server != None:
+        return 0
+
+    workers = vw.config.viv.analysis.workers
+    if workers < 0:
+        import multiprocessing
+        workers = multiprocessing.cpu_count()
+
+    return workers
+
+def _forkBatch(vw, todo, compute, skip, batchsize):
+    # Returns a list of (item, worker, idx) tuples (or [] when done)
+    batch = []
+    items = []
+    for item in todo:
+        # Don't bother computing items which are skipped (for now)
+        if skip != None and skip(vw, item):
+            batch.append( (item, None) )
+            continue
+
+        batch.append( (item, len(items)) )
+        items.append(item)
+        if len(items) >= batchsize:
+            break
+
+    worker = None
+    if items:
+        worker = Worker(vw, items, compute)
+
+    return [ (item, worker, idx) for item, idx in batch ]
+
+def parallelMap(vw, items, compute, skip=None, workers=None):
+    '''
+    Yield (item, compute(vw, item)) for each of the items (in order),
+    skipping those for which skip(vw, item) returns True.  The result
+    is identical to the serial loop, but compute() is done ahead of time
+    by worker processes.  ( see module docs for restrictions )
+
+    Example:
+        for va, res in parallelMap(vw, vas, emulateIt):
+            applyResults(vw, va, res)
+    '''
+    if workers == None:
+        workers = getWorkerCount(vw)
+
+    if workers < 2:
+        for item in items:
+            if skip != None and skip(vw, item):
+                continue
+            yield item, compute(vw, item)
+        return
+
+    items = list(items)
+    todo = iter(items)
+
+    # Batch items to amortize the fork, but keep all the workers busy
+    batchsize = max(1, min(64, len(items) / (workers * 4)))
+
+    batches = collections.deque()
+    try:
+        while True:
+
+            while len(batches) < workers:
+                batch = _forkBatch(vw, todo, compute, skip, batchsize)
+                if not batch:
+                    break
+                batches.append(batch)
+
+            if not batches:
+                break
+
+            # Writes made by earlier items in the same worker
+            batchwrites = []
+
+            for item, worker, idx in batches.popleft():
+
+                ret = None
+                if worker != None and idx != None:
+                    results = worker.getResults()
+                    if results != None:
+                        ret = results[idx]
+
+                writes = list(batchwrites)
+                if ret != None:
+                    for event, einfo in ret[2]:
+                        batchwrites.extend(getEventWrites(event, einfo))
+
+                # Things may have changed since the worker was forked
+                if skip != None and skip(vw, item):
+                    continue
+
+                if ret != None:
+                    ok, result, events, reads = ret
+                    for event, einfo in vw._event_list[worker.mark:]:
+                        writes.extend(getEventWrites(event, einfo))
+
+                    if not ok or reads.conflicts(writes):
+                        ret = None
+
+                if ret == None:
+                    yield item, compute(vw, item)
+                    continue
+
+                for event, einfo in events:
+                    vw._fireEvent(event, einfo)
+
+                yield item, result
+
+    finally:
+        for batch in batches:
+            for item, worker, idx in batch:
+                if worker != None:
+                    worker.cancel()
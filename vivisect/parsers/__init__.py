@@ -15,8 +15,6 @@ import md5
 import sys
 import struct
 
-import vstruct.defs.macho as vs_macho
-
 def md5File(filename):
     d = md5.md5()
     f = file(filename,"rb")
@@ -31,13 +29,15 @@ def md5Bytes(bytes):
     d.update(bytes)
     return d.hexdigest()
 
+# The vstruct.defs.macho MH_MAGIC, MH_CIGAM, MH_MAGIC_64, MH_CIGAM_64,
+# FAT_MAGIC and FAT_CIGAM values ( without importing all of vstruct.defs )
 macho_magics = (
-    vs_macho.MH_MAGIC,
-    vs_macho.MH_CIGAM,
-    vs_macho.MH_MAGIC_64,
-    vs_macho.MH_CIGAM_64,
-    vs_macho.FAT_MAGIC,
-    vs_macho.FAT_CIGAM,
+    0xfeedface,
+    0xcefaedfe,
+    0xfeedfacf,
+    0xcffaedfe,
+    0xcafebabe,
+    0xbebafeca,
 )
 
 def guessFormat(bytes):
@@ -25,7 +25,7 @@ from vivisect.const import *
 #0x183   DEC Alpha AXP
 
 def parseFile(vw, filename):
-    pe = PE.PE(file(filename,"rb"))
+    pe = PE.peFromFileName(filename, mapped=True)
     return loadPeIntoWorkspace(vw, pe, filename)
 
 def parseBytes(vw, bytes):
@@ -428,8 +428,11 @@ def loadPeIntoWorkspace(vw, pe, filename=None):
 
     # auto-mark embedded PEs as "dead data" to prevent code flow...
     if carvepes: 
-        pe.fd.seek(0)
-        fbytes = pe.fd.read()
+        # carve straight out of the mapping when we have one
+        fbytes = pe.mmap
+        if fbytes == None:
+            pe.fd.seek(0)
+            fbytes = pe.fd.read()
         for offset, i in pe_carve.carve(fbytes, 1):
             # Found a sub-pe!
             subpe = pe_carve.CarvedPE(fbytes, offset, chr(i))
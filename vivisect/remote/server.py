@@ -1,8 +1,11 @@
 import os
 import sys
+import zlib
 import time
 import cobra
 import Queue
+import atexit
+import weakref
 import optparse
 import threading
 
@@ -24,8 +27,46 @@ timeo_wait  = 10
 timeo_sock  = 30
 timeo_aban  = 120   # 2 minute timeout for abandon
 
+# Clients batch up the events they fire and send them at most
+# every batch_wait seconds (or every batch_max events)
+batch_wait  = 0.1
+batch_max   = 10000
+
+# The compressed workspace snapshot served to new clients is rebuilt
+# once this many events have been fired since it was made
+snap_delta_max = 0x2000
+
 # This should *only* rev when they're truly incompatible
-server_version = 20130820
+server_version = 20261019
+
+def packSnapshot(events):
+    '''
+    Serialize (and compress) a list of workspace events for a snapshot.
+    Snapshots use msgpack like the rest of the transport ( clients must
+    never unpickle anything from a server ).
+    '''
+    cobra.requireMsgpack()
+    return zlib.compress(cobra.msgpack.dumps(events, **cobra.dumpargs))
+
+def unpackSnapshot(snap):
+    '''
+    Decode a snapshot from packSnapshot() ( the same way the msgpack
+    cobra transport decodes messages ).
+    '''
+    cobra.requireMsgpack()
+    return cobra.msgpack.loads(zlib.decompress(snap), **cobra.loadargs)
+
+# The live clients ( whose waiting events are flushed at exit )
+_live_clients = weakref.WeakSet()
+
+def _flushLiveClients():
+    for client in list(_live_clients):
+        try:
+            client.close()
+        except Exception, e:
+            print('Failed to send workspace events to the server: %s' % e)
+
+atexit.register(_flushLiveClients)
 
 class VivServerClient:
     '''
@@ -40,26 +81,103 @@ class VivServerClient:
         self.eoffset = 0
         self.q = Queue.Queue()  # The actual local Q we deliver to
 
+        self.snap = None
+        self.events = []
+        self.eskip = None
+        self.elock = threading.Lock()
+        self.etimer = None
+        self.ethread = None
+        self.closed = False
+
+        _live_clients.add(self)
+
     @e_threads.firethread
     def _eatServerEvents(self):
-        while True:
-            for event in self.server.getNextEvents(self.chan):
+        while not self.closed:
+            try:
+                events = self.server.getNextEvents(self.chan)
+            except Exception:
+                # Our channel is shut down by close()
+                if self.closed:
+                    return
+                raise
+
+            for event in events:
                 self.q.put(event)
 
     def vprint(self, msg):
         return self.server.vprint(msg)
 
     def _fireEvent(self, event, einfo, local=False, skip=None):
-        return self.server._fireEvent(self.wsname, event, einfo, local=local, skip=skip)
+        # Events are queued up and sent to the server in batches
+        with self.elock:
+            if skip != self.eskip:
+                self._flushEvents()
+                self.eskip = skip
+
+            self.events.append( (event, einfo) )
+            if self.closed or len(self.events) >= batch_max:
+                self._flushEvents()
+                return
+
+            if self.etimer == None:
+                self.etimer = threading.Timer(batch_wait, self.flushEvents)
+                self.etimer.setDaemon(True)
+                self.etimer.start()
+
+    def _flushEvents(self):
+        # NOTE: must hold self.elock
+        if not self.events:
+            return
+        events = self.events
+        self.events = []
+        try:
+            self.server._fireEvents(self.wsname, events, skip=self.eskip)
+        except:
+            # Keep them to try again later
+            self.events = events + self.events
+            raise
+
+    def flushEvents(self):
+        '''
+        Send any events which are waiting to go to the server.
+        '''
+        with self.elock:
+            if self.etimer != None:
+                self.etimer.cancel()
+                self.etimer = None
+            self._flushEvents()
+
+    def close(self):
+        '''
+        Send any events which are waiting to go to the server and stop
+        receiving events from it.  Events fired after close() are sent
+        to the server immediately (rather than batched).
+        '''
+        with self.elock:
+            self.closed = True
+            if self.etimer != None:
+                self.etimer.cancel()
+                self.etimer = None
+            self._flushEvents()
+
+        if self.chan != None:
+            self.server.closeEventChannel(self.chan)
+
+        if self.ethread != None:
+            self.ethread.join(timeo_wait)
 
     def createEventChannel(self):
-        self.chan = self.server.createEventChannel(self.wsname)
-        self._eatServerEvents()
+        self.chan, self.snap = self.server.createEventSnapshot(self.wsname)
+        self.ethread = self._eatServerEvents()
         return self.chan
 
     def exportWorkspace(self):
-        # Retrieve the big initial list of viv events
-        return self.server.getNextEvents(self.chan)
+        # Unpack the big initial list of viv events (the events fired
+        # since the snapshot was made are waiting in our channel)
+        events = unpackSnapshot(self.snap)
+        self.snap = None
+        return events
 
     def waitForEvent(self, chan):
         return self.q.get()
@@ -69,6 +187,9 @@ class VivServer:
     def __init__(self, dirname=""):
         self.path = os.path.abspath(dirname)
 
+        # wsname: [ lock, path, pevents, users, elog, snap, savelock ]
+        # ( the savelock is held while the file is appended to, and is
+        # always acquired *before* the workspace lock )
         self.wsdict = {}
         self.chandict = {}
         self.wslock = threading.Lock()
@@ -97,20 +218,27 @@ class VivServer:
                 # Remove from our chandict
                 self.chandict.pop(chan, None)
                 # Remove from the workspace clients
-                lock, fpath, pevents, users = wsinfo
+                lock = wsinfo[0]
+                users = wsinfo[3]
                 with lock:
                     users.pop(chan,None)
 
     @e_threads.maintthread(30)
     def _saveWorkspaceThread(self):
+        self._saveWorkspaces()
+
+    def _saveWorkspaces(self):
         for wsinfo in self.wsdict.values():
-            lock,path,events,users = wsinfo
+            lock,path,events = wsinfo[:3]
             if events:
-                with lock:
-                    wsinfo[2] = []  # start a new events list...
+                # NOTE: the event log is never loaded while we hold the
+                # savelock, so it can't miss the events being saved
+                with wsinfo[6]:
+                    with lock:
+                        events = wsinfo[2]
+                        wsinfo[2] = []  # start a new events list...
+                    viv_basicfile.vivEventsAppendFile(path, events)
 
-                viv_basicfile.vivEventsAppendFile(path, events)
-                
     def _req_wsinfo(self, wsname):
         wsinfo = self.wsdict.get(wsname)
         if wsinfo == None:
@@ -137,7 +265,7 @@ class VivServer:
             os.makedirs(wsdir, 0750)
 
         viv_basicfile.vivEventsToFile(wspath, events)
-        wsinfo = [ threading.Lock(), wspath, [], {} ]
+        wsinfo = [ threading.Lock(), wspath, [], {}, list(events), None, threading.Lock() ]
         self.wsdict[wsname] = wsinfo
 
     def _loadWorkspaces(self):
@@ -164,7 +292,7 @@ class VivServer:
                 if wsinfo == None:
                     # Initialize the workspace info tuple
                     lock = threading.Lock()
-                    wsinfo = [ lock, wspath, [], {} ]
+                    wsinfo = [ lock, wspath, [], {}, None, None, threading.Lock() ]
                     print('loaded: %s' % wsname)
                     self.wsdict[wsname] = wsinfo
 
@@ -180,30 +308,92 @@ class VivServer:
     # used with remote workspaces, with a prepended wsname first argument
 
     def _fireEvent(self, wsname, event, einfo, local=False, skip=None):
-        lock, fpath, pevents, users = self._req_wsinfo(wsname)
-        evtup = (event,einfo)
-        with lock:
+        return self._fireEvents(wsname, [ (event, einfo), ], skip=skip)
+
+    def _fireEvents(self, wsname, events, skip=None):
+        '''
+        Fire a list of (event, einfo) tuples (in order) into a workspace.
+        '''
+        wsinfo = self._req_wsinfo(wsname)
+        events = [ tuple(evtup) for evtup in events ]
+        pevents = [ evtup for evtup in events if not evtup[0] & VTE_MASK ]
+        with wsinfo[0]:
             # Transient events do not get saved
-            if not event & VTE_MASK:
-                pevents.append(evtup)
+            wsinfo[2].extend(pevents)
+            if wsinfo[4] != None:
+                wsinfo[4].extend(pevents)
             # SPEED HACK
-            [ q.append(evtup) for (chan,q) in users.items() if chan != skip ]
+            [ q.extend(events) for (chan,q) in wsinfo[3].items() if chan != skip ]
+
+    def _loadEventLog(self, wsinfo):
+        # NOTE: must *not* hold the workspace lock
+        if wsinfo[4] != None:
+            return
+
+        # The file is complete while we hold the savelock
+        with wsinfo[6]:
+            with wsinfo[0]:
+                if wsinfo[4] == None:
+                    elog = viv_basicfile.vivEventsFromFile(wsinfo[1])
+                    elog.extend(wsinfo[2])
+                    wsinfo[4] = elog
+
+    def _addEventChannel(self, wsinfo, events):
+        # NOTE: must hold the workspace lock
+        chan = os.urandom(16).encode('hex')
+        # These must reference the same actual list object...
+        queue = e_threads.ChunkQueue(items=events)
+        wsinfo[3][chan] = queue
+        self.chandict[chan] = [ wsinfo, queue ]
+        return chan
+
+    def closeEventChannel(self, chan):
+        '''
+        Remove an event channel (waking any client waiting on it).
+        '''
+        chaninfo = self.chandict.pop(chan, None)
+        if chaninfo == None:
+            return
+
+        wsinfo,queue = chaninfo
+        with wsinfo[0]:
+            wsinfo[3].pop(chan, None)
+        queue.shutdown()
 
     def createEventChannel(self, wsname):
         wsinfo = self._req_wsinfo(wsname)
-        chan = os.urandom(16).encode('hex')
-
-        lock, fpath, pevents, users = wsinfo
-        with lock:
-            events = []
-            events.extend( viv_basicfile.vivEventsFromFile( fpath ) )
-            events.extend(pevents)
-            # These must reference the same actual list object...
-            queue = e_threads.ChunkQueue(items=events)
-            users[chan] = queue
-            self.chandict[chan] = [ wsinfo, queue ]
+        self._loadEventLog(wsinfo)
+        with wsinfo[0]:
+            events = list(wsinfo[4])
+            return self._addEventChannel(wsinfo, events)
 
-        return chan
+    def createEventSnapshot(self, wsname):
+        '''
+        Create an event channel for the given workspace and return a
+        (chan, snapshot) tuple.  The snapshot is a zlib compressed msgpack
+        of the workspace events up to some point and the channel starts
+        with any events fired since then.
+        '''
+        wsinfo = self._req_wsinfo(wsname)
+        self._loadEventLog(wsinfo)
+        with wsinfo[0]:
+            elog = wsinfo[4]
+            snap = wsinfo[5]
+            if snap == None or len(elog) - snap[0] > snap_delta_max:
+                snap = None
+                elog = elog[:]
+
+        # Build a new snapshot without blocking events from other clients
+        if snap == None:
+            snap = (len(elog), packSnapshot(elog))
+
+        with wsinfo[0]:
+            elog = wsinfo[4]
+            if wsinfo[5] == None or wsinfo[5][0] < snap[0]:
+                wsinfo[5] = snap
+            chan = self._addEventChannel(wsinfo, elog[snap[0]:])
+
+        return chan, snap[1]
 
 def getServerWorkspace(server, wsname):
     vw = vivisect.cli.VivCli()
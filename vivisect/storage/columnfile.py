@@ -0,0 +1,386 @@
+'''
+A columnar workspace storage format.
+
+Rather than pickling (and later replaying) the entire event list, the
+columnfile module saves the *state* of the workspace as a series of typed
+sections which are loaded in bulk:
+
+    META - the workspace metadata
+    MBYT - the raw bytes of one memory map (page aligned)
+    MMAP - the memory map table (referencing the MBYT sections)
+    LOCS - the location store columns
+    XREF - from/to/type/flags xref columns
+    NAME - va column and name list
+    FUNC - function va column, function metadata and code block columns
+    STAT - the remaining (small) workspace structures
+    EVNT - a pickled list of events (from incremental saves)
+
+Each section is a (tag, size) header followed by its payload, so the file
+is indexed by skipping from header to header without reading payloads.
+Memory map bytes are mmap'd from the file rather than read into memory.
+Incremental saves append EVNT sections which are replayed after the bulk
+sections are loaded.
+
+Select it like any other storage module:
+
+    vw.setMeta('StorageModule', 'vivisect.storage.columnfile')
+
+NOTE: the (pickled) bulk sections are kept so that exportWorkspace() may
+      build the events which recreate them.  This is only done when they
+      are asked for (by a workspace server, another storage module, etc)
+      and the pickled sections are dropped once they have been.
+'''
+import os
+import mmap
+import struct
+import collections
+import cPickle as pickle
+
+import vivisect
+import vivisect.locstore as viv_locstore
+from vivisect.const import *
+
+vivsig_columns = 'VIVCOLS'.ljust(8, '\x00')
+
+# MBYT payloads begin on a page boundary so they may be mmap'd
+MAP_ALIGN = 4096
+
+sechdr = struct.Struct('<4sQ')
+
+# The sections which hold the bulk loaded state
+state_tags = ('META', 'MMAP', 'LOCS', 'XREF', 'NAME', 'FUNC', 'STAT')
+
+# Workspace attributes which are saved (and restored) as they are
+stat_attrs = (
+    'segments',
+    'relocations',
+    'reloc_by_va',
+    'exports',
+    'exports_by_va',
+    'comments',
+    'filemeta',
+    'colormaps',
+    'vasetdefs',
+    'vasets',
+    'frefs',
+    'symhints',
+    'func_args',
+)
+
+class MappedBytes(mmap.mmap):
+    '''
+    A read-only mmap of memory map bytes which pickles as a string
+    (so events containing it may still be saved by other modules).
+    '''
+    def __reduce__(self):
+        return (str, (self[:],))
+
+class LoadedState:
+    '''
+    The bulk loaded sections of a workspace and its memory maps (which
+    may be mmap'd from the file).  Calling it builds the events which
+    recreate the sections ( see exportWorkspace() ) and drops the pickled
+    payloads.  The mmaps are closed by close() ( or once the workspace
+    is done with us ).
+    '''
+    def __init__(self, state, maps):
+        self.state = state
+        self.maps = maps
+
+    def __call__(self):
+        events = _stateEvents(self.state, self.maps)
+        self.state = None
+        return events
+
+    def close(self):
+        for va, perms, fname, mbytes in self.maps:
+            if isinstance(mbytes, MappedBytes):
+                mbytes.close()
+        self.maps = []
+
+    def __del__(self):
+        self.close()
+
+def packColumn(fmt, vals):
+    '''
+    Pack a list of values into a (fmt, bytes) column.  Values which
+    will not pack (None, out of range, etc) leave the column pickled.
+    '''
+    try:
+        return fmt, struct.pack('<%d%s' % (len(vals), fmt), *vals)
+    except struct.error:
+        return None, list(vals)
+
+def unpackColumn(col):
+    fmt, data = col
+    if fmt == None:
+        return data
+    return struct.unpack('<%d%s' % (len(data) / struct.calcsize(fmt), fmt), data)
+
+def _writeSection(fd, tag, payload):
+    fd.write(sechdr.pack(tag, len(payload)))
+    fd.write(payload)
+
+def _writeObject(fd, tag, obj):
+    _writeSection(fd, tag, pickle.dumps(obj, protocol=2))
+
+def _writeMapBytes(fd, mbytes):
+    # Pad (with a section of its own) so the MBYT payload is aligned
+    pad = -(fd.tell() + 2 * sechdr.size) % MAP_ALIGN
+    _writeSection(fd, 'PAD ', '\x00' * pad)
+
+    offset = fd.tell() + sechdr.size
+    _writeSection(fd, 'MBYT', mbytes)
+    return offset
+
+def _metaOrder(meta):
+    # Architecture (and then Platform) callbacks are used by the rest
+    return (meta[0] != 'Architecture', meta[0] != 'Platform')
+
+def _writeWorkspace(vw, fd):
+    fd.write(vivsig_columns)
+
+    metas = sorted(vw.metadata.items(), key=_metaOrder)
+    _writeObject(fd, 'META', metas)
+
+    maps = []
+    for va, size, perms, fname in vw.getMemoryMaps():
+        offset, mbytes = vw.getByteDef(va)
+        maps.append( (va, perms, fname, _writeMapBytes(fd, mbytes), len(mbytes)) )
+    _writeObject(fd, 'MMAP', maps)
+
+    _writeObject(fd, 'LOCS', vw.locstore.getColumns())
+
+    xrefs = vw.getXrefs()
+    _writeObject(fd, 'XREF', (
+        packColumn('Q', [ x[XR_FROM] for x in xrefs ]),
+        packColumn('Q', [ x[XR_TO] for x in xrefs ]),
+        packColumn('i', [ x[XR_RTYPE] for x in xrefs ]),
+        packColumn('q', [ x[XR_RFLAG] for x in xrefs ]),
+    ))
+
+    names = vw.name_by_va.items()
+    _writeObject(fd, 'NAME', (
+        packColumn('Q', [ va for va, name in names ]),
+        [ name for va, name in names ],
+    ))
+
+    funcs = vw.funcmeta.items()
+    cbs = vw.codeblocks
+    _writeObject(fd, 'FUNC', (
+        packColumn('Q', [ fva for fva, meta in funcs ]),
+        [ meta for fva, meta in funcs ],
+        packColumn('Q', [ cb[CB_VA] for cb in cbs ]),
+        packColumn('Q', [ cb[CB_SIZE] for cb in cbs ]),
+        packColumn('Q', [ cb[CB_FUNCVA] for cb in cbs ]),
+    ))
+
+    _writeObject(fd, 'STAT', [ (name, getattr(vw, name)) for name in stat_attrs ])
+
+def saveWorkspace(vw, filename):
+    # The current file may be mmap'd by this very workspace, so write
+    # a new one and rename it over the top rather than truncating.
+    tmpname = '%s.tmp' % filename
+    fd = file(tmpname, 'wb')
+    try:
+        _writeWorkspace(vw, fd)
+    finally:
+        fd.close()
+
+    if os.name == 'nt' and os.path.exists(filename):
+        os.remove(filename)
+    os.rename(tmpname, filename)
+
+def saveWorkspaceChanges(vw, filename):
+    if not os.path.exists(filename):
+        return saveWorkspace(vw, filename)
+
+    elist = vw.exportWorkspaceChanges()
+    if len(elist):
+        fd = file(filename, 'ab')
+        _writeObject(fd, 'EVNT', elist)
+        fd.close()
+
+def _indexSections(fd, filename):
+    '''
+    Return a list of (tag, offset, size) tuples for the sections in
+    the file (without reading their payloads).
+    '''
+    if fd.read(len(vivsig_columns)) != vivsig_columns:
+        raise vivisect.InvalidWorkspace(filename, 'not a columnfile workspace')
+
+    fd.seek(0, os.SEEK_END)
+    filesize = fd.tell()
+    fd.seek(len(vivsig_columns))
+
+    ret = []
+    while True:
+        hdr = fd.read(sechdr.size)
+        if not hdr:
+            break
+
+        if len(hdr) != sechdr.size:
+            raise vivisect.InvalidWorkspace(filename, 'truncated section header')
+
+        tag, size = sechdr.unpack(hdr)
+        offset = fd.tell()
+        if offset + size > filesize:
+            raise vivisect.InvalidWorkspace(filename, 'truncated %s section' % tag)
+
+        ret.append( (tag, offset, size) )
+        fd.seek(size, os.SEEK_CUR)
+
+    return ret
+
+def _readPayload(fd, offset, size):
+    fd.seek(offset)
+    return fd.read(size)
+
+def _readObject(fd, offset, size):
+    return pickle.loads(_readPayload(fd, offset, size))
+
+def _mapBytes(fd, offset, size):
+    if size == 0:
+        return ''
+
+    # Can't mmap on platforms with a larger allocation granularity
+    if offset % mmap.ALLOCATIONGRANULARITY:
+        fd.seek(offset)
+        return fd.read(size)
+
+    return MappedBytes(fd.fileno(), size, access=mmap.ACCESS_READ, offset=offset)
+
+def _loadSections(vw, fd, sections):
+    '''
+    Load the bulk sections into the workspace and return a (state, maps)
+    tuple of the pickled section payloads and the memory maps.
+    '''
+    secs = dict( (tag, (offset, size)) for tag, offset, size in sections )
+    state = dict( (tag, _readPayload(fd, *secs[tag])) for tag in state_tags )
+
+    for meta in pickle.loads(state['META']):
+        vw._handleSETMETA(meta)
+
+    maps = [ (va, perms, fname, _mapBytes(fd, offset, size))
+             for va, perms, fname, offset, size in pickle.loads(state['MMAP']) ]
+    for mmap in maps:
+        vw._handleADDMMAP(mmap)
+
+    vw.locstore.setColumns(pickle.loads(state['LOCS']))
+
+    # Import locations may be NoReturnApis (see _handleADDLOCATION)
+    noret = vw.getMeta('NoReturnApis', {})
+    for lva, lsize, ltype, linfo in vw.locstore.getLocations(LOC_IMPORT):
+        if noret.get(linfo.lower()):
+            vw.cfctx.addNoReturnAddr(lva)
+
+    xrfrom, xrto, xrtype, xrflags = [ unpackColumn(c) for c in pickle.loads(state['XREF']) ]
+    vw.xrefstore.addXrefs(zip(xrfrom, xrto, xrtype, xrflags))
+
+    vacol, names = pickle.loads(state['NAME'])
+    vas = unpackColumn(vacol)
+    vw.name_by_va.update( zip(vas, names) )
+    vw.va_by_name.update( zip(names, vas) )
+
+    fvacol, metas, cbvacol, cbsizecol, cbfvacol = pickle.loads(state['FUNC'])
+    fvas = unpackColumn(fvacol)
+    for fva in fvas:
+        vw._initFunction(fva)
+
+    for cb in zip(unpackColumn(cbvacol), unpackColumn(cbsizecol), unpackColumn(cbfvacol)):
+        vw._handleADDCODEBLOCK(cb)
+
+    # Function meta callbacks (CallsFrom) expect the code blocks
+    for fva, meta in zip(fvas, metas):
+        vw._handleADDFUNCTION( (fva, meta) )
+
+    for name, value in pickle.loads(state['STAT']):
+        setattr(vw, name, value)
+
+    return state, maps
+
+def _stateEvents(state, maps):
+    '''
+    Build the list of events which recreate the bulk loaded sections
+    (in the order they would be fired by analysis).
+    '''
+    events = [ (VWE_SETMETA, meta) for meta in pickle.loads(state['META']) ]
+    events.extend( (VWE_ADDMMAP, mmap) for mmap in maps )
+
+    stat = dict(pickle.loads(state['STAT']))
+    events.extend( (VWE_ADDSEGMENT, seg) for seg in stat['segments'] )
+
+    # Shadowed locations were added first (and then covered by others)
+    cols = pickle.loads(state['LOCS'])
+    locstore = viv_locstore.LocationStore()
+    locstore.setColumns(cols)
+
+    shadowed = collections.Counter(cols[4])
+    events.extend( (VWE_ADDLOCATION, loc) for loc in cols[4] )
+    for loc in locstore.getLocations():
+        if shadowed[loc]:
+            shadowed[loc] -= 1
+            continue
+        events.append( (VWE_ADDLOCATION, loc) )
+
+    xrefs = zip(*[ unpackColumn(c) for c in pickle.loads(state['XREF']) ])
+    events.extend( (VWE_ADDXREF, xref) for xref in xrefs )
+
+    # Exports make names, so the saved names must come after them
+    events.extend( (VWE_ADDEXPORT, exp) for exp in stat['exports'] )
+
+    vacol, names = pickle.loads(state['NAME'])
+    events.extend( (VWE_SETNAME, name) for name in zip(unpackColumn(vacol), names) )
+
+    events.extend( (VWE_ADDRELOC, reloc) for reloc in stat['relocations'] )
+
+    fvacol, metas, cbvacol, cbsizecol, cbfvacol = pickle.loads(state['FUNC'])
+    fvas = unpackColumn(fvacol)
+    events.extend( (VWE_ADDFUNCTION, (fva, {})) for fva in fvas )
+
+    cbs = zip(unpackColumn(cbvacol), unpackColumn(cbsizecol), unpackColumn(cbfvacol))
+    events.extend( (VWE_ADDCODEBLOCK, cb) for cb in cbs )
+
+    for fva, meta in zip(fvas, metas):
+        events.extend( (VWE_SETFUNCMETA, (fva, name, value)) for name, value in meta.items() )
+
+    events.extend( (VWE_SETFUNCARGS, fargs) for fargs in stat['func_args'].items() )
+    events.extend( (VWE_COMMENT, cmnt) for cmnt in stat['comments'].items() )
+
+    for fname, fmeta in stat['filemeta'].items():
+        events.append( (VWE_ADDFILE, (fname, fmeta.get('imagebase'), fmeta.get('md5sum'))) )
+        events.extend( (VWE_SETFILEMETA, (fname, key, value)) for key, value in fmeta.items()
+                       if key not in ('imagebase', 'md5sum') )
+
+    events.extend( (VWE_ADDCOLOR, color) for color in stat['colormaps'].items() )
+
+    for name, defs in stat['vasetdefs'].items():
+        events.append( (VWE_ADDVASET, (name, defs, stat['vasets'][name].values())) )
+
+    events.extend( (VWE_ADDFREF, (va, idx, val)) for (va, idx), val in stat['frefs'].items() )
+    events.extend( (VWE_SYMHINT, (va, idx, hint)) for (va, idx), hint in stat['symhints'].items() )
+    return events
+
+def loadWorkspace(vw, filename):
+    fd = file(filename, 'rb')
+    try:
+        sections = _indexSections(fd, filename)
+        mark = len(vw._event_list)
+        state, maps = _loadSections(vw, fd, sections)
+
+        # The events are only built if exportWorkspace() is called ( and
+        # the mmaps stay open for as long as the workspace is around )
+        loaded = LoadedState(state, maps)
+        vw._event_state = (mark, loaded)
+        vw._storage_states.append(loaded)
+
+        # Incremental changes are replayed as events
+        for tag, offset, size in sections:
+            if tag == 'EVNT':
+                vw.importWorkspace(_readObject(fd, offset, size))
+
+    except (KeyError, pickle.UnpicklingError), e:
+        raise vivisect.InvalidWorkspace(filename, 'invalid workspace file')
+
+    finally:
+        fd.close()
@@ -67,7 +67,7 @@ class SymbolikFunctionEmulator(vsym_emulator.SymbolikEmulator):
         '''
         self.stackbase = stackbase
         self.stacksize = stacksize
-        spsym = Const(stackbase, self.__width__)
+        spsym = symcons(Const, (stackbase, self.__width__), stackbase, self.__width__)
         self.setStackCounter(spsym)
 
     def setStackSize(self, stacksize):
@@ -165,7 +165,7 @@ class SymbolikFunctionEmulator(vsym_emulator.SymbolikEmulator):
         if args == None:
             # Initialize arguments by setting variables based on their arg indexes
             argc = len( self._sym_vw.getFunctionArgs(fva) )
-            args = [ Var('arg%d' % i, self.__width__) for i in xrange( argc ) ]
+            args = [ symcons(Var, ('arg%d' % i, self.__width__), 'arg%d' % i, self.__width__) for i in xrange( argc ) ]
 
         self.cconv.setSymbolikArgs(self, args)
 
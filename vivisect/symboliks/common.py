@@ -1,3 +1,5 @@
+import copy
+import weakref
 import hashlib
 import operator
 import functools
@@ -23,6 +25,35 @@ def symcache(f):
     functools.update_wrapper(docache, f)
     return docache
 
+# The hash-consed symbolik objects by (class, ...) structural key
+_sym_interned = weakref.WeakValueDictionary()
+
+def symcons(cls, key, *args):
+    '''
+    Return the shared symbolik object of class cls with the given
+    structural key (constructing it from args the first time).
+
+    Keys are made from kid _sym_id values (not the kids themselves), so
+    a lookup is O(1) for any depth of tree.  The update() methods use
+    this so identical subtrees from many code paths become one object
+    (which also shares its str/repr/etc cache).
+
+    Because a shared object never changes, its hash (of the solve()
+    answer) is computed once here (its kids are shared and already
+    solved, so this is O(1)) and its reduce() results are memoized.
+
+    NOTE: shared objects are never changed in place, walkTree() and
+          setSymKid() return a changed copy instead.
+    '''
+    key = (cls,) + key
+    sym = _sym_interned.get(key)
+    if sym == None:
+        sym = cls(*args)
+        sym._sym_key = key
+        sym._sym_hash = hash(sym.solve())
+        _sym_interned[key] = sym
+    return sym
+
 def varsolve(name,width,emu=None):
     '''
     A helper routine which unifies the way symboliks
@@ -78,6 +109,8 @@ class SymbolikBase:
 
     def __init__(self):
         self._sym_id       = self.idgen.next()
+        self._sym_key      = None
+        self._sym_hash     = None
         self.kids          = []
         self.parents       = []
         self.cache         = {}
@@ -146,16 +179,26 @@ class SymbolikBase:
         return o_pow(self, other, self.getWidth())
 
     def __hash__(self):
+        if self._sym_hash != None:
+            return self._sym_hash
         return hash(self.solve())
 
     def __eq__(self, other):
 
+        if other is self:
+            return True
+
         if other == None:
             return False
 
         if type(other) in (int, long):
             return self.solve() == other
 
+        # hash-consed objects know their hash, different means not equal
+        ohash = getattr(other, '_sym_hash', None)
+        if self._sym_hash != None and ohash != None and self._sym_hash != ohash:
+            return False
+
         return self.solve() == other.solve()
 
     def __ne__(self, other):
@@ -183,14 +226,22 @@ class SymbolikBase:
               cache under the assumption they could be iterated.
         '''
         # only use the cache if they're not specifying vars
-        if vals == None:
+        if vals != None:
+            return self._solve(emu=emu,vals=vals)
+
+        if emu == None:
             ret = self.cache.get('solve')
-            if ret != None:
-                return ret
+            if ret == None:
+                ret = self._solve()
+                self.cache['solve'] = ret
+            return ret
 
-        ret = self._solve(emu=emu,vals=vals)
-        if vals == None:
-            self.cache['solve'] = ret
+        # Solving with an emulator depends on the emulator ( and this
+        # object may be shared by many ) so remember which one
+        emuref, ret = self.cache.get('emusolve', (None, None))
+        if emuref == None or emuref() is not emu:
+            ret = self._solve(emu=emu)
+            self.cache['emusolve'] = (weakref.ref(emu), ret)
 
         return ret
 
@@ -207,6 +258,16 @@ class SymbolikBase:
         Example:
             symobj = symobj.reduce()
         '''
+        # A hash-consed object never changes, so remember its reduction
+        # ( which depends on the emulator, like solve() )
+        if self._sym_key != None:
+            emuref, rfoo, sym = self.cache.get('reduce', (None, None, None))
+            if sym != None and rfoo == foo:
+                if emuref == None and emu == None:
+                    return sym
+                if emuref != None and emuref() is emu:
+                    return sym
+
         def doreduce(path,oldkid,ctx):
             return oldkid._reduce(emu=emu)
         
@@ -220,6 +281,17 @@ class SymbolikBase:
                     break
                 symstr = s1str
 
+        if self._sym_key != None:
+            # the memoized answer is handed to every caller, so it must
+            # be copied rather than changed in place from now on
+            if sym._sym_key == None:
+                sym._sym_key = ('reduce',) + self._sym_key
+
+            emuref = None
+            if emu != None:
+                emuref = weakref.ref(emu)
+            self.cache['reduce'] = (emuref, foo, sym)
+
         return sym
 
     def _reduce(self, emu=None):
@@ -235,17 +307,48 @@ class SymbolikBase:
         '''
         raise Exception('%s *must* implement update(emu)!' % self.__class__.__name__)
 
-    def setSymKid(self, idx, kid):
+    def _copySym(self):
+        # Return an unshared copy of this object (with the same kids)
+        sym = copy.copy(self)
+        sym._sym_id = self.idgen.next()
+        sym._sym_key = None
+        sym._sym_hash = None
+        sym.kids = list(self.kids)
+        sym.parents = []
+        sym.cache = {}
+        for kid in sym.kids:
+            kid._addSymParent(sym)
+        return sym
+
+    def _addSymParent(self, parent):
+        # Hash-consed objects never change in place, so they need no
+        # back-links for cache invalidation ( and would otherwise keep
+        # every tree built over them from every path alive )
+        if self._sym_key == None:
+            self.parents.append(parent)
+
+    def setSymKid(self, idx, kid, shared=False):
         '''
+        Set the kid at idx and return the symbolik object with the new
+        kid.  Hash-consed (shared) objects ( or any object under one,
+        which callers indicate with shared=True ) are not changed, a copy
+        with the new kid is returned instead:
+
+            symobj = symobj.setSymKid(0, newkid)
         '''
+        if shared or self._sym_key != None:
+            if idx < len(self.kids) and self.kids[idx]._sym_id == kid._sym_id:
+                return self
+            return self._copySym().setSymKid(idx, kid)
+
         if idx > len(self.kids)-1:
             self.kids.append(kid)
-            self.kids[idx].parents.append(self) 
+            kid._addSymParent(self)
         else:
             # kid already exists
             oldkid = self.kids[idx]
             if oldkid._sym_id == kid._sym_id:
-                return
+                return self
 
             # invalidate the cache
             todo = list(oldkid.parents)
@@ -272,7 +375,9 @@ class SymbolikBase:
                         break
             # add new kid
             self.kids[idx] = kid
-            self.kids[idx].parents.append(self) 
+            kid._addSymParent(self)
+
+        return self
 
 
     @symcache
@@ -307,15 +412,24 @@ class SymbolikBase:
         '''
         return self._walkTreeImpl([],cb,ctx=ctx)
 
-    def _walkTreeImpl(self, path, cb, ctx=None):
+    def _walkTreeImpl(self, path, cb, ctx=None, shared=False):
         # the internal version of walk tree ( which is also the recursive one )
+        # ( everything under a hash-consed object is shared, so is copied
+        # rather than changed in place )
+        shared = shared or self._sym_key != None
+        copied = False
         path.append( self )
         # when kids[i] is a list of tupes then we need to call into it!
         for i in range(len(self.kids)):
             oldkid = self.kids[i]
-            newkid = oldkid._walkTreeImpl(path,cb,ctx=ctx)
+            newkid = oldkid._walkTreeImpl(path,cb,ctx=ctx,shared=shared)
             if newkid._sym_id != oldkid._sym_id:
-                self.setSymKid(i, newkid)
+                sym = self.setSymKid(i, newkid, shared=(shared and not copied))
+                if sym is not self:
+                    # we are now the (unshared) copy ( but our other
+                    # kids are still shared )
+                    self = path[-1] = sym
+                    copied = True
 
         newkid = cb(path,self,ctx)
         if newkid == None:
@@ -364,7 +478,7 @@ class cnot(SymbolikBase):
         v1 = self.kids[0].update(emu=emu)
         if isinstance(v1, Constraint):
             return v1.reverse()
-        return cnot(v1)
+        return symcons(cnot, (v1._sym_id,), v1)
 
     def _reduce(self, emu=None):
         # FIXME dependancy loop...
@@ -430,7 +544,8 @@ class Call(SymbolikBase):
     def update(self, emu):
         symfunc  = self.kids[0].update(emu)
         symargs  = [ x.update(emu) for x in self.kids[1:] ]
-        return Call(symfunc, self.width, symargs) 
+        key = (symfunc._sym_id, self.width) + tuple([ x._sym_id for x in symargs ])
+        return symcons(Call, key, symfunc, self.width, symargs)
 
     @symcache
     def isDiscrete(self, emu=None):
@@ -466,7 +581,7 @@ class Mem(SymbolikBase):
         if ret != None:
             return ret
 
-        return Mem(symaddr, symsize)
+        return symcons(Mem, (symaddr._sym_id, symsize._sym_id), symaddr, symsize)
 
     @symcache
     def isDiscrete(self, emu=None):
@@ -535,7 +650,7 @@ class Var(SymbolikBase):
         ret = emu.getSymVariable(self.name, create=False)
         if ret != None:
             return ret
-        return Var(self.name, width=self.width)
+        return symcons(Var, (self.name, self.width), self.name, self.width)
 
     def getWidth(self):
         return self.width
@@ -630,7 +745,7 @@ class Arg(SymbolikBase):
         return varsolve(name, self.width, emu=emu)
 
     def update(self, emu):
-        return Arg(self.idx, width=self.width)
+        return symcons(Arg, (self.idx, self.width), self.idx, self.width)
 
     def getWidth(self):
         return self.width
@@ -744,7 +859,7 @@ class Operator(SymbolikBase):
     def update(self, emu):
         v1 = self.kids[0].update(emu)
         v2 = self.kids[1].update(emu)
-        return self.__class__(v1, v2, self.width)
+        return symcons(self.__class__, (v1._sym_id, v2._sym_id, self.width), v1, v2, self.width)
 
     def _solve(self, emu=None, vals=None):
         v1 = self.kids[0].solve(emu=emu, vals=vals)
@@ -874,4 +989,4 @@ class o_sextend(SymbolikBase):
 
     def update(self, emu):
         kids = [ k.update(emu) for k in self.kids ]
-        return self.__class__(*kids)
+        return symcons(self.__class__, tuple([ k._sym_id for k in kids ]), *kids)
@@ -3,6 +3,14 @@ import unittest
 from vivisect.const import *
 from vivisect.symboliks.common import *
 from vivisect.symboliks.expression import symexp
+from vivisect.symboliks.emulator import SymbolikEmulator
+
+class MockVw(object):
+    def __init__(self, *args, **kwargs):
+        self.psize = 4
+
+    def getLocation(self, va):
+        return None
 
 class TestSymbolikCache(unittest.TestCase):
     '''
@@ -48,3 +56,111 @@ class TestSymbolikCache(unittest.TestCase):
         s.kids[0] = Var('x',4)
         self.assertEqual(s.solve(), solved2)
 
+    def test_symboliks_cache_hashcons(self):
+        s = symexp('(x + 20) * y')
+
+        emu1 = SymbolikEmulator(MockVw())
+        emu2 = SymbolikEmulator(MockVw())
+
+        # identical updated trees are the same object
+        s1 = s.update(emu1)
+        s2 = s.update(emu2)
+        self.assertIsNot(s1, s)
+        self.assertIs(s1, s2)
+        self.assertIs(s1.kids[0].kids[0], Var('x', 4).update(emu1))
+
+        emu1.setSymVariable('x', Const(3, 4))
+        s3 = s.update(emu1)
+        self.assertIsNot(s3, s1)
+        self.assertEqual(str(s3), '((3 + 20) * y)')
+        self.assertIs(s3.kids[1], s1.kids[1])
+
+        # changing a shared tree makes a copy
+        def swapx(path,sym,ctx):
+            if sym.symtype == SYMT_VAR and sym.name == 'x':
+                return Var('z',4)
+
+        s4 = s1.walkTree(swapx)
+        self.assertIsNot(s4, s1)
+        self.assertEqual(str(s4), '((z + 20) * y)')
+        self.assertEqual(str(s2), '((x + 20) * y)')
+        self.assertIs(s4.kids[1], s1.kids[1])
+        self.assertIs(s.update(emu2), s1)
+
+        s1.reduce()
+        self.assertEqual(str(s1), '((x + 20) * y)')
+
+    def test_symboliks_cache_hashcons_solve(self):
+        emu1 = SymbolikEmulator(MockVw())
+        emu2 = SymbolikEmulator(MockVw())
+
+        m = Mem(Const(0x41410000, 4), Const(4, 4))
+        m1 = m.update(emu1)
+        m2 = m.update(emu2)
+        self.assertIs(m1, m2)
+
+        # the solve cache for a shared object depends on the emulator
+        emu2.writeSymMemory(Const(0x41410000, 4), Const(0x41414141, 4))
+        val1 = m1.solve(emu=emu1)
+        self.assertNotEqual(val1, 0x41414141)
+        self.assertEqual(m2.solve(emu=emu2), 0x41414141)
+        self.assertEqual(m1.solve(emu=emu1), val1)
+
+    def test_symboliks_cache_hashcons_reduce(self):
+        emu = SymbolikEmulator(MockVw())
+
+        s1 = symexp('(x + 0) * 1').update(emu)
+        s2 = symexp('(y + 0) * 1').update(emu)
+
+        # shared objects know their hash up front
+        self.assertIsNotNone(s1._sym_hash)
+        self.assertEqual(hash(s1), hash(s1.solve()))
+        self.assertNotEqual(s1, s2)
+
+        # and only reduce once
+        r1 = s1.reduce()
+        self.assertEqual(str(r1), 'x')
+        self.assertIs(s1.reduce(), r1)
+        self.assertEqual(str(s1), '((x + 0) * 1)')
+
+        # the memoized reduction is never changed in place
+        def swapx(path,sym,ctx):
+            if sym.symtype == SYMT_VAR and sym.name == 'x':
+                return Var('z',4)
+
+        r2 = (r1 + Const(1, 4)).walkTree(swapx)
+        self.assertEqual(str(r2), '(z + 1)')
+        self.assertEqual(str(s1.reduce()), 'x')
+
+    def test_symboliks_cache_hashcons_parents(self):
+        import gc
+
+        emu = SymbolikEmulator(MockVw())
+        keep = Var('arg0', 4).update(emu)
+
+        def countSyms():
+            gc.collect()
+            return len([ o for o in gc.get_objects() if isinstance(o, SymbolikBase) ])
+
+        before = countSyms()
+
+        paths = []
+        for i in range(500):
+            pemu = SymbolikEmulator(MockVw())
+            s = (Var('arg0', 4) + Const(i, 4)) * Var('arg0', 4)
+            paths.append(s.update(pemu))
+
+        # shared objects don't hold on to the trees built over them
+        self.assertIs(paths[0].kids[1], keep)
+        self.assertEqual(keep.parents, [])
+
+        paths = None
+        s = None
+        self.assertEqual(countSyms(), before)
+
+        # and are never grown in place
+        c = Call(keep, 4).update(emu)
+        c2 = c.setSymKid(1, keep)
+        self.assertIsNot(c2, c)
+        self.assertEqual(len(c.kids), 1)
+        self.assertEqual(len(c2.kids), 2)
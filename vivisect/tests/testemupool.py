@@ -0,0 +1,52 @@
+import unittest
+
+import vivisect
+
+class EmulatorPoolTest(unittest.TestCase):
+
+    def getWorkspace(self):
+        vw = vivisect.VivWorkspace()
+        vw.setMeta('Architecture', 'i386')
+        # push 0x41; mov [0x41410100], eax; ret
+        code = '6a41' + 'a300014141' + 'c3'
+        vw.addMemoryMap(0x41410000, 7, 'woot', code.decode('hex') + '\x00' * 0x1000)
+        return vw
+
+    def getEmuState(self, emu):
+        return (emu.getRegisterSnap(),
+                emu.readMemory(0x41410100, 4),
+                emu.readMemory(emu.getStackCounter() - 0x10, 0x20),
+                sorted(emu.taints.items()),
+                emu.setVivTaint('woot', None),
+                emu.emumon, emu.funcva, emu.getUninitRegUse())
+
+    def test_emulator_pool(self):
+        vw = self.getWorkspace()
+        fresh = self.getEmuState(vw.getEmulator())
+
+        with vw.getPoolEmulator() as emu:
+            self.assertEqual(self.getEmuState(emu), fresh)
+            emu.runFunction(0x41410000, maxhit=1)
+            self.assertNotEqual(emu.readMemory(0x41410100, 4), '\x00' * 4)
+            emu.setEmuOpt('i386:reponce', False)
+
+        # The same emulator comes back reset
+        with vw.getPoolEmulator(logread=True) as emu2:
+            self.assertTrue(emu2 is emu)
+            self.assertTrue(emu2.logread)
+            self.assertTrue(emu2.getEmuOpt('i386:reponce'))
+            self.assertEqual(self.getEmuState(emu2), fresh)
+
+            # Nested use gets another emulator
+            with vw.getPoolEmulator() as emu3:
+                self.assertFalse(emu3 is emu2)
+
+    def test_emulator_pool_clear(self):
+        vw = self.getWorkspace()
+        with vw.getPoolEmulator() as emu:
+            # Changing workspace memory discards the pooled emulators
+            vw.addMemoryMap(0x42420000, 7, 'newmap', 'B' * 0x100)
+
+        with vw.getPoolEmulator() as emu2:
+            self.assertFalse(emu2 is emu)
+            self.assertEqual(emu2.readMemory(0x42420000, 4), 'BBBB')
@@ -1,6 +1,7 @@
 import unittest
 
 import vivisect.impapi as viv_impapi
+import vivisect.impapi.builddb as viv_impapi_builddb
 
 class ImpApiTest(unittest.TestCase):
 
@@ -20,3 +21,30 @@ class ImpApiTest(unittest.TestCase):
     def test_impapi_winkern(self):
         imp = viv_impapi.getImportApi('winkern','i386')
         self.assertEqual( imp.getImpApiCallConv('ntoskrnl.ObReferenceObjectByHandle'), 'stdcall')
+
+    def test_impapi_prebuilt(self):
+        # The prebuilt dbs must be rebuilt when an impapi module changes
+        # ( python -m vivisect.impapi.builddb )
+        for api, arch in viv_impapi_builddb.impapi_mods:
+            db = viv_impapi.getImpApiDb(api, arch)
+            self.assertTrue(db != None)
+            self.assertTrue(db is viv_impapi.getImpApiDb(api.upper(), arch))
+
+            mod = viv_impapi.getImpApiModule(api, arch)
+            self.assertEqual(dict(db.items()), mod.api)
+            self.assertEqual(db.apitypes, mod.apitypes)
+
+    def test_impapi_update(self):
+        imp = viv_impapi.getImportApi('windows','i386')
+        self.assertEqual( imp.getImpApiType('HEAP'), 'HANDLE')
+        self.assertEqual( imp.getImpApiArgNames('kernel32.woot'), None)
+        self.assertEqual( imp.getImpApiArgTypes('KERNEL32.CreateFileA'), ['int'] * 7 )
+
+        apidef = ('int', None, 'cdecl', 'kernel32.CreateFileA', (('void *', 'woot'),))
+        imp.updateApiDef({'kernel32.createfilea':apidef})
+        self.assertEqual( imp.getImpApi('kernel32.CreateFileA'), apidef )
+        self.assertEqual( imp.getImpApiArgNames('kernel32.CreateFileA'), ['woot'] )
+
+        # apis added later win ( like dict.update() )
+        imp.addImpApi('windows','i386')
+        self.assertEqual( imp.getImpApiCallConv('kernel32.CreateFileA'), 'stdcall' )
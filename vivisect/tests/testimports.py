@@ -0,0 +1,47 @@
+import os
+import sys
+import unittest
+import subprocess
+
+import vstruct
+import vivisect
+import vivisect.impemu.lookup as viv_imp_lookup
+import vivisect.impemu.platarch.windows as v_i_windows
+
+basedir = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+modscode = '''
+import sys
+import %s
+print('\\n'.join([ n for n, m in sys.modules.items() if m != None ]))
+'''
+
+class ImportTest(unittest.TestCase):
+
+    def getImportedModules(self, modname):
+        env = dict(os.environ)
+        env['PYTHONPATH'] = basedir
+        output = subprocess.check_output([sys.executable, '-c', modscode % modname], env=env)
+        return output.split()
+
+    def test_import_vivisect_lazy(self):
+        mods = self.getImportedModules('vivisect')
+        for modname in mods:
+            self.assertFalse(modname.split('.')[0] in ('vdb', 'vtrace', 'cobra', 'pycparser'), modname)
+            self.assertFalse(modname.startswith('envi.archs.'), modname)
+            self.assertFalse(modname.startswith('vstruct.defs'), modname)
+            self.assertFalse(modname == 'vstruct.cparse', modname)
+
+    def test_import_lazy_apis(self):
+        eclass = viv_imp_lookup.getWorkspaceEmulator('i386', plat='windows')
+        self.assertTrue(eclass is v_i_windows.Windowsi386Emulator)
+        eclass = viv_imp_lookup.getWorkspaceEmulator('i386', plat='linux')
+        self.assertEqual(eclass.__name__, 'i386WorkspaceEmulator')
+        self.assertEqual(viv_imp_lookup.getWorkspaceEmulator('woot'), None)
+
+        self.assertEqual(vstruct.getStructure('win32.CLIENT_ID').vsGetTypeName(), 'CLIENT_ID')
+        self.assertTrue('win32' in vstruct.getModuleNames())
+
+        vw = vivisect.VivWorkspace()
+        vw.setUserStructSource('struct woot { int x; int y; };')
+        self.assertEqual(len(vw.vsbuilder.buildVStruct('woot')), 8)
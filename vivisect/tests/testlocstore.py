@@ -0,0 +1,83 @@
+import unittest
+
+import vivisect
+import vivisect.locstore as viv_locstore
+
+from vivisect.const import *
+
+class LocationStoreTest(unittest.TestCase):
+
+    def test_locstore_lookups(self):
+        ls = viv_locstore.LocationStore()
+        ls.addLocation((0x41410000, 4, LOC_POINTER, None))
+        ls.addLocation((0x41410004, 5, LOC_OP, 0))
+        ls.addLocation((0x4141fff0, 0x20, LOC_STRING, None))
+        ls.addLocation((0x41420100, 4, LOC_IMPORT, 'kernel32.CreateFileA'))
+
+        self.assertEqual(len(ls), 4)
+        self.assertIsNone(ls.getLocation(None))
+        self.assertIsNone(ls.getLocation(0x4140ffff))
+        self.assertEqual(ls.getLocation(0x41410003), (0x41410000, 4, LOC_POINTER, None))
+        self.assertEqual(ls.getLocation(0x41410008), (0x41410004, 5, LOC_OP, 0))
+        self.assertIsNone(ls.getLocation(0x41410009))
+
+        # a location which spans into the next bucket
+        self.assertEqual(ls.getLocation(0x4142000f), (0x4141fff0, 0x20, LOC_STRING, None))
+        self.assertIsNone(ls.getLocation(0x41420010))
+
+        self.assertEqual(ls.getLocations(LOC_IMPORT), [(0x41420100, 4, LOC_IMPORT, 'kernel32.CreateFileA')])
+        self.assertEqual(ls.getLocations(LOC_IMPORT, linfo='woot'), [])
+        self.assertEqual([ l[0] for l in ls.getLocations() ], [0x41410000, 0x41410004, 0x4141fff0, 0x41420100])
+
+        rlocs = ls.getLocationsInRange(0x41410002, 0x20000)
+        self.assertEqual([ l[0] for l in rlocs ], [0x41410000, 0x41410004, 0x4141fff0, 0x41420100])
+
+        self.assertEqual(ls.getPrevLocation(0x41420100)[0], 0x4141fff0)
+        self.assertIsNone(ls.getPrevLocation(0x41410000))
+
+        self.assertEqual(ls.findLocation(0x41410002, 0x10), (0x41410002, (0x41410000, 4, LOC_POINTER, None)))
+        self.assertEqual(ls.findLocation(0x41410009, 0x20000), (0x4141fff0, (0x4141fff0, 0x20, LOC_STRING, None)))
+        self.assertEqual(ls.findLocation(0x41420010, 0x100000)[0], 0x41420100)
+        self.assertIsNone(ls.findLocation(0x41420010, 0xf0))
+        self.assertIsNone(ls.findLocation(0x41410000, 0))
+
+        ls.delLocation((0x4141fff0, 0x20, LOC_STRING, None))
+        self.assertIsNone(ls.getLocation(0x4142000f))
+        self.assertEqual(len(ls), 3)
+
+    def test_locstore_overlap(self):
+        ls = viv_locstore.LocationStore()
+        old = (0x1000, 0x10, LOC_STRING, None)
+        new = (0x1004, 4, LOC_POINTER, None)
+        ls.addLocation(old)
+        ls.addLocation(new)
+
+        # The old location still owns the bytes around the new one
+        self.assertEqual(ls.getLocation(0x1003), old)
+        self.assertEqual(ls.getLocation(0x1005), new)
+        self.assertEqual(ls.getLocation(0x100f), old)
+        self.assertEqual(ls.getLocations(), [old, new])
+        self.assertEqual(ls.getLocations(LOC_STRING), [old])
+
+        # Deleting clears all the bytes in the range
+        ls.delLocation(old)
+        self.assertIsNone(ls.getLocation(0x1003))
+        self.assertIsNone(ls.getLocation(0x1005))
+        self.assertEqual(ls.getLocations(), [new])
+
+    def test_locstore_workspace_range(self):
+        vw = vivisect.VivWorkspace()
+        vw.setMeta('Architecture', 'i386')
+        vw.addMemoryMap(0x1000, 7, 'woot', 'A' * 0x20)
+
+        # a location split into fragments is only in the range once
+        old = (0x1000, 0x10, LOC_STRING, None)
+        new = (0x1004, 4, LOC_POINTER, None)
+        vw.locstore.addLocation(old)
+        vw.locstore.addLocation(new)
+
+        self.assertEqual(vw.getLocationRange(0x1000, 0x20), [
+            old,
+            new,
+            (0x1010, 0x10, LOC_UNDEF, None),
+        ])
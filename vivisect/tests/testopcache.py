@@ -0,0 +1,39 @@
+import unittest
+
+import vivisect
+
+class OpcodeCacheTest(unittest.TestCase):
+
+    def getWorkspace(self):
+        vw = vivisect.VivWorkspace()
+        vw.setMeta('Architecture', 'i386')
+        # inc eax; inc eax; ret
+        vw.addMemoryMap(0x41410000, 7, 'woot', '\x40\x40\xc3' + '\x90' * 0x100)
+        return vw
+
+    def test_viv_opcode_cache(self):
+        vw = self.getWorkspace()
+        opcache = vw.getOpcodeCache()
+
+        op = vw.parseOpcode(0x41410000)
+        self.assertEqual(op.mnem, 'inc')
+        self.assertTrue(vw.parseOpcode(0x41410000) is op)
+        self.assertEqual(opcache.getStats()['hits'], 1)
+        self.assertEqual(opcache.getStats()['misses'], 1)
+
+        # emulators share the workspace decoded opcodes
+        emu = vw.getEmulator()
+        self.assertTrue(emu.parseOpcode(0x41410000) is op)
+        self.assertTrue(vw.parseOpcode(0x41410001) is emu.parseOpcode(0x41410001))
+
+        # writes invalidate the cache ( but not the emulator's bytes )
+        vw.writeMemory(0x41410000, '\x48')
+        self.assertEqual(len(opcache), 0)
+        self.assertEqual(vw.parseOpcode(0x41410000).mnem, 'dec')
+        self.assertEqual(vw.getEmulator().parseOpcode(0x41410000).mnem, 'dec')
+        self.assertTrue(emu.parseOpcode(0x41410000) is op)
+
+        # as do new memory maps
+        vw.addMemoryMap(0x42420000, 7, 'newmap', '\x90' * 0x100)
+        self.assertEqual(len(opcache), 0)
+        self.assertEqual(vw.parseOpcode(0x42420000).mnem, 'nop')
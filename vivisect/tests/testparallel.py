@@ -0,0 +1,81 @@
+import os
+import unittest
+
+import vivisect
+import vivisect.parallel as viv_parallel
+
+from vivisect.const import *
+
+def computeVa(vw, va):
+    # Depends on the locations around va and fires an event
+    loc = vw.getLocation(va - 1)
+    if va % 3 == 0:
+        vw.makeName(va, 'three_%.8x' % va)
+    return loc
+
+def skipVa(vw, va):
+    return vw.getLocation(va) != None
+
+class ParallelTest(unittest.TestCase):
+
+    def getWorkspace(self):
+        vw = vivisect.VivWorkspace()
+        vw.setMeta('Architecture', 'i386')
+        vw.addMemoryMap(0x41410000, 7, 'woot', 'A' * 0x1000)
+        return vw
+
+    def runMap(self, workers):
+        vw = self.getWorkspace()
+        vas = range(0x41410000, 0x41410100, 5)
+
+        ret = []
+        for va, loc in viv_parallel.parallelMap(vw, vas, computeVa, skip=skipVa, workers=workers):
+            ret.append( (va, loc) )
+            # Make locations which later items will depend on
+            if va % 2 == 0:
+                vw.makeNumber(va, 4)
+
+        return ret, vw.getLocations(), vw.getNames()
+
+    def test_parallel_map(self):
+        if not hasattr(os, 'fork'):
+            raise unittest.SkipTest('no os.fork()')
+
+        serial = self.runMap(0)
+        self.assertEqual(serial, self.runMap(3))
+        self.assertEqual(serial, self.runMap(8))
+
+    def test_parallel_readset(self):
+        reads = viv_parallel.ReadSet()
+        reads.locvas.add(0x41410010)
+        reads.keys.add( ('funcmeta', 0x41410000) )
+
+        self.assertFalse(reads.conflicts([ ('loc', 0x41410000, 0x10) ]))
+        self.assertTrue(reads.conflicts([ ('loc', 0x41410000, 0x11) ]))
+        self.assertTrue(reads.conflicts([ ('funcmeta', 0x41410000) ]))
+        self.assertFalse(reads.conflicts([ ('funcmeta', 0x41410004) ]))
+        self.assertTrue(reads.conflicts([ ('funcmeta', viv_parallel.ANYKEY) ]))
+        self.assertTrue(reads.conflicts([ None ]))
+
+    def test_parallel_tracker(self):
+        vw = self.getWorkspace()
+        tracker = viv_parallel.ReadTracker(vw)
+
+        # function args, dead data and codeflow state are tracked
+        reads = tracker.reads = viv_parallel.ReadSet()
+        vw.func_args.get(0x41410000)
+        args = (0x41410000, [ ('int', 'arg0') ])
+        self.assertTrue(reads.conflicts(viv_parallel.getEventWrites(VWE_SETFUNCARGS, args)))
+        args = (0x41410004, [ ('int', 'arg0') ])
+        self.assertFalse(reads.conflicts(viv_parallel.getEventWrites(VWE_SETFUNCARGS, args)))
+
+        reads = tracker.reads = viv_parallel.ReadSet()
+        vw.isDeadData(0x41410000)
+        dead = ('deaddata:0x41410000', (0x41410000, 0x41410010))
+        self.assertTrue(reads.conflicts(viv_parallel.getEventWrites(VWE_SETMETA, dead)))
+        self.assertFalse(reads.conflicts(viv_parallel.getEventWrites(VWE_SETMETA, ('woot', 1))))
+
+        reads = tracker.reads = viv_parallel.ReadSet()
+        vw.cfctx.getCallsFrom(0x41410000)
+        self.assertTrue(reads.conflicts(viv_parallel.getEventWrites(VWE_ADDFUNCTION, (0x41410010, {}))))
+        self.assertFalse(reads.conflicts(viv_parallel.getEventWrites(VWE_COMMENT, (0x41410010, 'woot'))))
@@ -31,3 +31,19 @@ class PETests(unittest.TestCase):
         self.assertEquals(len(export_list), 2, "expecting 2 exported functions")
         self.assertEquals(export_list[0][1], 45, "exported function with ordinal 45 not found")
         self.assertEquals(export_list[1][1], 55, "exported function with ordinal 55 not found")
+
+    def test_mapped_pe(self):
+        file_path = helpers.getTestPath('windows', 'i386', 'export_by_name.dll')
+        pe = PE.peFromFileName(file_path)
+        mpe = PE.peFromFileName(file_path, mapped=True)
+        self.assertIsNotNone(mpe.mmap)
+        self.assertEquals(mpe.getExports(), pe.getExports())
+        self.assertEquals(mpe.getImports(), pe.getImports())
+        self.assertEquals(mpe.getRelocations(), pe.getRelocations())
+        self.assertEquals([s.tree() for s in mpe.getSections()], [s.tree() for s in pe.getSections()])
+        self.assertEquals(mpe.getDllName(), pe.getDllName())
+
+        # short reads past the end of the file behave as before
+        self.assertIsNone(mpe.readAtOffset(mpe.filesize - 2, 4))
+        self.assertEquals(mpe.readAtOffset(mpe.filesize - 2, 4, shortok=True), pe.readAtOffset(pe.filesize - 2, 4, shortok=True))
+        self.assertEquals(str(mpe.readBufferAtOffset(0, 2)), 'MZ')
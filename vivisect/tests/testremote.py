@@ -0,0 +1,108 @@
+import zlib
+import time
+import shutil
+import tempfile
+import unittest
+import cPickle as pickle
+
+import vivisect
+import vivisect.remote.server as viv_server
+
+class VivServerTest(unittest.TestCase):
+
+    def getServer(self):
+        vw = vivisect.VivWorkspace()
+        vw.setMeta('Architecture', 'i386')
+        vw.addMemoryMap(0x41410000, 7, 'woot', 'A' * 0x1000)
+        vw.makeName(0x41410000, 'woot')
+
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+
+        server = viv_server.VivServer(dirname=tmpdir)
+        server.addNewWorkspace('woot.viv', vw.exportWorkspace())
+        return server
+
+    def waitForName(self, vw, va):
+        for i in xrange(100):
+            if vw.getName(va) != None:
+                return vw.getName(va)
+            time.sleep(0.05)
+
+    def test_remote_server_sync(self):
+        server = self.getServer()
+
+        batches = []
+        fireEvents = server._fireEvents
+        def countEvents(wsname, events, skip=None):
+            batches.append(len(events))
+            return fireEvents(wsname, events, skip=skip)
+        server._fireEvents = countEvents
+
+        vw1 = viv_server.getServerWorkspace(server, 'woot.viv')
+        vw2 = viv_server.getServerWorkspace(server, 'woot.viv')
+        self.assertEqual(vw1.getName(0x41410000), 'woot')
+        self.assertEqual(vw1.getMemoryMaps(), vw2.getMemoryMaps())
+
+        for i in xrange(20):
+            vw1.makeName(0x41410010 + i, 'name_%d' % i)
+
+        self.assertEqual(self.waitForName(vw2, 0x41410010 + 19), 'name_19')
+        self.assertEqual(sum(batches), 20)
+        self.assertTrue(len(batches) < 20)
+
+        # new clients get the snapshot plus the events fired since
+        snap = server.wsdict['woot.viv'][5]
+        vw3 = viv_server.getServerWorkspace(server, 'woot.viv')
+        self.assertTrue(server.wsdict['woot.viv'][5] is snap)
+
+        # the snapshot is msgpack ( clients never unpickle server data )
+        events = viv_server.unpackSnapshot(snap[1])
+        self.assertEqual(len(events), snap[0])
+        self.assertRaises(Exception, pickle.loads, zlib.decompress(snap[1]))
+        self.assertEqual(self.waitForName(vw3, 0x41410010 + 19), 'name_19')
+        self.assertEqual(vw3.getName(0x41410000), 'woot')
+
+    def test_remote_server_flush(self):
+        server = self.getServer()
+        wsinfo = server.wsdict['woot.viv']
+
+        # never flush on the timer...
+        self.addCleanup(setattr, viv_server, 'batch_wait', viv_server.batch_wait)
+        viv_server.batch_wait = 3600
+
+        vw1 = viv_server.getServerWorkspace(server, 'woot.viv')
+        vw1.makeName(0x41410010, 'saved')
+        vw1.makeName(0x41410011, 'closed')
+        self.assertEqual(len(wsinfo[2]), 0)
+
+        # saving from a client flushes to the server
+        vw1.saveWorkspace()
+        self.assertEqual(len(wsinfo[2]), 2)
+
+        # and the file is appended to without the workspace lock
+        lock = wsinfo[0]
+        appendFile = viv_server.viv_basicfile.vivEventsAppendFile
+        def checkLock(path, events):
+            self.assertTrue(lock.acquire(False))
+            lock.release()
+            return appendFile(path, events)
+        viv_server.viv_basicfile.vivEventsAppendFile = checkLock
+        self.addCleanup(setattr, viv_server.viv_basicfile, 'vivEventsAppendFile', appendFile)
+
+        server._saveWorkspaces()
+        self.assertEqual(len(wsinfo[2]), 0)
+
+        # exiting flushes any client events still waiting
+        vw1.makeName(0x41410012, 'exited')
+        viv_server._flushLiveClients()
+        self.assertEqual(len(wsinfo[2]), 1)
+        self.assertTrue(vw1.server.closed)
+
+        # which also closes the event channel and its thread
+        self.assertFalse(vw1.server.chan in server.chandict)
+        self.assertFalse(vw1.server.ethread.isAlive())
+
+        # and once closed, events are sent as they are fired
+        vw1.makeName(0x41410013, 'later')
+        self.assertEqual(len(wsinfo[2]), 2)
@@ -0,0 +1,143 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import vivisect
+import vivisect.tests.samplecode as samplecode
+
+from vivisect.const import *
+
+class StorageTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def getSampleWorkspace(self):
+        vw = vivisect.VivWorkspace()
+        vw.setMeta('Architecture','i386')
+        vw.setMeta('Format','blob')
+        vw.addMemoryMap(0x41410000, 0xff, 'none', samplecode.func1)
+        vw.makeFunction(0x41410000)
+        vw.makeName(0x41410000, 'func1')
+        vw.setComment(0x41410000, 'woot')
+        vw.setVaSetRow('Bookmarks', (0x41410000, 'func1'))
+        return vw
+
+    def assertSameWorkspace(self, vw1, vw2):
+        self.assertEqual(vw1.getMemoryMaps(), vw2.getMemoryMaps())
+        for va, size, perms, fname in vw1.getMemoryMaps():
+            self.assertEqual(vw1.readMemory(va, size), vw2.readMemory(va, size))
+
+        self.assertEqual(vw1.getLocations(), vw2.getLocations())
+        self.assertEqual(sorted(vw1.getXrefs()), sorted(vw2.getXrefs()))
+        self.assertEqual(sorted(vw1.getNames()), sorted(vw2.getNames()))
+        self.assertEqual(sorted(vw1.getFunctions()), sorted(vw2.getFunctions()))
+        self.assertEqual(sorted(vw1.getCodeBlocks()), sorted(vw2.getCodeBlocks()))
+        self.assertEqual(vw1.getComments(), vw2.getComments())
+        self.assertEqual(vw1.getVaSetRows('Bookmarks'), vw2.getVaSetRows('Bookmarks'))
+        for fva in vw1.getFunctions():
+            self.assertEqual(vw1.getFunctionMetaDict(fva), vw2.getFunctionMetaDict(fva))
+
+    def test_storage_columnfile(self):
+        wspath = os.path.join(self.tmpdir, 'func1.viv')
+
+        vw = self.getSampleWorkspace()
+        vw.setMeta('StorageModule', 'vivisect.storage.columnfile')
+        vw.setMeta('StorageName', wspath)
+        vw.saveWorkspace()
+
+        vw2 = vivisect.VivWorkspace()
+        vw2.setMeta('StorageModule', 'vivisect.storage.columnfile')
+        vw2.loadWorkspace(wspath)
+        self.assertSameWorkspace(vw, vw2)
+        self.assertEqual(vw2.getName(0x41410000), 'func1')
+        self.assertEqual(vw2.getLocation(0x41410002), vw.getLocation(0x41410002))
+
+        # incremental saves are appended and replayed on load
+        vw2.makeName(0x41410003, 'woot')
+        vw2.saveWorkspace(fullsave=False)
+
+        vw3 = vivisect.VivWorkspace()
+        vw3.setMeta('StorageModule', 'vivisect.storage.columnfile')
+        vw3.loadWorkspace(wspath)
+        self.assertSameWorkspace(vw2, vw3)
+        self.assertEqual(vw3.getName(0x41410003), 'woot')
+
+        # a full save over the (mmap'd) file it was loaded from
+        vw3.saveWorkspace()
+        vw4 = vivisect.VivWorkspace()
+        vw4.setMeta('StorageModule', 'vivisect.storage.columnfile')
+        vw4.loadWorkspace(wspath)
+        self.assertSameWorkspace(vw3, vw4)
+
+    def test_storage_columnfile_invalid(self):
+        wspath = os.path.join(self.tmpdir, 'func1.viv')
+
+        vw = self.getSampleWorkspace()
+        vw.setMeta('StorageName', wspath)
+        vw.saveWorkspace()
+
+        vw2 = vivisect.VivWorkspace()
+        vw2.setMeta('StorageModule', 'vivisect.storage.columnfile')
+        self.assertRaises(vivisect.InvalidWorkspace, vw2.loadWorkspace, wspath)
+
+    def test_storage_columnfile_export(self):
+        wspath = os.path.join(self.tmpdir, 'func1.viv')
+
+        vw = self.getSampleWorkspace()
+        vw.setMeta('StorageModule', 'vivisect.storage.columnfile')
+        vw.setMeta('StorageName', wspath)
+        vw.saveWorkspace()
+
+        vw2 = vivisect.VivWorkspace()
+        vw2.setMeta('StorageModule', 'vivisect.storage.columnfile')
+        vw2.loadWorkspace(wspath)
+        vw2.makeName(0x41410003, 'woot')
+
+        # the export has the bulk loaded state *and* the later events
+        vw3 = vivisect.VivWorkspace()
+        vw3.importWorkspace(vw2.exportWorkspace())
+        self.assertSameWorkspace(vw2, vw3)
+        self.assertEqual(vw3.getName(0x41410000), 'func1')
+        self.assertEqual(vw3.getName(0x41410003), 'woot')
+        self.assertEqual(vw3.getMeta('Architecture'), 'i386')
+
+        # so a full save through another module is complete
+        bpath = os.path.join(self.tmpdir, 'func1.basic.viv')
+        vw2.setMeta('StorageModule', 'vivisect.storage.basicfile')
+        vw2.setMeta('StorageName', bpath)
+        vw2.saveWorkspace()
+
+        vw4 = vivisect.VivWorkspace()
+        vw4.loadWorkspace(bpath)
+        self.assertSameWorkspace(vw2, vw4)
+
+    def test_storage_columnfile_close(self):
+        wspath = os.path.join(self.tmpdir, 'func1.viv')
+
+        vw = self.getSampleWorkspace()
+        vw.setMeta('StorageModule', 'vivisect.storage.columnfile')
+        vw.setMeta('StorageName', wspath)
+        vw.saveWorkspace()
+
+        vw2 = vivisect.VivWorkspace()
+        vw2.setMeta('StorageModule', 'vivisect.storage.columnfile')
+        vw2.loadWorkspace(wspath)
+
+        loaded, = vw2._storage_states
+        self.assertIsNotNone(loaded.state)
+
+        # the pickled sections are dropped once the events are built
+        events = vw2.exportWorkspace()
+        self.assertIsNone(loaded.state)
+        self.assertEqual(vw2.exportWorkspace(), events)
+
+        mbytes = loaded.maps[0][3]
+        self.assertEqual(mbytes[:4], samplecode.func1[:4])
+        loaded.close()
+        self.assertEqual(loaded.maps, [])
+        self.assertRaises(ValueError, mbytes.__getitem__, 0)
@@ -107,6 +107,23 @@ class VivisectTest(unittest.TestCase):
         self.assertEqual( vw.castPointer(0x22220000), 0x41424344 )
         self.assertEqual( vw.parseNumber(0x22220000, 2), 0x4142 )
 
+    def test_viv_findpointers(self):
+        vw = vivisect.VivWorkspace()
+        vw.setMeta('Architecture', 'i386')
+        vw.setMeta('Format', 'blob')
+
+        mbytes = 'A\x04\x00\x41\x41' + 'woot\x00\x00' + '\x10\x00\x41\x41' + '\x00\x00\x41\x41' + 'B' * 16
+        vw.addMemoryMap(0x41410000, 7, 'woot', mbytes)
+
+        # unaligned pointers are found, and a location hides the ones it covers
+        vw.makeNumber(0x4141000f, 4)
+        self.assertEqual(vw.findPointers(cache=False), [ (0x41410001, 0x41410004), (0x4141000b, 0x41410010) ])
+
+        self.assertEqual(vw.detectString(0x41410005), 4)
+        self.assertEqual(vw.detectString(0x41410006), -1)
+        vw.makeNumber(0x41410007, 1)
+        self.assertEqual(vw.detectString(0x41410005), -1)
+
     #def test_impapi_windows(self):
         #imp = viv_impapi.getImportApi('windows','i386')
         #self.assertEqual( imp.getImpApiCallConv('ntdll.RtlAllocateHeap'), 'stdcall')
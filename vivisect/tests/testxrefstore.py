@@ -0,0 +1,91 @@
+import random
+import unittest
+
+import vivisect
+import vivisect.parallel as viv_parallel
+import vivisect.xrefstore as viv_xrefstore
+
+from vivisect.const import *
+
+class XrefStoreTest(unittest.TestCase):
+
+    def test_xrefstore_lookups(self):
+        xs = viv_xrefstore.XrefStore()
+        x1 = (0x41410000, 0x41420000, REF_CODE, 0)
+        x2 = (0x41410004, 0x41420000, REF_PTR, 0)
+        x3 = (0x4141fff0, 0x41430010, REF_DATA, 4)
+        x4 = (0x41420100, 0x41410000, REF_CODE, 0)
+
+        for x in (x1, x2, x3, x4):
+            self.assertTrue(xs.addXref(x))
+        self.assertFalse(xs.addXref(x2))
+
+        self.assertEqual(len(xs), 4)
+        self.assertTrue(xs.hasXref(x3))
+        self.assertEqual(xs.getXrefs(), [x1, x2, x3, x4])
+        self.assertEqual(xs.getXrefs(REF_CODE), [x1, x4])
+        self.assertEqual(xs.getXrefsTo(0x41420000), [x1, x2])
+        self.assertEqual(xs.getXrefsTo(0x41420000, rtype=REF_PTR), [x2])
+        self.assertEqual(xs.getXrefsFrom(0x41410004), [x2])
+        self.assertEqual(xs.getXrefsFrom(0x41410008), [])
+
+        # range queries (across buckets)
+        self.assertEqual(xs.getXrefsFromRange(0x41410000, 0x10101), [x1, x2, x3, x4])
+        self.assertEqual(xs.getXrefsFromRange(0x41410001, 0x10000), [x2, x3])
+        self.assertEqual(xs.getXrefsFromRange(0x41410000, 0x20000, rtype=REF_CODE), [x1, x4])
+        self.assertEqual(xs.getXrefsToRange(0x41420000, 0x20000), [x1, x2, x3])
+        self.assertEqual(xs.getXrefsToRange(0x41400000, 0x10000), [])
+
+        xs.delXref(x2)
+        self.assertFalse(xs.hasXref(x2))
+        self.assertRaises(KeyError, xs.delXref, x2)
+        self.assertEqual(xs.getXrefs(), [x1, x3, x4])
+        self.assertEqual(xs.getXrefs(REF_PTR), [])
+        self.assertEqual(xs.getXrefsTo(0x41420000), [x1])
+        self.assertEqual(xs.getXrefsFromRange(0x41410004, 4), [])
+
+        # re-added xrefs are last in add order
+        xs.delXref(x1)
+        xs.addXref(x1)
+        self.assertEqual(xs.getXrefs(), [x3, x4, x1])
+        self.assertEqual(xs.getXrefs(REF_CODE), [x4, x1])
+
+    def test_xrefstore_random(self):
+        xs = viv_xrefstore.XrefStore()
+        xrefs = set()
+        rand = random.Random(0x41)
+        for i in xrange(3000):
+            x = (rand.randint(0, 0x80000), rand.randint(0, 0x80000), rand.randint(1, 3), 0)
+            if x in xrefs and rand.randint(0, 1):
+                xrefs.remove(x)
+                xs.delXref(x)
+            else:
+                xrefs.add(x)
+                xs.addXref(x)
+
+        self.assertEqual(sorted(xs.getXrefs()), sorted(xrefs))
+        for i in xrange(100):
+            va = rand.randint(0, 0x80000)
+            size = rand.randint(0, 0x20000)
+            self.assertEqual(sorted(xs.getXrefsFromRange(va, size)), sorted([ x for x in xrefs if va <= x[0] < va + size ]))
+            self.assertEqual(sorted(xs.getXrefsToRange(va, size, rtype=REF_PTR)),
+                             sorted([ x for x in xrefs if va <= x[1] < va + size and x[2] == REF_PTR ]))
+
+    def test_xrefstore_workspace(self):
+        vw = vivisect.VivWorkspace()
+        vw.addXref(0x41410000, 0x41420000, REF_CODE)
+        vw.addXref(0x41410000, 0x41420000, REF_CODE)
+        self.assertEqual(vw.getXrefs(), [(0x41410000, 0x41420000, REF_CODE, 0)])
+        self.assertEqual(vw.getXrefsToRange(0x41420000, 1), [(0x41410000, 0x41420000, REF_CODE, 0)])
+
+        vw.delXref((0x41410000, 0x41420000, REF_CODE, 0))
+        self.assertEqual(vw.getXrefs(), [])
+        self.assertRaises(Exception, vw.delXref, (0x41410000, 0x41420000, REF_CODE, 0))
+
+    def test_xrefstore_readset(self):
+        reads = viv_parallel.ReadSet()
+        reads.keyranges.append( ('xrefs_by_from', 0x41410000, 0x10) )
+        self.assertTrue(reads.conflicts([ ('xrefs_by_from', 0x4141000f) ]))
+        self.assertFalse(reads.conflicts([ ('xrefs_by_from', 0x41410010) ]))
+        self.assertFalse(reads.conflicts([ ('xrefs_by_to', 0x41410000) ]))
+        self.assertTrue(reads.conflicts([ ('xrefs_by_from', viv_parallel.ANYKEY) ]))
@@ -0,0 +1,68 @@
+'''
+Benchmark the cold import time of the vivisect/envi/vtrace/PE packages.
+
+Each import is timed in a fresh interpreter ( so nothing is cached in
+sys.modules ) and the best/median of several runs is reported along with
+the number of modules the import loaded.
+
+Usage: python -m vivisect.tools.importbench [options] [modname ...]
+'''
+import os
+import sys
+import json
+import optparse
+import subprocess
+
+default_mods = ('envi', 'vtrace', 'vivisect', 'PE')
+
+timecode = '''
+import sys, time, json
+start = time.time()
+import %s
+delta = time.time() - start
+sys.stdout.write(json.dumps([delta * 1000, len([m for m in sys.modules.values() if m != None])]))
+'''
+
+def timeImport(modname, python=sys.executable):
+    '''
+    Return a (milliseconds, module count) tuple for a cold import of
+    modname in a new interpreter.
+    '''
+    # Run from the directory *containing* our packages
+    basedir = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join([basedir, env.get('PYTHONPATH', '')])
+
+    proc = subprocess.Popen([python, '-c', timecode % modname], env=env, stdout=subprocess.PIPE)
+    output = proc.communicate()[0]
+    if proc.returncode != 0:
+        raise Exception('Importing %s failed!' % modname)
+
+    return tuple(json.loads(output))
+
+def main(argv):
+    parser = optparse.OptionParser(usage=__doc__.strip())
+    parser.add_option('--runs', dest='runs', type='int', default=10)
+    parser.add_option('--python', dest='python', default=sys.executable)
+    opts, args = parser.parse_args(argv)
+
+    modnames = args
+    if not modnames:
+        modnames = default_mods
+
+    # Warm up the .pyc files ( and the os file cache )
+    for modname in modnames:
+        timeImport(modname, python=opts.python)
+
+    print('    %-16s %10s %10s %8s' % ('module', 'best ms', 'median ms', 'modules'))
+    for modname in modnames:
+        times = []
+        for i in xrange(opts.runs):
+            msecs, modcount = timeImport(modname, python=opts.python)
+            times.append(msecs)
+
+        times.sort()
+        print('    %-16s %10.1f %10.1f %8d' % (modname, times[0], times[len(times) / 2], modcount))
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
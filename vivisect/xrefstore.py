@@ -0,0 +1,215 @@
+'''
+An indexed storage construct for workspace xref tuples.
+
+The XrefStore keeps the (fromva, tova, rtype, rflags) tuples in:
+
+    * a set of the live xrefs (for constant time dedupe / membership)
+    * an (add ordered) list of all the xrefs and one for each xref type
+    * "from" and "to" indexes of va: [ xrefs ]
+
+Each va index also keeps the address space carved into fixed size buckets
+of sorted vas, so the xrefs out of (or into) [va, va+size) are found with
+bisect rather than by walking every xref.
+
+Deleted xrefs are dropped from the add ordered lists lazily (the next
+time the list is read).
+'''
+import bisect
+
+# Vas in a va index bucket share the bits above this
+BUCKET_SHIFT = 16
+
+class VaIndex:
+    '''
+    A dict of va: [ xrefs ] which also answers range queries.
+    '''
+    def __init__(self, shift=BUCKET_SHIFT):
+        self._vi_shift = shift
+        self._vi_byva = {}
+        self._vi_buckets = {}   # bidx: sorted list of vas
+        self._vi_bidxs = []     # sorted list of non-empty bucket indexes
+
+    def add(self, va, xref):
+        xrefs = self._vi_byva.get(va)
+        if xrefs != None:
+            xrefs.append(xref)
+            return
+
+        self._vi_byva[va] = [ xref, ]
+
+        bidx = va >> self._vi_shift
+        bucket = self._vi_buckets.get(bidx)
+        if bucket == None:
+            bucket = []
+            self._vi_buckets[bidx] = bucket
+            bisect.insort(self._vi_bidxs, bidx)
+
+        bisect.insort(bucket, va)
+
+    def remove(self, va, xref):
+        xrefs = self._vi_byva[va]
+        xrefs.remove(xref)
+        if xrefs:
+            return
+
+        self._vi_byva.pop(va)
+
+        bidx = va >> self._vi_shift
+        bucket = self._vi_buckets[bidx]
+        bucket.pop(bisect.bisect_left(bucket, va))
+        if not bucket:
+            self._vi_buckets.pop(bidx)
+            self._vi_bidxs.pop(bisect.bisect_left(self._vi_bidxs, bidx))
+
+    def get(self, va):
+        return self._vi_byva.get(va)
+
+    def getRange(self, va, size):
+        '''
+        Return the (va ordered) list of xrefs for the vas in [va, va+size).
+        '''
+        ret = []
+        if size <= 0:
+            return ret
+
+        endva = va + size
+        byva = self._vi_byva
+        bidxs = self._vi_bidxs
+
+        pos = bisect.bisect_left(bidxs, va >> self._vi_shift)
+        while pos < len(bidxs):
+            bucket = self._vi_buckets[bidxs[pos]]
+            if bucket[0] >= endva:
+                break
+
+            i = bisect.bisect_left(bucket, va)
+            while i < len(bucket) and bucket[i] < endva:
+                ret.extend(byva[bucket[i]])
+                i += 1
+
+            pos += 1
+
+        return ret
+
+class XrefStore:
+
+    def __init__(self):
+        self._xr_live = set()
+        self._xr_lists = { None:[] }    # rtype (or None for all): [ xrefs ]
+        self._xr_dead = {}              # rtype (or None): count of deleted xrefs in the list
+        self._xr_from = VaIndex()
+        self._xr_to = VaIndex()
+
+    def __len__(self):
+        return len(self._xr_live)
+
+    def hasXref(self, xref):
+        return xref in self._xr_live
+
+    def addXref(self, xref):
+        '''
+        Add an xref tuple to the store (returns False if it already was).
+        '''
+        if xref in self._xr_live:
+            return False
+
+        self._xr_live.add(xref)
+
+        fromva, tova, rtype, rflags = xref
+        self._xr_from.add(fromva, xref)
+        self._xr_to.add(tova, xref)
+
+        xrefs = self._xr_lists.get(rtype)
+        if xrefs == None:
+            xrefs = []
+            self._xr_lists[rtype] = xrefs
+        xrefs.append(xref)
+        self._xr_lists[None].append(xref)
+        return True
+
+    def addXrefs(self, xrefs):
+        '''
+        Add a list of xref tuples ( for storage modules etc ).
+        '''
+        for xref in xrefs:
+            self.addXref(xref)
+
+    def delXref(self, xref):
+        '''
+        Remove an xref tuple from the store (raises KeyError if it isn't).
+        '''
+        self._xr_live.remove(xref)
+
+        fromva, tova, rtype, rflags = xref
+        self._xr_from.remove(fromva, xref)
+        self._xr_to.remove(tova, xref)
+        self._xr_dead[rtype] = self._xr_dead.get(rtype, 0) + 1
+        self._xr_dead[None] = self._xr_dead.get(None, 0) + 1
+
+    def _getListXrefs(self, rtype):
+        xrefs = self._xr_lists.get(rtype, [])
+        if self._xr_dead.pop(rtype, None):
+            # A re-added xref is live (but in the list twice) so only
+            # the last ( most recently added ) one is kept
+            live = self._xr_live
+            seen = set()
+            ret = []
+            for xref in reversed(xrefs):
+                if xref in live and xref not in seen:
+                    seen.add(xref)
+                    ret.append(xref)
+
+            ret.reverse()
+            xrefs[:] = ret
+
+        return xrefs
+
+    def getXrefs(self, rtype=None):
+        '''
+        Return the list of xref tuples (optionally of only the given type).
+        '''
+        if not rtype:
+            rtype = None
+        return list(self._getListXrefs(rtype))
+
+    def getXrefsFrom(self, va, rtype=None):
+        '''
+        Return the list of xrefs from the given va (optionally of only
+        the given type).
+        '''
+        xrefs = self._xr_from.get(va)
+        if xrefs == None:
+            return []
+        if rtype == None:
+            return xrefs
+        return [ xtup for xtup in xrefs if xtup[2] == rtype ]
+
+    def getXrefsTo(self, va, rtype=None):
+        '''
+        Return the list of xrefs to the given va (optionally of only
+        the given type).
+        '''
+        xrefs = self._xr_to.get(va)
+        if xrefs == None:
+            return []
+        if rtype == None:
+            return xrefs
+        return [ xtup for xtup in xrefs if xtup[2] == rtype ]
+
+    def getXrefsFromRange(self, va, size, rtype=None):
+        '''
+        Return the (fromva ordered) list of xrefs out of [va, va+size).
+        '''
+        xrefs = self._xr_from.getRange(va, size)
+        if rtype == None:
+            return xrefs
+        return [ xtup for xtup in xrefs if xtup[2] == rtype ]
+
+    def getXrefsToRange(self, va, size, rtype=None):
+        '''
+        Return the (tova ordered) list of xrefs into [va, va+size).
+        '''
+        xrefs = self._xr_to.getRange(va, size)
+        if rtype == None:
+            return xrefs
+        return [ xtup for xtup in xrefs if xtup[2] == rtype ]
@@ -1,7 +1,6 @@
 import struct
 
 from copy import deepcopy
-from inspect import isclass
 from StringIO import StringIO
 
 import vstruct.primitives as vs_prims
@@ -537,8 +536,11 @@ def resolvepath(impmod, pathstr):
     nameparts = pathstr.split('.')
     return resolve(impmod, nameparts)
 
-# NOTE: Gotta import this *after* VStruct/VSArray defined
-import vstruct.defs as vs_defs
+def _getDefs():
+    # vstruct.defs is imported on first use (it's large and must be
+    # imported *after* VStruct/VSArray are defined)
+    import vstruct.defs as vs_defs
+    return vs_defs
 
 def getStructure(sname):
     """
@@ -547,18 +549,20 @@ def getStructure(sname):
     addStructure() or a python path (ie. win32.TEB) of a
     definition from within vstruct.defs.
     """
-    x = resolve(vs_defs, sname.split("."))
+    x = resolve(_getDefs(), sname.split("."))
     if x != None:
         return x()
 
     return None
 
 def getModuleNames():
-    return [x for x in dir(vs_defs) if not x.startswith("__")]
+    return [x for x in dir(_getDefs()) if not x.startswith("__")]
 
 def getStructNames(modname):
+    from inspect import isclass
+
     ret = []
-    mod = resolve(vs_defs, modname)
+    mod = resolve(_getDefs(), modname)
     if mod == None:
         return ret
 
@@ -6,7 +6,6 @@ VStruct builder!  Used to serialize structure definitions etc...
 
 import copy
 import types
-import inspect
 import vstruct
 import vstruct.primitives as vs_prim
 
@@ -90,10 +89,12 @@ class VStructBuilder:
         if isinstance(nsmod, VStructBuilder):
             return nsmod.getVStructNames()
 
+        from inspect import isclass
+
         ret = []
         for name in dir(nsmod):
             nobj = getattr(nsmod, name)
-            if not inspect.isclass(nobj):
+            if not isclass(nobj):
                 continue
             if issubclass(nobj, vstruct.VStruct):
                 ret.append(name)
@@ -37,8 +37,6 @@ import types
 import struct
 import getopt
 import signal
-import inspect
-import platform
 import traceback
 
 import cPickle as pickle
@@ -49,7 +47,6 @@ import envi.memory as e_mem
 import envi.registers as e_reg
 import envi.expression as e_expr
 import envi.symstore.resolver as e_resolv
-import envi.symstore.symcache as e_symcache
 
 import cobra
 import vstruct
@@ -110,6 +107,76 @@ class AccessViolation(Exception):
         self.perm = perm
         Exception.__init__(self, "AccessViolation at 0x%.8x (%d)" % (va, perm))
 
+class TraceMemoryCache(e_mem.MemoryCache):
+    '''
+    A cache of the target memory pages read while a trace is stopped.
+
+    Pages come straight from the platform layer (missing pages for a
+    read are fetched in one platformReadMemoryRanges() call) and the
+    trace drops the whole cache before the target runs again.
+    '''
+    def __init__(self, trace, pagesize=4096, maxread=0x10000):
+        e_mem.MemoryCache.__init__(self, trace, pagesize=pagesize)
+        self.maxread = maxread
+
+    def _cachePage(self, va):
+        return self.mem.platformReadMemory(va, self.pagesize)
+
+    def _getMissingPages(self, va, size):
+        pageva = va & self.pagemask
+        return [ pva for pva in xrange(pageva, va + size, self.pagesize) if not self.pagecache.has_key(pva) ]
+
+    def cachePages(self, pagevas):
+        '''
+        Read the given (page aligned) addresses into the cache in
+        one shot.  Pages which can not be read are skipped.
+        '''
+        ranges = [ (pva, self.pagesize) for pva in pagevas ]
+        for pva, pbytes in zip(pagevas, self.mem.platformReadMemoryRanges(ranges)):
+            if pbytes != None:
+                self.pagecache[pva] = pbytes
+
+    def readMemory(self, va, size):
+        missing = self._getMissingPages(va, size)
+        if len(missing) > 1:
+            self.cachePages(missing)
+        return e_mem.MemoryCache.readMemory(self, va, size)
+
+    def readMemoryRanges(self, ranges):
+        '''
+        Return a list of bytes (or None for unreadable memory) for
+        each of the given (va, size) tuples.
+        '''
+        missing = set()
+        for va, size in ranges:
+            if size <= self.maxread:
+                missing.update(self._getMissingPages(va, size))
+
+        if missing:
+            self.cachePages(sorted(missing))
+
+        ret = []
+        for va, size in ranges:
+            if size > self.maxread:
+                ret.append(None)
+                continue
+
+            if self._getMissingPages(va, size):
+                ret.append(None)
+                continue
+
+            ret.append(e_mem.MemoryCache.readMemory(self, va, size))
+
+        return ret
+
+    def dropPages(self, va, size):
+        '''
+        Remove any cached pages which overlap the given range.
+        '''
+        pageva = va & self.pagemask
+        for pva in xrange(pageva, va + size, self.pagesize):
+            self.pagecache.pop(pva, None)
+
 class Trace(e_mem.IMemory, e_reg.RegisterContext, e_resolv.SymbolResolver, object):
     """
     The main tracer object.  A trace instance is dynamically generated using
@@ -139,9 +206,11 @@ class Trace(e_mem.IMemory, e_reg.RegisterContext, e_resolv.SymbolResolver, objec
         self.initMode("ThreadProxy", True, "Proxy necessary requests through a single thread (can deadlock...)")
         self.initMode("SingleStep", False, "All calls to run() actually just step.  This allows RunForever + SingleStep to step forever ;)")
         self.initMode("FastStep", False, "All stepi() will NOT generate a step event")
+        self.initMode("CacheMemory", True, "Cache pages of target memory while the target is stopped")
 
         self.regcache = None
         self.regcachedirty = False
+        self.memcache = None
         self.sus_threads = {}   # A dictionary of suspended threads
 
         # Set if we're a server and this trace is proxied
@@ -318,6 +387,7 @@ class Trace(e_mem.IMemory, e_reg.RegisterContext, e_resolv.SymbolResolver, objec
         self.attached = False
         self.pid = 0
         self.mapcache = None
+        self.memcache = None
 
     def release(self):
         '''
@@ -369,7 +439,14 @@ class Trace(e_mem.IMemory, e_reg.RegisterContext, e_resolv.SymbolResolver, objec
 
         r = e_resolv.SymbolResolver.getSymByAddr(self, addr, exact=exact)
         if r != None:
-            return r
+            # The nearest symbol may be a library we haven't parsed yet
+            if exact or r.symtype != e_resolv.SYMSTOR_SYM_MODULE:
+                return r
+
+            if not self._loadBinaryNorm(r.name):
+                return r
+
+            return e_resolv.SymbolResolver.getSymByAddr(self, addr, exact=exact)
 
         # See if we need to parse the file.
         mmap = self.getMemoryMap(addr)
@@ -434,6 +511,7 @@ class Trace(e_mem.IMemory, e_reg.RegisterContext, e_resolv.SymbolResolver, objec
 
         NOTE: vdb automatically handles this with a config option
         '''
+        import envi.symstore.symcache as e_symcache
         self.symcache = e_symcache.SymbolCachePath(path)
 
     def searchSymbols(self, regex, libname=None):
@@ -468,6 +546,14 @@ class Trace(e_mem.IMemory, e_reg.RegisterContext, e_resolv.SymbolResolver, objec
             threadid = self.getMeta("ThreadId")
         return self._cacheRegs(threadid)
 
+    def getRegisterContexts(self):
+        """
+        Retrieve a dictionary of threadid: RegisterContext for every
+        thread in the target process ( fetched together while stopped ).
+        """
+        self.requireNotRunning()
+        return dict(self._cacheAllRegs())
+
 #######################################################################
 #
 # We mirror the RegisterContext API using our own thread index based
@@ -496,6 +582,7 @@ class Trace(e_mem.IMemory, e_reg.RegisterContext, e_resolv.SymbolResolver, objec
         """
         self.requireNotRunning()
         self.mapcache = None # We may have a new memory map
+        self.memcache = None
         return self.platformAllocateMemory(size, perms=perms, suggestaddr=suggestaddr)
 
     def protectMemory(self, va, size, perms):
@@ -505,6 +592,7 @@ class Trace(e_mem.IMemory, e_reg.RegisterContext, e_resolv.SymbolResolver, objec
         """
         self.requireNotRunning()
         self.mapcache = None # We may have new memory protections
+        self.memcache = None
         return self.platformProtectMemory(va, size, perms)
 
     def readMemory(self, address, size):
@@ -513,15 +601,65 @@ class Trace(e_mem.IMemory, e_reg.RegisterContext, e_resolv.SymbolResolver, objec
         back as \x00s (this probably goes in a mixin soon)
         """
         self.requireNotRunning()
-        return self.platformReadMemory(long(address), long(size))
+        address = long(address)
+        size = long(size)
+
+        memcache = self._getMemCache()
+        if memcache == None or size > memcache.maxread:
+            return self.platformReadMemory(address, size)
+
+        try:
+            return memcache.readMemory(address, size)
+        except Exception:
+            # The whole page may not be readable even if the range is
+            return self.platformReadMemory(address, size)
+
+    def readMemoryRanges(self, ranges):
+        """
+        Read a list of (address, size) tuples from the trace in one shot.
+        Returns a list of the bytes for each range (or None where the
+        memory could not be read).
+
+        Example:
+            for bytez in trace.readMemoryRanges([(va1, 4), (va2, 16)]):
+                ...
+        """
+        self.requireNotRunning()
+        ranges = [ (long(va), long(size)) for va, size in ranges ]
+
+        memcache = self._getMemCache()
+        if memcache == None:
+            return self.platformReadMemoryRanges(ranges)
+
+        ret = memcache.readMemoryRanges(ranges)
+
+        # Anything the cache couldn't answer goes to the platform
+        todo = [ i for i in xrange(len(ret)) if ret[i] == None ]
+        if todo:
+            rbytes = self.platformReadMemoryRanges([ ranges[i] for i in todo ])
+            for i, bytez in zip(todo, rbytes):
+                ret[i] = bytez
+
+        return ret
 
     def writeMemory(self, address, bytez):
         """
         Write the given bytes to the address in the current trace.
         """
         self.requireNotRunning()
+        if self.memcache != None:
+            self.memcache.dropPages(address, len(bytez))
         self.platformWriteMemory(long(address), bytez)
 
+    def _getMemCache(self):
+        # Return the page cache for this stop (or None if disabled)
+        if not self.getMode("CacheMemory"):
+            return None
+
+        if self.memcache == None:
+            self.memcache = TraceMemoryCache(self)
+        return self.memcache
+
     def searchMemory(self, needle, regex=False):
         """
         Search all of process memory for a sequence of bytes.
@@ -850,6 +988,17 @@ class Trace(e_mem.IMemory, e_reg.RegisterContext, e_resolv.SymbolResolver, objec
             self.fds = self.platformGetFds()
         return self.fds
 
+    def takeSnapshot(self, filename=None):
+        """
+        Take a snapshot of the (stopped) trace and return a TraceSnapshot
+        for it.  Specify filename to stream the snapshot to disk rather
+        than holding the process memory in memory.
+        ( see vtrace.snapshot )
+        """
+        import vtrace.snapshot as vs_snap
+        self.requireNotRunning()
+        return vs_snap.takeSnapshot(self, filename=filename)
+
     def getMemoryMaps(self):
         """
         Return a list of the currently mapped memory for the target
@@ -1432,6 +1581,7 @@ def getTrace(target=None, **kwargs):
 
     # From here down, we're trying to build a trace for *this* platform!
 
+    import platform
     os_name = platform.system().lower() # Like "linux", "darwin","windows"
     arch = envi.getCurrentArch()
 
@@ -226,8 +226,8 @@ class SnapshotBreak(Breakpoint):
     """
     def notify(self, event, trace):
         exe = trace.getExe()
-        snap = trace.takeSnapshot()
-        snap.saveToFile("%s-%d.vsnap" % (exe, time.time()))
+        snap = trace.takeSnapshot(filename="%s-%d.vsnap" % (exe, time.time()))
+        snap.release()
         Breakpoint.notify(self, event, trace)
 
 class NiceBreakpoint(Breakpoint):
@@ -227,10 +227,12 @@ class TracerBase(vtrace.Notifier):
         Sync the reg-cache into the target process
         """
         if self.regcache != None:
-            for tid, ctx in self.regcache.items():
-                if ctx.isDirty():
-                    self.platformSetRegCtx(tid, ctx)
+            dirty = [ (tid, ctx) for tid, ctx in self.regcache.items() if ctx.isDirty() ]
+            if dirty:
+                self.platformSetRegCtxs(dirty)
         self.regcache = None
+        # The target is about to run, so the memory cache goes too
+        self.memcache = None
 
     def _cacheRegs(self, threadid):
         """
@@ -245,6 +247,22 @@ class TracerBase(vtrace.Notifier):
             self.regcache[threadid] = ret
         return ret
 
+    def _cacheAllRegs(self):
+        """
+        Make sure the reg-cache is populated for every thread (fetching
+        the missing ones in one platformGetRegCtxs call)
+        """
+        if self.regcache == None:
+            self.regcache = {}
+
+        tids = [ tid for tid in self.getThreads().keys() if tid not in self.regcache ]
+        if tids:
+            for tid, ctx in self.platformGetRegCtxs(tids):
+                ctx.setIsDirty(False)
+                self.regcache[tid] = ctx
+
+        return self.regcache
+
     def _checkForBreakpoint(self):
         """
         Check to see if we've landed on a breakpoint, and if so
@@ -798,6 +816,22 @@ class TracerBase(vtrace.Notifier):
     def platformSetRegCtx(self, threadid, ctx):
         raise Exception("Platform must implement platformSetRegCtx!")
 
+    def platformGetRegCtxs(self, threadids):
+        '''
+        Return a list of (threadid, ctx) tuples for the given threads.
+
+        Platforms which can fetch several register contexts at once (or
+        must proxy each fetch to another thread) should implement this.
+        '''
+        return [ (tid, self.platformGetRegCtx(tid)) for tid in threadids ]
+
+    def platformSetRegCtxs(self, ctxs):
+        '''
+        Set the register contexts for a list of (threadid, ctx) tuples.
+        '''
+        for tid, ctx in ctxs:
+            self.platformSetRegCtx(tid, ctx)
+
     def platformProtectMemory(self, va, size, perms):
         raise Exception("Plaform does not implement protect memory")
         
@@ -806,6 +840,20 @@ class TracerBase(vtrace.Notifier):
         
     def platformReadMemory(self, address, size):
         raise Exception("Platform must implement platformReadMemory!")
+
+    def platformReadMemoryRanges(self, ranges):
+        '''
+        Read a list of (address, size) tuples returning a list of bytes
+        (or None for ranges which could not be read).  Platforms which
+        can do vectored reads should over-ride this.
+        '''
+        ret = []
+        for address, size in ranges:
+            try:
+                ret.append(self.platformReadMemory(address, size))
+            except Exception:
+                ret.append(None)
+        return ret
         
     def platformWriteMemory(self, address, bytes):
         raise Exception("Platform must implement platformWriteMemory!")
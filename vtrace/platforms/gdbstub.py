@@ -95,14 +95,23 @@ gdb_reg_defs = {
 
 exit_types = ('X', 'W')
 
+# The max number of outstanding packets (once in no-ack mode)
+GDB_PIPELINE_DEPTH = 16
+
+# The most memory we will move in a single m/X packet
+GDB_MAX_XFER = 0x4000
+
+# Bytes which must be escaped in binary data
+binesc_re = re.compile('[#$}*]')
+
 def pkt(cmd):
     return '$%s#%.2x' % (cmd, csum(cmd))
 
 def csum(bytes):
-    sum = 0
-    for b in bytes:
-        sum += ord(b)
-    return sum & 0xff
+    return sum(bytearray(bytes)) & 0xff
+
+def binescape(bytes):
+    return binesc_re.sub(lambda m: '}' + chr(ord(m.group(0)) ^ 0x20), bytes)
 
 SIGINT  = 2
 SIGTRAP = 5
@@ -118,6 +127,7 @@ class GdbStubMixin:
         self._gdb_host = host
         self._gdb_port = port
         self._gdb_sock = None
+        self._gdb_rxbuf = ''
 
         self._gdb_tx_lock = threading.Lock()  # socket tx lock
         self._gdb_rx_lock = threading.Lock()  # socket rx lock
@@ -131,40 +141,65 @@ class GdbStubMixin:
         self._gdb_reg_xlat = []
         #self._gdb_regnames = []
 
+        # These get set by _gdbNegotiate (from the qSupported response)
+        self._gdb_pktsize = None    # the stub's max packet size (if known)
+        self._gdb_noack = False     # are we in QStartNoAckMode?
+        self._gdb_pipeline = 1      # max outstanding packets
+        self._gdb_binwrite = None   # does the stub support X packets?
+
+        self._gdb_regbytes = None   # the 'g' packet bytes for this stop
+
         self.stepping = False
         self.breaking = False
 
         self._gdbSetArch( self.getMeta('Architecture') )
 
+    def _recvMore(self):
+        # Must be called with the rx lock held
+        x = self._gdb_sock.recv(65536)
+        if len(x) == 0:
+            raise GdbServerDisconnected()
+        self._gdb_rxbuf += x
+
+    def _recvBytes(self, size):
+        # Must be called with the rx lock held
+        while len(self._gdb_rxbuf) < size:
+            self._recvMore()
+        ret = self._gdb_rxbuf[:size]
+        self._gdb_rxbuf = self._gdb_rxbuf[size:]
+        return ret
+
     def _recvUntil(self, c):
-        ret = ''
-        while not ret.endswith(c):
-            x = self._gdb_sock.recv(1)
-            if len(x) == 0:
+        # Must be called with the rx lock held
+        off = 0
+        i = self._gdb_rxbuf.find(c)
+        while i == -1:
+            off = len(self._gdb_rxbuf)
+            try:
+                self._recvMore()
+            except GdbServerDisconnected:
                 raise Exception('socket closed prematurely!')
-            ret += x
-        return ret
+            i = self._gdb_rxbuf.find(c, off)
+        return self._recvBytes(i + 1)
 
     def _recvPkt(self):
 
         with self._gdb_rx_lock:
 
-            b = self._gdb_sock.recv(1)
-            if len(b) == 0:
-                raise GdbServerDisconnected()
-
+            b = self._recvBytes(1)
             if b != '$':
                 raise Exception('Invalid Pkt Beginning! ->%s<-' % b)
 
             bytes = self._recvUntil('#')
             bytes = bytes[:-1]
 
-            isum = int(self._gdb_sock.recv(2), 16)
+            isum = int(self._recvBytes(2), 16)
             ssum = csum(bytes)
             if isum != ssum:
                 raise Exception('Invalid Checksum! his: 0x%.2x ours: 0x%.2x' % (isum, ssum))
 
-            self._gdb_sock.sendall('+')
+            if not self._gdb_noack:
+                self._gdb_sock.sendall('+')
 
             #print 'RECV: ->%s<-' % bytes
             return bytes
@@ -182,12 +217,40 @@ class GdbStubMixin:
             self._sendPkt(cmd)
             return self._recvPkt()
 
+    def _cmdTransactMany(self, cmds):
+        '''
+        Send a list of commands (keeping up to _gdb_pipeline of them
+        outstanding) and return the list of responses.
+        '''
+        if self._gdb_pipeline <= 1:
+            return [ self._cmdTransact(cmd) for cmd in cmds ]
+
+        ret = []
+        with self._gdb_tns_lock:
+            sent = 0
+            while len(ret) < len(cmds):
+                if sent < len(cmds):
+                    # Fill the pipeline with a single send
+                    todo = cmds[sent : len(ret) + self._gdb_pipeline]
+                    with self._gdb_tx_lock:
+                        self._gdb_sock.sendall(''.join([ pkt(cmd) for cmd in todo ]))
+                    sent += len(todo)
+
+                ret.append(self._recvPkt())
+
+        return ret
+
     def _sendPkt(self, cmd):
         #print 'SEND: ->%s<-' % cmd
         with self._gdb_tx_lock:
 
             self._gdb_sock.sendall(pkt(cmd))
-            b = self._gdb_sock.recv(1)
+            if self._gdb_noack:
+                return
+
+            with self._gdb_rx_lock:
+                b = self._recvBytes(1)
+
             if b != '+':
                 raise Exception('Retrans! ->%s<-' % b)
 
@@ -195,11 +258,17 @@ class GdbStubMixin:
         if self._gdb_sock != None:
             self._gdb_sock.shutdown(2)
 
+        self._gdb_rxbuf = ''
+        self._gdb_noack = False
+        self._gdb_pipeline = 1
+
         tries = 0
         while tries < 10:
             self._gdb_sock = socket.socket()
             try:
                 self._gdb_sock.connect( (self._gdb_host, self._gdb_port) )
+                # Lots of tiny packets and acks, don't let nagle hold them
+                self._gdb_sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
 
                 # Some gdb stubs seem to send/expect an initial '+'
                 try:
@@ -217,6 +286,40 @@ class GdbStubMixin:
                 time.sleep(0.2)
                 tries += 1
 
+    def _gdbNegotiate(self):
+        '''
+        Ask the stub what it supports (qSupported) and use bigger packets
+        and pipelined requests if we can.  Limited stubs (VMWare...) which
+        don't answer keep the old one-packet-at-a-time behavior.
+        '''
+        feats = {}
+        for feat in self._cmdTransact('qSupported').split(';'):
+            if feat.endswith('+'):
+                feats[feat[:-1]] = True
+            elif '=' in feat:
+                name, value = feat.split('=', 1)
+                feats[name] = value
+
+        psize = feats.get('PacketSize')
+        if psize:
+            self._gdb_pktsize = int(psize, 16)
+
+        if feats.get('QStartNoAckMode') and self._cmdTransact('QStartNoAckMode') == 'OK':
+            self._gdb_noack = True
+            self._gdb_pipeline = GDB_PIPELINE_DEPTH
+
+        # Whole page reads are too expensive one round trip at a time
+        if self._gdb_pipeline <= 1 and self._gdb_pktsize == None:
+            self.setMode('CacheMemory', False)
+
+    def _gdbReadSize(self):
+        # How much memory to ask for in each m packet
+        if self._gdb_pktsize == None:
+            # FIXME is this 256 problem just in the VMWare gdb stub?
+            return 256
+        # the response is hex (plus framing)
+        return max(1, min(GDB_MAX_XFER, (self._gdb_pktsize - 4) / 2))
+
     def _monitorCommand(self, cmd):
         resp = ''
         cmd = 'qRcmd,%s' % cmd.encode('hex')
@@ -231,6 +334,7 @@ class GdbStubMixin:
 
     def platformAttach(self, pid):
         self._connectSocket()
+        self._gdbNegotiate()
         self.attaching = True
         # Wait for the debug stub to stop the target
         while True:
@@ -251,11 +355,13 @@ class GdbStubMixin:
         cmd = 'c'
         if sig != None:
             cmd = 'C%.2x' % sig
+        self._gdb_regbytes = None
         self._sendPkt(cmd)
 
     def platformStepi(self):
         # FIXME by selected thread? and address?
         #self._cmdTransact('s')
+        self._gdb_regbytes = None
         self._sendPkt('s')
         self.stepping = True
 
@@ -432,8 +538,7 @@ class GdbStubMixin:
         '''
 
         # FIXME tid!
-        regbuf = self._cmdTransact('g')
-        regbytes = self._runLengthDecode(regbuf)
+        regbytes = self._gdbGetRegBytes()
         rvals = struct.unpack(self._gdb_regfmt, regbytes[:self._gdb_regsize])
         ctx = self.arch.archGetRegCtx()
 
@@ -449,15 +554,24 @@ class GdbStubMixin:
         Set the target stub's register context from the envi register context
         '''
         # FIXME tid!
-        regbytes = self._cmdTransact('g').decode('hex')
+        regbytes = self._gdbGetRegBytes()
         regremain = regbytes[self._gdb_regsize:]
         rvals = struct.unpack(self._gdb_regfmt, regbytes[:self._gdb_regsize])
         rvals = list(rvals) # So we can assign to them...
         for myidx, enviidx in self._gdb_reg_xlat:
             rvals[myidx] = ctx.getRegister(enviidx)
         newbytes = struct.pack(self._gdb_regfmt, rvals) + regremain
+        self._gdb_regbytes = None
         return self._cmdTransact('G'+newbytes.encode('hex'))
 
+    def _gdbGetRegBytes(self):
+        # The 'g' packet is only fetched once per stop
+        if self._gdb_regbytes == None:
+            regbuf = self._cmdTransact('g')
+            self._raiseIfError(regbuf)
+            self._gdb_regbytes = self._runLengthDecode(regbuf)
+        return self._gdb_regbytes
+
     def platformGetThreads(self):
 
         ret = {}
@@ -485,32 +599,101 @@ class GdbStubMixin:
     def _runLengthDecode(self, buf):
         # GDB RSP implements some run-length encoding to save space
         i = buf.find('*')
+        if i == -1:
+            return buf.decode('hex')
+
+        parts = []
+        last = 0
+        prev = ''
         while i != -1:
+            if i > last:
+                prev = buf[i-1]
+                parts.append(buf[last:i])
             cnt = ord(buf[i+1]) - 29 # Run-length encoding is minus 29...
-            pad = buf[i-1] * cnt
-            buf = buf[:i] + pad + buf[i+2:]
+            parts.append(prev * cnt)
+            last = i + 2
+            i = buf.find('*', last)
+
+        parts.append(buf[last:])
+        return ''.join(parts).decode('hex')
+
+    def _gdbReadRanges(self, ranges):
+        # Read a list of (addr, size) ranges with pipelined m packets.
+        # Returns a list of bytes for each range (or None if the stub
+        # sent back an error packet for any part of it).
+        chunk = self._gdbReadSize()
+
+        todo = []
+        for ridx, (addr, size) in enumerate(ranges):
+            for va in xrange(addr, addr + size, chunk):
+                todo.append( (ridx, va, min(chunk, addr + size - va)) )
+
+        parts = [ [] for r in ranges ]
+        errors = {}
+        while todo:
+            cmds = [ 'm%x,%x' % (va, csize) for ridx, va, csize in todo ]
+            retry = []
+            for (ridx, va, csize), resp in zip(todo, self._cmdTransactMany(cmds)):
+                # Check the raw packet (Enn) *before* decoding, valid
+                # hex memory is always an even number of characters.
+                if len(resp) == 0 or (resp[0] == 'E' and len(resp) == 3):
+                    errors[ridx] = resp
+                    continue
 
-            i = buf.find('*')
+                pbytes = self._runLengthDecode(resp)
+                parts[ridx].append( (va, pbytes) )
+                # Stubs may return less than we asked for...
+                if len(pbytes) < csize:
+                    retry.append( (ridx, va + len(pbytes), csize - len(pbytes)) )
 
-        return buf.decode('hex')
+            todo = [ t for t in retry if not errors.has_key(t[0]) ]
+
+        ret = []
+        for ridx, (addr, size) in enumerate(ranges):
+            if errors.has_key(ridx):
+                ret.append(None)
+                continue
+
+            parts[ridx].sort()
+            ret.append(''.join([ pbytes for va, pbytes in parts[ridx] ]))
+
+        return ret
 
     def platformReadMemory(self, addr, size):
-        mbytes = ''
-        offset = 0
         #print('READ: 0x%.8x (%d)' % (addr, size))
-        while len(mbytes) < size:
-            # FIXME is this 256 problem just in the VMWare gdb stub?
-            cmd = 'm%x,%x' % (addr + offset, min(256, size-offset))
-            pkt = self._cmdTransact(cmd)
-            self._raiseIfError(pkt)
-            pbytes = self._runLengthDecode(pkt)
-            offset += len(pbytes)
-            mbytes += pbytes
+        mbytes = self._gdbReadRanges([ (addr, size) ])[0]
+        if mbytes == None:
+            raise Exception('Error: memory read failed at 0x%.8x (%d)' % (addr, size))
         return mbytes
 
+    def platformReadMemoryRanges(self, ranges):
+        ret = []
+        for mbytes, (addr, size) in zip(self._gdbReadRanges(ranges), ranges):
+            if mbytes != None and len(mbytes) != size:
+                mbytes = None
+            ret.append(mbytes)
+        return ret
+
     def platformWriteMemory(self, addr, mbytes):
-        cmd = 'M%x,%x:%s' % (addr, len(mbytes), mbytes.encode('hex'))
-        pkt = self._cmdTransact(cmd)
+        # Try a binary X write the first time (stubs which don't support
+        # it will send back an empty response).
+        if self._gdb_binwrite == None:
+            self._gdb_binwrite = self._cmdTransact('X%x,0:' % addr) == 'OK'
+
+        chunk = len(mbytes)
+        if self._gdb_pktsize != None:
+            chunk = max(1, min(GDB_MAX_XFER, (self._gdb_pktsize - 32) / 2))
+
+        cmds = []
+        for off in xrange(0, len(mbytes), chunk):
+            cbytes = mbytes[off:off+chunk]
+            if self._gdb_binwrite:
+                cmds.append('X%x,%x:%s' % (addr + off, len(cbytes), binescape(cbytes)))
+            else:
+                cmds.append('M%x,%x:%s' % (addr + off, len(cbytes), cbytes.encode('hex')))
+
+        for resp in self._cmdTransactMany(cmds):
+            self._raiseIfError(resp)
 
     def platformGetMaps(self):
         # No way to enumerate these by default...
@@ -4,6 +4,7 @@ Linux Platform Module
 # Copyright (C) 2007 Invisigoth - See LICENSE file for details
 import os
 import time
+import errno
 import struct
 import signal
 import traceback
@@ -26,9 +27,9 @@ from ctypes import *
 import ctypes.util as cutil
 
 if os.getenv('ANDROID_ROOT'):
-    libc = CDLL('/system/lib/libc.so')
+    libc = CDLL('/system/lib/libc.so', use_errno=True)
 else:
-    libc = CDLL(cutil.find_library("c"))
+    libc = CDLL(cutil.find_library("c"), use_errno=True)
 
 libc.lseek64.restype = c_ulonglong
 libc.lseek64.argtypes = [c_uint, c_ulonglong, c_uint]
@@ -37,6 +38,21 @@ libc.read.argtypes = [c_uint, c_void_p, c_long]
 libc.write.restype = c_long
 libc.write.argtypes = [c_uint, c_void_p, c_long]
 
+class iovec(Structure):
+    _fields_ = [
+        ('iov_base', c_void_p),
+        ('iov_len',  c_size_t),
+    ]
+
+# process_vm_readv() is only in glibc >= 2.15 (linux >= 3.2)
+process_vm_readv = getattr(libc, 'process_vm_readv', None)
+if process_vm_readv != None:
+    process_vm_readv.restype = c_ssize_t
+    process_vm_readv.argtypes = [c_int, POINTER(iovec), c_ulong, POINTER(iovec), c_ulong, c_ulong]
+
+# The max number of iovec structures per process_vm_readv() call
+IOV_MAX = 1024
+
 O_RDWR = 2
 O_LARGEFILE = 0x8000
 
@@ -274,6 +290,63 @@ class LinuxMixin(v_posix.PtraceMixin, v_posix.PosixMixin):
         # We have to slice cause ctypes "helps" us by adding a null byte...
         return buf.raw
 
+    def platformReadMemoryRanges(self, ranges):
+        """
+        Use process_vm_readv() to read many ranges with one syscall.
+        (unlike ptrace this does not need to be on the tracer thread)
+        """
+        if process_vm_readv == None:
+            return v_base.TracerBase.platformReadMemoryRanges(self, ranges)
+
+        ret = []
+        for i in xrange(0, len(ranges), IOV_MAX):
+            ret.extend(self._readMemoryRangesV(ranges[i:i+IOV_MAX]))
+        return ret
+
+    def _readMemoryRangesV(self, ranges):
+        ret = []
+        while ranges:
+            count = len(ranges)
+            buf = create_string_buffer(sum([ size for va, size in ranges ]))
+            bufaddr = addressof(buf)
+
+            liov = (iovec * count)()
+            riov = (iovec * count)()
+
+            offset = 0
+            for i, (va, size) in enumerate(ranges):
+                liov[i].iov_base = bufaddr + offset
+                liov[i].iov_len = size
+                riov[i].iov_base = va
+                riov[i].iov_len = size
+                offset += size
+
+            x = process_vm_readv(self.pid, liov, count, riov, count, 0)
+            if x < 0 and get_errno() != errno.EFAULT:
+                # Not permitted (or not implemented), do it the slow way
+                ret.extend(v_base.TracerBase.platformReadMemoryRanges(self, ranges))
+                return ret
+
+            # Transfers stop at the first range which can't be read
+            # (which may still be readable through /proc/pid/mem)
+            raw = buf.raw
+            done = 0
+            offset = 0
+            for va, size in ranges:
+                if offset + size > x:
+                    break
+                ret.append(raw[offset:offset+size])
+                offset += size
+                done += 1
+
+            if done == count:
+                break
+
+            ret.extend(v_base.TracerBase.platformReadMemoryRanges(self, ranges[done:done+1]))
+            ranges = ranges[done+1:]
+
+        return ret
+
     @v_base.threadwrap
     def whynot_platformWriteMemory(self, address, data):
         """
@@ -628,6 +701,15 @@ class LinuxMixin(v_posix.PtraceMixin, v_posix.PosixMixin):
         ctx._rctx_Import(u)
         return ctx
 
+    @v_base.threadwrap
+    def platformGetRegCtxs(self, tids):
+        # One trip to the tracer thread for all of them
+        return v_base.TracerBase.platformGetRegCtxs(self, tids)
+
+    @v_base.threadwrap
+    def platformSetRegCtxs(self, ctxs):
+        return v_base.TracerBase.platformSetRegCtxs(self, ctxs)
+
     @v_base.threadwrap
     def platformSetRegCtx(self, tid, ctx):
         u = self.user_reg_struct()
@@ -90,6 +90,11 @@ class VMWare32WindowsTrace(
             pe = PE.peFromMemoryObject(self, baseaddr)
             vhash = e_symcache.symCacheHashFromPe(pe)
 
+            symfile = self.symcache.getCacheFile(vhash)
+            if symfile != None:
+                self.impSymCacheFile( symfile, symfname=normname, baseaddr=baseaddr )
+                return
+
             symcache = self.symcache.getCacheSyms(vhash)
             if symcache == None:
                 # Symbol type 0 for now...
@@ -1726,6 +1726,11 @@ class WindowsMixin:
         symhash = e_symcache.symCacheHashFromPe(pe)
 
         if self.symcache:
+            symfile = self.symcache.getCacheFile(symhash)
+            if symfile != None:
+                self.impSymCacheFile( symfile, symfname=normname, baseaddr=baseaddr)
+                return
+
             symcache = self.symcache.getCacheSyms(symhash)
             if symcache != None:
                 self.impSymCache( symcache, symfname=normname, baseaddr=baseaddr)
@@ -1,34 +1,56 @@
 '''
 All the code related to vtrace process snapshots and TraceSnapshot classes.
+
+Snapshots taken to a file ( takeSnapshot(trace, filename=...) ) use the
+version 2 format, which streams the memory maps to disk rather than
+holding them in memory:
+
+    header:     magic, info offset, info size
+    pages:      the readable runs ("extents") of each memory map, each
+                starting at a page aligned file offset
+    info:       a pickled dict of the threads, registers, maps, extents
+                (va, size, file offset), metadata etc
+
+Loading one mmaps the file, so memory reads are slices of the mapping.
 '''
+import os
 import sys
 import copy
+import mmap
+import struct
 import cPickle as pickle
 
 import envi
 import envi.memory as e_mem
+import envi.pagelookup as e_page
 import envi.symstore.resolver as e_resolv
 
 import vtrace
 import vtrace.platforms.base as v_base
 
+snap_magic = 'VSNAP002'
+snap_hdr = struct.Struct('<8sQQ')
+snap_pagesize = 4096
+snap_chunksize = 0x100000
+
 class TraceSnapshot(vtrace.Trace, v_base.TracerBase):
     '''
     A trace snapshot is similar to a traditional "core file" except that
     you may also have memory only snapshots that are never written to disk.
     '''
-    def __init__(self, snapdict):
+    def __init__(self, snapdict, memmap=None):
 
         self.s_snapcache = {}
         self.s_snapdict = snapdict
+        self.s_memmap = memmap
 
         # a seperate parser for each version...
-        if snapdict['version'] == 1:
+        if snapdict['version'] in (1, 2):
             self.s_version = snapdict['version']
             self.s_threads = snapdict['threads']
             self.s_regs = snapdict['regs']
             self.s_maps = snapdict['maps']
-            self.s_mem = snapdict['mem']
+            self.s_mem = snapdict.get('mem')
             self.metadata = snapdict['meta']
             self.s_stacktrace = snapdict['stacktrace']
             self.s_exe = snapdict['exe']
@@ -50,15 +72,25 @@ class TraceSnapshot(vtrace.Trace, v_base.TracerBase):
         rinfo = self.s_regs.items()[0][1]
         self.setRegisterInfo(rinfo)
 
-        #FIXME hard-coded page size!
-        self.s_map_lookup = {}
+        self.s_map_lookup = e_page.RangeLookup()
         for mmap in self.s_maps:
-            for i in range(mmap[0], mmap[0] + mmap[1], 4096):
-                self.s_map_lookup[i] = mmap
+            self.s_map_lookup.addRangeLookup(mmap[0], mmap[0] + mmap[1], mmap)
+
+        # The backed ranges of memory as [va, size, bytes, offset] lists
+        # ( bytes are the map string for version 1 and the mmap for 2 )
+        self.s_ext_lookup = e_page.RangeLookup()
+        if self.s_version == 1:
+            for mva, msize, mperms, mfname in self.s_maps:
+                mapbytes = self.s_mem.get(mva)
+                if mapbytes:
+                    self.s_ext_lookup.addRangeLookup(mva, mva + len(mapbytes), [mva, len(mapbytes), mapbytes, 0])
+        else:
+            for eva, esize, eoff in snapdict['extents']:
+                self.s_ext_lookup.addRangeLookup(eva, eva + esize, [eva, esize, memmap, eoff])
 
         # Lets get some symbol resolvers created for our libraries
         #for fname in self.getNormalizedLibNames():
-            #subres = e_resolv.FileSymbol(fname, 
+            #subres = e_resolv.FileSymbol(fname,
 
         self.running = False
         self.attached = True
@@ -71,23 +103,33 @@ class TraceSnapshot(vtrace.Trace, v_base.TracerBase):
         Save this snapshot to the given file like object
         for later reloading...
         '''
+        if self.s_version != 1:
+            raise Exception('ERROR: version %d snapshots may only be saved with saveToFile()' % self.s_version)
         pickle.dump(self.s_snapdict, fd)
 
     def saveToFile(self, filename):
         '''
         Save a snapshot to file for later reading in...
         '''
-        f = file(filename, 'wb')
-        self.saveToFd(f)
-        f.close()
+        if self.s_version == 1:
+            f = file(filename, 'wb')
+            self.saveToFd(f)
+            f.close()
+            return
 
-    def getMemoryMap(self, addr):
-        if self.getMeta('Architecture') == 'amd64':
-            base = addr & 0xfffffffffffff000
-        else:
-            base = addr & 0xfffff000
+        writeSnapshotFile(filename, self.s_snapdict, self.s_maps, self.platformReadMemory)
+
+    def platformRelease(self):
+        if self.s_memmap != None:
+            self.s_ext_lookup = e_page.RangeLookup()
+            self.s_memmap.close()
+            self.s_memmap = None
 
-        return self.s_map_lookup.get(base, None)
+    def getMemoryMap(self, addr):
+        rtup = self.s_map_lookup.getRangeLookup(addr)
+        if rtup == None:
+            return None
+        return rtup[2]
 
     def platformGetFds(self):
         return self.s_fds
@@ -114,31 +156,50 @@ class TraceSnapshot(vtrace.Trace, v_base.TracerBase):
     def platformGetThreads(self):
         return self.s_threads
 
-    def platformReadMemory(self, address, size):
+    def _getExtent(self, address):
+        rtup = self.s_ext_lookup.getRangeLookup(address)
+        if rtup != None:
+            return rtup[2]
+
         map = self.getMemoryMap(address)
         if map == None:
             raise Exception("ERROR: platformReadMemory says no map for 0x%.8x" % address)
-        offset = address - map[0] # Base address
-        mapbytes = self.s_mem.get(map[0], None)
-        if mapbytes == None:
-            raise vtrace.PlatformException("ERROR: Memory map at 0x%.8x is not backed!" % map[0])
-        if len(mapbytes) == 0:
-            raise vtrace.PlatformException("ERROR: Memory Map at 0x%.8x is backed by ''" % map[0])
-
-        ret = mapbytes[offset:offset+size]
-        rlen = len(ret)
-        # We may have a cross-map read, just recurse for the rest
-        if rlen != size:
-            ret += self.platformReadMemory(address+rlen, size-rlen)
-        return ret
+        raise vtrace.PlatformException("ERROR: Memory map at 0x%.8x is not backed!" % map[0])
+
+    def platformReadMemory(self, address, size):
+        ret = []
+        while True:
+            eva, esize, ebytes, eoff = self._getExtent(address)
+            offset = eoff + address - eva
+            chunk = min(size, esize - (address - eva))
+
+            bytez = ebytes[offset:offset+chunk]
+            if chunk == size and not ret:
+                return bytez
+
+            ret.append(bytez)
+            # We may have a cross-map read
+            address += chunk
+            size -= chunk
+            if size <= 0:
+                return ''.join(ret)
 
     def platformWriteMemory(self, address, bytes):
-        map = self.getMemoryMap(address)
-        if map == None:
-            raise Exception("ERROR: platformWriteMemory says no map for 0x%.8x" % address)
-        offset = address - map[0]
-        mapbytes = self.s_mem[map[0]]
-        self.s_mem[map[0]] = mapbytes[:offset] + bytes + mapbytes[offset+len(bytes):]
+        while bytes:
+            ext = self._getExtent(address)
+            eva, esize, ebytes, eoff = ext
+            offset = eoff + address - eva
+            chunk = min(len(bytes), esize - (address - eva))
+
+            if self.s_version == 1:
+                ext[2] = ebytes[:offset] + bytes[:chunk] + ebytes[offset+chunk:]
+                self.s_mem[eva] = ext[2]
+            else:
+                # The mapping is copy on write ( the file is not changed )
+                ebytes[offset:offset+chunk] = bytes[:chunk]
+
+            address += chunk
+            bytes = bytes[chunk:]
 
     def platformDetach(self):
         pass
@@ -156,34 +217,150 @@ class TraceSnapshot(vtrace.Trace, v_base.TracerBase):
     def syncRegs(self):
         pass
 
-def loadSnapshot(filename):
+def _iterReadable(readfunc, va, size):
+    # Yield (va, bytes) for the readable runs of [va, va+size) ( a page at
+    # a time when a whole chunk can not be read )
+    endva = va + size
+    while va < endva:
+        csize = min(snap_chunksize, endva - va)
+        try:
+            yield va, readfunc(va, csize)
+        except Exception, e:
+            pva = va
+            while pva < va + csize:
+                psize = min(snap_pagesize - (pva % snap_pagesize), va + csize - pva)
+                try:
+                    yield pva, readfunc(pva, psize)
+                except Exception, e:
+                    pass
+                pva += psize
+
+        va += csize
+
+def writeSnapshotFile(filename, snapinfo, maps, readfunc):
     '''
-    Load a vtrace process snapshot from a file
+    Write a version 2 snapshot file from the snapinfo dict ( the same
+    keys as a version 1 snapshot without 'mem' ).  The bytes for the
+    (va, size, perms, fname) maps are read using readfunc(va, size) and
+    streamed directly to the file.
     '''
-    sfile = file(filename, "rb")
-    snapdict = pickle.load(sfile)
-    return TraceSnapshot(snapdict)
+    info = dict(snapinfo)
+    info.pop('mem', None)
+    info['version'] = 2
+
+    # Write a new file and move it into place ( the old one may be mapped )
+    tmpname = '%s.%d.tmp' % (filename, os.getpid())
+    fd = file(tmpname, 'wb')
+    try:
+        fd.write(snap_hdr.pack(snap_magic, 0, 0))
+
+        extents = []
+        snapmaps = []
+        offset = snap_hdr.size
+        for mtup in maps:
+            mva, msize, mperms, mfname = mtup
+
+            mapext = []
+            for va, bytez in _iterReadable(readfunc, mva, msize):
+                if mapext and mapext[-1][0] + mapext[-1][1] == va:
+                    mapext[-1][1] += len(bytez)
+                else:
+                    # Each extent starts on a page in the file
+                    pad = -offset % snap_pagesize
+                    fd.write('\x00' * pad)
+                    offset += pad
+                    mapext.append( [va, len(bytez), offset] )
+
+                fd.write(bytez)
+                offset += len(bytez)
+
+            if not mapext:
+                print >> sys.stderr, "WARNING: Can't snapshot memmap at 0x%.8x" % mva
+                continue
+
+            if mapext[0][0] != mva or len(mapext) > 1 or mapext[0][1] != msize:
+                print >> sys.stderr, "WARNING: Partial snapshot of memmap at 0x%.8x" % mva
+
+            snapmaps.append(mtup)
+            extents.extend([ tuple(ext) for ext in mapext ])
+
+        info['maps'] = snapmaps
+        info['extents'] = extents
+
+        infobytes = pickle.dumps(info, protocol=2)
+        fd.write(infobytes)
+        fd.seek(0)
+        fd.write(snap_hdr.pack(snap_magic, offset, len(infobytes)))
+
+    finally:
+        fd.close()
+
+    try:
+        os.rename(tmpname, filename)
+    except OSError, e:
+        os.unlink(filename)
+        os.rename(tmpname, filename)
 
-def takeSnapshot(trace):
+def loadSnapshot(filename):
     '''
-    Take a snapshot of the process from the current state and return
-    a reference to a tracer which wraps a "snapshot" or "core file".
+    Load a vtrace process snapshot from a file
     '''
+    sfile = file(filename, "rb")
+    try:
+        magic, infooff, infosize = snap_hdr.unpack(sfile.read(snap_hdr.size).ljust(snap_hdr.size))
+        if magic != snap_magic:
+            sfile.seek(0)
+            snapdict = pickle.load(sfile)
+            return TraceSnapshot(snapdict)
+
+        sfile.seek(infooff)
+        snapdict = pickle.loads(sfile.read(infosize))
+        memmap = mmap.mmap(sfile.fileno(), 0, access=mmap.ACCESS_COPY)
+        return TraceSnapshot(snapdict, memmap=memmap)
+
+    finally:
+        sfile.close()
+
+def _getSnapInfo(trace):
+    # Everything but the memory for a snapshot of the trace
     sd = dict()
-    orig_thread = trace.getMeta("ThreadId")
 
     regs = dict()
     stacktrace = dict()
 
-    for thrid,tdata in trace.getThreads().items():
-        ctx = trace.getRegisterContext(thrid)
-        reginfo = ctx.getRegisterInfo()
-        regs[thrid] = reginfo
+    # All the threads' registers are fetched together
+    for thrid, ctx in trace.getRegisterContexts().items():
+        regs[thrid] = ctx.getRegisterInfo()
         try:
             stacktrace[thrid] = trace.getStackTrace()
         except Exception, msg:
             print >> sys.stderr, "WARNING: Failed to get stack trace for thread 0x%.8x" % thrid
 
+    sd['threads'] = trace.getThreads()
+    sd['regs'] = regs
+    sd['meta'] = copy.deepcopy(trace.metadata)
+    sd['stacktrace'] = stacktrace
+    sd['exe'] = trace.getExe()
+    sd['fds'] = trace.getFds()
+    sd['vars'] = trace.localvars
+    return sd
+
+def takeSnapshot(trace, filename=None):
+    '''
+    Take a snapshot of the process from the current state and return
+    a reference to a tracer which wraps a "snapshot" or "core file".
+
+    If filename is specified, the memory maps are streamed to the
+    snapshot file ( rather than held in memory ) and the returned
+    snapshot is loaded from it.
+    '''
+    sd = _getSnapInfo(trace)
+
+    if filename != None:
+        # Read around the memory cache ( it would hold every page )
+        writeSnapshotFile(filename, sd, trace.getMemoryMaps(), trace.platformReadMemory)
+        return loadSnapshot(filename)
+
     mem = dict()
     maps = []
     for base,size,perms,fname in trace.getMemoryMaps():
@@ -195,14 +372,7 @@ def takeSnapshot(trace):
 
     # If the contents here change, change the version...
     sd['version'] = 1
-    sd['threads'] = trace.getThreads()
-    sd['regs'] = regs
     sd['maps'] = maps
     sd['mem'] = mem
-    sd['meta'] = copy.deepcopy(trace.metadata)
-    sd['stacktrace'] = stacktrace
-    sd['exe'] = trace.getExe()
-    sd['fds'] = trace.getFds()
-    sd['vars'] = trace.localvars
 
     return TraceSnapshot(snapdict=sd)
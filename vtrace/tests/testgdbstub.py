@@ -0,0 +1,169 @@
+import socket
+import struct
+import unittest
+import threading
+
+import vtrace.platforms.gdbstub as vt_gdbstub
+
+class FakeGdbServer:
+    '''
+    A minimal stand-in for a gdbserver stub (over a memory buffer).
+
+    A "limited" server acts like the VMWare stub: no qSupported, no
+    binary writes and at most 256 bytes per m packet.
+    '''
+    def __init__(self, limited=False):
+        self.limited = limited
+        self.membase = 0x41410000
+        self.mem = bytearray(''.join([ chr(i & 0xff) for i in xrange(0x10000) ]))
+        self.regs = struct.pack('<16I', *range(16))
+        self.cmds = []
+        self.noack = False
+
+        self.sock = socket.socket()
+        self.sock.bind(('127.0.0.1', 0))
+        self.sock.listen(1)
+        self.port = self.sock.getsockname()[1]
+
+        thr = threading.Thread(target=self.serve)
+        thr.setDaemon(True)
+        thr.start()
+
+    def recvPkt(self, fd):
+        c = fd.read(1)
+        while c == '+':
+            c = fd.read(1)
+        if c != '$':
+            return None
+
+        bytez = ''
+        c = fd.read(1)
+        while c != '#':
+            bytez += c
+            c = fd.read(1)
+
+        fd.read(2)
+        if not self.noack:
+            self.conn.sendall('+')
+
+        return bytez
+
+    def sendPkt(self, bytez):
+        self.conn.sendall(vt_gdbstub.pkt(bytez))
+
+    def unescape(self, bytez):
+        ret = ''
+        i = 0
+        while i < len(bytez):
+            if bytez[i] == '}':
+                ret += chr(ord(bytez[i+1]) ^ 0x20)
+                i += 2
+                continue
+            ret += bytez[i]
+            i += 1
+        return ret
+
+    def serve(self):
+        self.conn, addr = self.sock.accept()
+        self.conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.conn.sendall('+')
+        fd = self.conn.makefile('rb')
+        while True:
+            cmd = self.recvPkt(fd)
+            if cmd == None:
+                return
+
+            self.cmds.append(cmd[0])
+            self.sendPkt(self.handle(cmd))
+            if cmd == 'QStartNoAckMode':
+                self.noack = True
+
+    def handle(self, cmd):
+        if cmd == 'qSupported':
+            if self.limited:
+                return ''
+            return 'PacketSize=4000;QStartNoAckMode+'
+
+        if cmd == 'QStartNoAckMode':
+            return 'OK'
+
+        if cmd == 'g':
+            return self.regs.encode('hex')
+
+        if cmd[0] == 'm':
+            addr, size = [ int(x, 16) for x in cmd[1:].split(',') ]
+            if self.limited:
+                size = min(size, 256)
+            off = addr - self.membase
+            if off < 0 or off >= len(self.mem):
+                return 'E01'
+            return str(self.mem[off:off+size]).encode('hex')
+
+        if cmd[0] in ('M', 'X'):
+            if cmd[0] == 'X' and self.limited:
+                return ''
+
+            hdr, bytez = cmd[1:].split(':', 1)
+            addr, size = [ int(x, 16) for x in hdr.split(',') ]
+            if cmd[0] == 'X':
+                bytez = self.unescape(bytez)
+            else:
+                bytez = bytez.decode('hex')
+
+            off = addr - self.membase
+            self.mem[off:off+size] = bytez
+            return 'OK'
+
+        return ''
+
+class GdbStubTest(unittest.TestCase):
+
+    def getTrace(self, limited=False):
+        server = FakeGdbServer(limited=limited)
+        trace = vt_gdbstub.GdbStubTrace('i386')
+        self.addCleanup(trace.release)
+        trace._gdb_host = '127.0.0.1'
+        trace._gdb_port = server.port
+        trace._connectSocket()
+        trace._gdbNegotiate()
+        return server, trace
+
+    def checkMemory(self, server, trace):
+        base = server.membase
+        mbytes = str(server.mem)
+
+        self.assertEqual(trace.platformReadMemory(base + 3, 0x3000), mbytes[3:0x3003])
+        self.assertRaises(Exception, trace.platformReadMemory, base - 0x1000, 4)
+
+        ranges = [ (base, 4), (base - 0x1000, 4), (base + 0x2000, 0x1001) ]
+        self.assertEqual(trace.platformReadMemoryRanges(ranges), [ mbytes[:4], None, mbytes[0x2000:0x3001] ])
+
+        # memory which happens to start with 'E' is not an error packet
+        self.assertEqual(trace.platformReadMemory(base + 0x45, 4), 'EFGH')
+        ranges = [ (base + 0x45, 3), (base - 0x1000, 3) ]
+        self.assertEqual(trace.platformReadMemoryRanges(ranges), [ 'EFG', None ])
+
+        wbytes = '#$}*' * 0x400 + 'woot'
+        trace.platformWriteMemory(base + 0x10, wbytes)
+        self.assertEqual(trace.platformReadMemory(base + 0x10, len(wbytes)), wbytes)
+
+        # registers are fetched once per stop
+        ctx = trace.platformGetRegCtx(0)
+        ctx = trace.platformGetRegCtx(0)
+        self.assertEqual(ctx.getRegisterByName('ecx'), 1)
+        self.assertEqual(server.cmds.count('g'), 1)
+
+    def test_gdbstub_pipelined(self):
+        server, trace = self.getTrace()
+        self.assertTrue(trace._gdb_noack)
+        self.assertEqual(trace._gdb_pktsize, 0x4000)
+        self.checkMemory(server, trace)
+        self.assertTrue(trace._gdb_binwrite)
+
+    def test_gdbstub_limited(self):
+        server, trace = self.getTrace(limited=True)
+        self.assertFalse(trace._gdb_noack)
+        self.assertFalse(trace.getMode('CacheMemory'))
+        self.checkMemory(server, trace)
+        self.assertFalse(trace._gdb_binwrite)
+        self.assertTrue('M' in server.cmds)
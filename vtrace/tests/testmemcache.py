@@ -0,0 +1,45 @@
+import unittest
+
+import envi
+import vtrace.snapshot as vs_snap
+
+class VtraceMemCacheTest(unittest.TestCase):
+
+    def getSnapshot(self):
+        emu = envi.getArchModule('i386').getEmulator()
+        snapdict = {
+            'version':1,
+            'threads':{1:0},
+            'regs':{1:emu.getRegisterInfo()},
+            'maps':[ (0x1000, 0x2000, 7, 'woot'), ],
+            'mem':{ 0x1000:'A' * 0x1000 + 'B' * 0x1000 },
+            'meta':{'Architecture':'i386', 'ThreadId':1},
+            'stacktrace':{},
+            'exe':'woot',
+            'fds':[],
+        }
+        trace = vs_snap.TraceSnapshot(snapdict)
+        self.addCleanup(trace.release)
+        return trace
+
+    def test_vtrace_memcache(self):
+        trace = self.getSnapshot()
+
+        self.assertEqual(trace.readMemory(0x1ffe, 4), 'AABB')
+        self.assertEqual(sorted(trace.memcache.pagecache.keys()), [0x1000, 0x2000])
+
+        ranges = [ (0x1000, 2), (0x5000, 4), (0x2ffe, 2) ]
+        self.assertEqual(trace.readMemoryRanges(ranges), ['AA', None, 'BB'])
+
+        # writes go through and drop the pages they touch
+        trace.writeMemory(0x1fff, 'CC')
+        self.assertEqual(trace.readMemory(0x1ffe, 4), 'ACCB')
+
+        # running (or stepping) the target drops the cache
+        trace._syncRegs()
+        self.assertIsNone(trace.memcache)
+
+        trace.setMode('CacheMemory', False)
+        self.assertEqual(trace.readMemory(0x1ffe, 4), 'ACCB')
+        self.assertEqual(trace.readMemoryRanges(ranges), ['AA', None, 'BB'])
+        self.assertIsNone(trace.memcache)
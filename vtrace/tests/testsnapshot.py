@@ -0,0 +1,75 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import envi
+import vtrace.snapshot as vs_snap
+
+class VtraceSnapshotTest(unittest.TestCase):
+
+    def getSnapshot(self):
+        emu = envi.getArchModule('i386').getEmulator()
+        emu.setRegisterByName('eax', 0x41414141)
+        snapdict = {
+            'version':1,
+            'threads':{1:0, 2:0},
+            'regs':{1:emu.getRegisterInfo(), 2:emu.getRegisterInfo()},
+            'maps':[ (0x1000, 0x2000, 7, 'woot'), (0x3000, 0x1000, 7, 'woot'), (0x10000, 0x3000, 7, 'part') ],
+            # the last map is only partially backed
+            'mem':{ 0x1000:'A' * 0x1000 + 'B' * 0x1000, 0x3000:'C' * 0x1000, 0x10000:'D' * 0x2000 },
+            'meta':{'Architecture':'i386', 'ThreadId':1},
+            'stacktrace':{1:[], 2:[]},
+            'exe':'woot',
+            'fds':[],
+        }
+        trace = vs_snap.TraceSnapshot(snapdict)
+        self.addCleanup(trace.release)
+        return trace
+
+    def test_vtrace_snapshot_file(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        filename = os.path.join(tmpdir, 'woot.vsnap')
+
+        trace = self.getSnapshot()
+        self.assertEqual(sorted(trace.getRegisterContexts().keys()), [1, 2])
+
+        snap = trace.takeSnapshot(filename=filename)
+        self.addCleanup(snap.release)
+
+        self.assertEqual(snap.s_version, 2)
+        self.assertEqual(snap.getMemoryMaps(), trace.getMemoryMaps())
+        self.assertEqual(snap.getRegisterContext(2).getRegisterByName('eax'), 0x41414141)
+
+        # cross map reads
+        self.assertEqual(snap.platformReadMemory(0x1ffe, 4), 'AABB')
+        self.assertEqual(snap.platformReadMemory(0x2fff, 2), 'BC')
+        self.assertEqual(snap.readMemory(0x1000, 0x3000), trace.readMemory(0x1000, 0x3000))
+
+        # only the readable pages of a map are saved
+        self.assertEqual(snap.platformReadMemory(0x10000, 0x2000), 'D' * 0x2000)
+        self.assertRaises(Exception, snap.platformReadMemory, 0x11ffe, 4)
+        self.assertRaises(Exception, snap.platformReadMemory, 0x20000, 4)
+
+        # writes change the snapshot but not the file
+        snap.writeMemory(0x1fff, 'VV')
+        self.assertEqual(snap.readMemory(0x1ffe, 4), 'AVVB')
+
+        snap2 = vs_snap.loadSnapshot(filename)
+        self.addCleanup(snap2.release)
+        self.assertEqual(snap2.readMemory(0x1ffe, 4), 'AABB')
+
+        # save the modified snapshot over the file it was loaded from
+        snap.saveToFile(filename)
+        snap3 = vs_snap.loadSnapshot(filename)
+        self.addCleanup(snap3.release)
+        self.assertEqual(snap3.readMemory(0x1ffe, 4), 'AVVB')
+        self.assertEqual(snap3.readMemory(0x10000, 0x2000), 'D' * 0x2000)
+
+        # version 1 snapshots are still loaded from their pickles
+        trace.saveToFile(filename)
+        snap4 = vs_snap.loadSnapshot(filename)
+        self.addCleanup(snap4.release)
+        self.assertEqual(snap4.s_version, 1)
+        self.assertEqual(snap4.readMemory(0x2fff, 2), 'BC')